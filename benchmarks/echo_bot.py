@@ -0,0 +1,36 @@
+import struct
+import sys
+
+# answers instantly with full thrust towards the checkpoint,
+# used to measure the cost of the strategy protocols themselves
+stdin = sys.stdin.buffer
+stdout = sys.stdout.buffer
+first_line = stdin.readline()
+if first_line == b'mad_pod binary 1\n':
+    stdout.write(b'binary 1\n')
+    stdout.flush()
+    while len(header := stdin.read(4)) == 4:
+        length, = struct.unpack('<I', header)
+        x, y, next_checkpoint_x, next_checkpoint_y = struct.unpack_from('<4i', stdin.read(length))
+        stdout.write(struct.pack('<I3i', 12, next_checkpoint_x, next_checkpoint_y, 100))
+        stdout.flush()
+elif first_line == b'mad_pod multi 1\n':
+    stdout.write(b'multi 1\n')
+    stdout.flush()
+    while len(header := stdin.read(4)) == 4:
+        length, = struct.unpack('<I', header)
+        payload = stdin.read(length)
+        count, = struct.unpack_from('<I', payload)
+        answer = [struct.pack('<II', 4 + 16 * count, count)]
+        for game_id, x, y, next_checkpoint_x, next_checkpoint_y in struct.iter_unpack('<I4i16x', payload[4:]):
+            answer.append(struct.pack('<I3i', game_id, next_checkpoint_x, next_checkpoint_y, 100))
+        stdout.write(b''.join(answer))
+        stdout.flush()
+else:
+    line = first_line
+    while line:
+        x, y, next_checkpoint_x, next_checkpoint_y, next_checkpoint_dist, next_checkpoint_angle = line.split()
+        stdin.readline()
+        stdout.write(next_checkpoint_x + b' ' + next_checkpoint_y + b' 100\n')
+        stdout.flush()
+        line = stdin.readline()
@@ -0,0 +1,306 @@
+# Reproducible benchmarks of the simulation hot paths and the strategy protocol.
+#   python -m benchmarks.run -o baseline.json        store a baseline
+#   python -m benchmarks.run -b baseline.json -t 0.1  fail when anything got more than 10% slower
+from typing import Callable, Optional
+from dataclasses import dataclass, asdict
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+from mad_pod.simulation.game import Game
+from mad_pod.simulation.pod_physics import PodControl
+from mad_pod.strategy_communication.communication import Strategy
+from mad_pod.strategy_communication.multiplex import MultiStrategy
+from mad_pod.strategy_communication.messages import StrategyInput, StrategyOutput
+from mad_pod.strategy_communication.binary import encode_input, decode_output, encode_output
+
+SEED = 12345
+POD_COUNTS = [2, 4, 16, 64]
+ECHO_BOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'echo_bot.py')
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    # best of the repeats, in nanoseconds per operation
+    ns_per_op: float
+    ops: int
+
+    @property
+    def ops_per_sec(self) -> float:
+        return 1e9 / self.ns_per_op
+
+
+def measure(name: str, setup: Callable[[], Callable[[], int]], repeat: int) -> BenchmarkResult:
+    # setup builds a fresh fixture and returns a function that runs a batch and returns the number of ops in it
+    best = float('inf')
+    ops = 0
+    for _ in range(repeat):
+        run = setup()
+        start = time.perf_counter()
+        ops = run()
+        elapsed = time.perf_counter() - start
+        best = min(best, elapsed / ops)
+    return BenchmarkResult(name=name, ns_per_op=best * 1e9, ops=ops)
+
+
+def create_game(number_of_pods: int) -> Game:
+    return Game.create(number_of_pods, 4, SEED)
+
+
+def chase_outputs(game: Game) -> list[StrategyOutput]:
+    return [
+        StrategyOutput(target_pos=game.get_strategy_input(i).checkpoint_pos, thrust=100)
+        for i in range(len(game.pods))
+    ]
+
+
+def bench_game_step(number_of_pods: int, steps: int) -> Callable[[], int]:
+    game = create_game(number_of_pods)
+    # the controls are computed up front from a reference run, so only Game.step is timed
+    reference = create_game(number_of_pods)
+    outputs = []
+    for _ in range(steps):
+        outputs.append(chase_outputs(reference))
+        reference.step(outputs[-1])
+    def run() -> int:
+        for strategy_outputs in outputs:
+            game.step(strategy_outputs)
+        return steps * number_of_pods
+    return run
+
+
+def bench_pods_move(number_of_pods: int, steps: int) -> Callable[[], int]:
+    game = create_game(number_of_pods)
+    pod_controls = [PodControl(thrust=100.0, target_angle=0.5 * i) for i in range(number_of_pods)]
+    def run() -> int:
+        for _ in range(steps):
+            game.pods.move(pod_controls)
+        return steps * number_of_pods
+    return run
+
+
+def bench_get_strategy_input(number_of_pods: int, steps: int) -> Callable[[], int]:
+    game = create_game(number_of_pods)
+    def run() -> int:
+        for _ in range(steps):
+            for i in range(number_of_pods):
+                game.get_strategy_input(i)
+        return steps * number_of_pods
+    return run
+
+
+def bench_snapshot_restore(number_of_pods: int, steps: int) -> Callable[[], int]:
+    # the clone-step-rollback cycle of search-based bots
+    game = create_game(number_of_pods)
+    strategy_outputs = chase_outputs(game)
+    def run() -> int:
+        for _ in range(steps):
+            snapshot = game.snapshot()
+            game.step(strategy_outputs)
+            game.restore(snapshot)
+        return steps
+    return run
+
+
+SAMPLE_INPUT = StrategyInput(
+    pod_pos=(1234, 5678),
+    checkpoint_pos=(9012, 3456),
+    checkpoint_dist=7890,
+    checkpoint_angle=-123,
+    enemy_pos=(4567, 8901)
+)
+
+
+def bench_serialize(count: int, protocol: str = 'text') -> Callable[[], int]:
+    encode = encode_input if protocol == 'binary' else StrategyInput.serialize
+    def run() -> int:
+        for _ in range(count):
+            encode(SAMPLE_INPUT)
+        return count
+    return run
+
+
+def bench_deserialize(count: int, protocol: str = 'text') -> Callable[[], int]:
+    if protocol == 'binary':
+        # without the length prefix, like the reader thread passes it
+        raw = encode_output(StrategyOutput(target_pos=(9012, 3456), thrust='BOOST'))[4:]
+        decode = decode_output
+    else:
+        raw = b'9012 3456 BOOST\n'
+        decode = StrategyOutput.deserialize
+    def run() -> int:
+        for _ in range(count):
+            decode(raw)
+        return count
+    return run
+
+
+def bench_react_round_trip(turns: int, protocol: str = 'text') -> Callable[[], int]:
+    strategy = Strategy(f'"{sys.executable}" "{ECHO_BOT}"', protocol=protocol)
+    game = create_game(1)
+    strategy_input = game.get_strategy_input(0)
+    # the first answer includes the process start, it is not timed
+    strategy.react(strategy_input)
+    def run() -> int:
+        try:
+            for _ in range(turns):
+                strategy.react(strategy_input)
+        finally:
+            strategy.stop()
+        return turns
+    return run
+
+
+def bench_react_round_trip_multi(turns: int, games: int) -> Callable[[], int]:
+    # one process answering a tick of many games, ops are game turns
+    strategy = MultiStrategy(f'"{sys.executable}" "{ECHO_BOT}"')
+    game = create_game(1)
+    strategy_inputs = {game_id: game.get_strategy_input(0) for game_id in range(games)}
+    strategy.begin_react_batch(strategy_inputs)
+    strategy.end_react_batch()
+    def run() -> int:
+        try:
+            for _ in range(turns):
+                strategy.begin_react_batch(strategy_inputs)
+                strategy.end_react_batch()
+        finally:
+            strategy.stop()
+        return turns * games
+    return run
+
+
+def bench_render(number_of_pods: int, frames: int) -> Callable[[], int]:
+    # offscreen, so it measures whatever rasterizer the standalone context gets, llvmpipe on headless machines
+    from mad_pod.visualization.renderer import OffscreenRenderer
+    renderer = OffscreenRenderer(800, 450, backend=None if os.environ.get('DISPLAY') else 'egl')
+    game = create_game(number_of_pods)
+    prev_frame = game.get_visualization_data()
+    game.step(chase_outputs(game))
+    renderer.renderer.set_frames(prev_frame, game.get_visualization_data())
+    renderer.render(0.0)
+    def run() -> int:
+        try:
+            for i in range(frames):
+                renderer.renderer.render(i / frames)
+            # rendering is asynchronous, reading the pixels waits for it to finish
+            renderer.render(1.0)
+        finally:
+            renderer.release()
+        return frames
+    return run
+
+
+def render_available() -> bool:
+    try:
+        bench_render(1, 1)()
+    except Exception:
+        return False
+    return True
+
+
+def run_all(repeat: int, scale: float) -> list[BenchmarkResult]:
+    def n(x: int) -> int:
+        return max(int(x * scale), 1)
+    results = []
+    for number_of_pods in POD_COUNTS:
+        steps = n(20000 // number_of_pods)
+        results.append(measure(f'game_step[pods={number_of_pods}]', lambda: bench_game_step(number_of_pods, steps), repeat))
+        results.append(measure(f'pods_move[pods={number_of_pods}]', lambda: bench_pods_move(number_of_pods, steps), repeat))
+        results.append(measure(
+            f'get_strategy_input[pods={number_of_pods}]',
+            lambda: bench_get_strategy_input(number_of_pods, steps),
+            repeat
+        ))
+        results.append(measure(
+            f'snapshot_step_restore[pods={number_of_pods}]',
+            lambda: bench_snapshot_restore(number_of_pods, steps),
+            repeat
+        ))
+    results.append(measure('strategy_input_serialize', lambda: bench_serialize(n(100000)), repeat))
+    results.append(measure('strategy_output_deserialize', lambda: bench_deserialize(n(100000)), repeat))
+    results.append(measure('strategy_react_round_trip', lambda: bench_react_round_trip(n(2000)), repeat))
+    results.append(measure('strategy_input_serialize_binary', lambda: bench_serialize(n(100000), 'binary'), repeat))
+    results.append(measure('strategy_output_deserialize_binary', lambda: bench_deserialize(n(100000), 'binary'), repeat))
+    results.append(measure(
+        'strategy_react_round_trip_binary',
+        lambda: bench_react_round_trip(n(2000), 'binary'),
+        repeat
+    ))
+    if render_available():
+        for number_of_pods in (2, 500):
+            results.append(measure(
+                f'render_frame[pods={number_of_pods}]',
+                lambda: bench_render(number_of_pods, n(200)),
+                repeat
+            ))
+    for games in (1, 16, 64):
+        results.append(measure(
+            f'strategy_react_round_trip_multi[games={games}]',
+            lambda: bench_react_round_trip_multi(n(2000 // games), games),
+            repeat
+        ))
+    return results
+
+
+def compare(results: list[BenchmarkResult], baseline: dict, threshold: float) -> list[str]:
+    regressions = []
+    baseline_results = baseline['results']
+    for result in results:
+        if result.name not in baseline_results:
+            continue
+        baseline_ns = baseline_results[result.name]['ns_per_op']
+        change = result.ns_per_op / baseline_ns - 1
+        marker = ''
+        if change > threshold:
+            marker = '  REGRESSION'
+            regressions.append(result.name)
+        print(f'{result.name:<40} {baseline_ns:>12.1f} -> {result.ns_per_op:>12.1f} ns/op {change:>+8.1%}{marker}')
+    return regressions
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run')
+    parser.add_argument('-o', '--output', help='write results as JSON to this file')
+    parser.add_argument('-b', '--baseline', help='compare against results stored in this file')
+    parser.add_argument('-t', '--threshold', type=float, default=0.1, help='allowed slowdown, 0.1 is 10%%')
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplies the number of operations per run')
+    args = parser.parse_args(argv)
+
+    results = run_all(args.repeat, args.scale)
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'platform': platform.platform(),
+            'seed': SEED,
+        },
+        'results': {
+            result.name: {**asdict(result), 'ops_per_sec': result.ops_per_sec}
+            for result in results
+        },
+    }
+    for result in results:
+        print(f'{result.name:<40} {result.ns_per_op:>12.1f} ns/op {result.ops_per_sec:>14.0f} ops/s')
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print()
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f'{len(regressions)} benchmarks are more than {args.threshold:.0%} slower than the baseline')
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
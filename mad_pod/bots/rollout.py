@@ -0,0 +1,176 @@
+from __future__ import annotations
+from typing import Optional, Literal
+
+import math
+import time
+
+import numpy as np
+
+from ..constants import POD_ROTATION_SPEED, POD_SPEED_REDUCTION, CHECKPOINT_RADIUS
+from ..simulation.batch import move_arrays
+from ..strategy_communication.messages import StrategyInput, StrategyOutput
+from ..utils import get_relative_angle
+
+BOOST_THRUST = 200.0
+# targets are put this far along the chosen heading, so rounding them to integers barely changes the angle
+_TARGET_DISTANCE = 10000
+_CHECKPOINT_SCORE = 20000.0
+
+
+class RolloutPlanner:
+    # Random shooting over control sequences. Every turn it samples candidate sequences of
+    # (rotation, thrust) for the next horizon steps, simulates all of them at once with the
+    # batched physics and plays the first control of the one that gets furthest along the track.
+    # Rounds of candidates are evaluated until the time budget is spent,
+    # each round after the first one perturbs the best sequence found so far.
+    # The state the game doesn't report is reconstructed: velocity from the last two positions,
+    # the heading from the last control, the track from the checkpoints seen so far.
+    def __init__(
+        self,
+        budget: float = 0.03,
+        candidates: int = 512,
+        horizon: int = 6,
+        boosts: int = 1,
+        seed: int = 0
+    ):
+        self.budget = budget
+        self.candidates = candidates
+        self.horizon = horizon
+        self.boosts_left = boosts
+        self.rng = np.random.default_rng(seed)
+        self.checkpoints: list[tuple[int, int]] = []
+        self.track_complete = False
+        self.prev_pos: Optional[tuple[int, int]] = None
+        self.ang: Optional[float] = None
+        # best sequence of the previous turn, (horizon, 2) of rotation and thrust
+        self.plan: Optional[np.ndarray] = None
+        self.rounds = 0
+
+    def _learn_track(self, checkpoint: tuple[int, int]):
+        if self.track_complete or (self.checkpoints and self.checkpoints[-1] == checkpoint):
+            return
+        if len(self.checkpoints) > 1 and checkpoint == self.checkpoints[0]:
+            self.track_complete = True
+        else:
+            self.checkpoints.append(checkpoint)
+
+    def _estimate_angle(self, strategy_input: StrategyInput) -> float:
+        # the reported angle is truncated to whole degrees, the predicted one is exact unless something pushed the pod
+        x, y = strategy_input.pod_pos
+        checkpoint_x, checkpoint_y = strategy_input.checkpoint_pos
+        reported = strategy_input.checkpoint_angle
+        relative = math.radians(reported + 0.5 * (reported > 0) - 0.5 * (reported < 0))
+        observed = math.atan2(checkpoint_y - y, checkpoint_x - x) - relative
+        if self.ang is not None and abs(get_relative_angle(self.ang, observed)) < math.radians(1.5):
+            return self.ang
+        return observed
+
+    def _route(self, checkpoint: tuple[int, int]) -> np.ndarray:
+        # the current checkpoint and the ones after it, as far as they are known
+        if not self.track_complete:
+            return np.array([checkpoint], dtype=np.float64)
+        i = self.checkpoints.index(checkpoint)
+        n = len(self.checkpoints)
+        return np.array([self.checkpoints[(i + k) % n] for k in range(min(3, n))], dtype=np.float64)
+
+    def _evaluate(
+        self,
+        pos: np.ndarray,
+        vel: np.ndarray,
+        ang: float,
+        route: np.ndarray,
+        plans: np.ndarray
+    ) -> np.ndarray:
+        n = plans.shape[0]
+        pos = np.repeat(pos[None], n, axis=0)
+        vel = np.repeat(vel[None], n, axis=0)
+        angs = np.full(n, ang)
+        target = np.zeros(n, dtype=np.int64)
+        # pods that reached every checkpoint of the route
+        finished = np.zeros(n, dtype=bool)
+        score = np.zeros(n)
+        last = len(route) - 1
+        for t in range(plans.shape[1]):
+            move_arrays(pos, vel, angs, angs + plans[:, t, 0], plans[:, t, 1])
+            checkpoint_vect = route[np.minimum(target, last)] - pos
+            hit = ~finished & (
+                checkpoint_vect[:, 0] * checkpoint_vect[:, 0] + checkpoint_vect[:, 1] * checkpoint_vect[:, 1]
+                <= CHECKPOINT_RADIUS * CHECKPOINT_RADIUS
+            )
+            # the sooner the better
+            score += hit * (_CHECKPOINT_SCORE - 100 * t)
+            target += hit
+            finished |= target > last
+        checkpoint_vect = route[np.minimum(target, last)] - pos
+        distance = np.hypot(checkpoint_vect[:, 0], checkpoint_vect[:, 1])
+        return score - np.where(finished, 0.0, distance)
+
+    def _random_plans(self, n: int) -> np.ndarray:
+        plans = np.empty((n, self.horizon, 2))
+        plans[..., 0] = self.rng.uniform(-POD_ROTATION_SPEED, POD_ROTATION_SPEED, (n, self.horizon))
+        full = self.rng.random((n, self.horizon)) < 0.5
+        plans[..., 1] = np.where(full, 100.0, self.rng.uniform(0.0, 100.0, (n, self.horizon)))
+        if self.boosts_left > 0:
+            plans[:n // 10, 0, 1] = BOOST_THRUST
+        return plans
+
+    def _perturbed_plans(self, best: np.ndarray, n: int, scale: float) -> np.ndarray:
+        plans = np.repeat(best[None], n, axis=0)
+        plans[..., 0] += self.rng.normal(0.0, POD_ROTATION_SPEED * scale, (n, self.horizon))
+        plans[..., 1] += self.rng.normal(0.0, 30.0 * scale, (n, self.horizon))
+        np.clip(plans[..., 0], -POD_ROTATION_SPEED, POD_ROTATION_SPEED, out=plans[..., 0])
+        boost = plans[:, 0, 1] > 100.0
+        np.clip(plans[..., 1], 0.0, 100.0, out=plans[..., 1])
+        plans[boost, 0, 1] = BOOST_THRUST
+        return plans
+
+    def __call__(self, strategy_input: StrategyInput) -> StrategyOutput:
+        start = time.perf_counter()
+        checkpoint = strategy_input.checkpoint_pos
+        self._learn_track(checkpoint)
+        pos = np.array(strategy_input.pod_pos, dtype=np.float64)
+        if self.prev_pos is None:
+            vel = np.zeros(2)
+        else:
+            vel = (pos - np.array(self.prev_pos, dtype=np.float64)) * POD_SPEED_REDUCTION
+        ang = self._estimate_angle(strategy_input)
+        route = self._route(checkpoint)
+
+        plans = self._random_plans(self.candidates)
+        if self.plan is not None:
+            # keep following the last plan unless something better turns up
+            plans[-1, :-1] = self.plan[1:]
+            plans[-1, -1] = self.plan[-1]
+            if plans[-1, 0, 1] > 100.0 and self.boosts_left == 0:
+                plans[-1, 0, 1] = 100.0
+        scores = self._evaluate(pos, vel, ang, route, plans)
+        best_index = int(np.argmax(scores))
+        best, best_score = plans[best_index], scores[best_index]
+        self.rounds = 1
+        while time.perf_counter() - start < self.budget:
+            scale = 1.0 / (1 + 0.5 * self.rounds)
+            plans = self._perturbed_plans(best, self.candidates, scale)
+            scores = self._evaluate(pos, vel, ang, route, plans)
+            best_index = int(np.argmax(scores))
+            if scores[best_index] > best_score:
+                best, best_score = plans[best_index].copy(), scores[best_index]
+            self.rounds += 1
+
+        rotation, thrust = float(best[0, 0]), float(best[0, 1])
+        heading = ang + rotation
+        self.prev_pos = strategy_input.pod_pos
+        self.ang = heading
+        self.plan = best
+        output_thrust: int | Literal['BOOST']
+        if thrust > 100.0:
+            self.boosts_left -= 1
+            output_thrust = 'BOOST'
+        else:
+            output_thrust = int(round(thrust))
+        return StrategyOutput(
+            target_pos=(
+                int(strategy_input.pod_pos[0] + _TARGET_DISTANCE * math.cos(heading)),
+                int(strategy_input.pod_pos[1] + _TARGET_DISTANCE * math.sin(heading))
+            ),
+            thrust=output_thrust
+        )
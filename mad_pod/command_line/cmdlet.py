@@ -1,77 +1,630 @@
 from typing import Optional
 import argparse
-from threading import Thread
-from queue import Queue
+import os
+import sys
+from threading import Thread, Event
 
 from ..simulation.game import Game
 from ..simulation.play import play, PlayResult
-from ..strategy_communication.communication import Strategy
-from ..visualization.data import VisualizationData, VisualizationStopCommand
-from ..visualization.gltk import visualize_game
+from ..simulation.trace import TraceSink, TRACE_LEVELS
+from ..simulation.tournament import run_tournament, TournamentSummary, MatchSettings
+from ..simulation.heatmap import (
+    Heatmaps, track_key, write_heatmap_images,
+    DEFAULT_CELL, DEFAULT_APPROACH_CELL, DEFAULT_APPROACH_EXTENT, DEFAULT_MAX_TRACKS
+)
+from ..simulation.tracks import open_tracks, generate_tracks, write_tracks, DEFAULT_MIN_SPACING, MAX_CHECKPOINTS
+from ..simulation.league import League, LeagueSettings
+from ..simulation.optimize import Optimizer, OptimizeSettings, Parameter, Evaluation, format_value
+from ..strategy_communication.factory import make_strategy
+from ..strategy_communication.timing import TimeLimit, StrategyTiming
+from ..metrics import Metrics
+from ..visualization.frame_buffer import FrameBuffer, ReplayFrames, FRAME_POLICIES
 
 def run_vis1_gltk(
     cmdlines: list[str], 
     step_limit: int = 500, 
     window_scale: float = 1/5, 
     frame_duration: float = 0.3,
-    seed: Optional[int] = None
+    seed: Optional[int] = None,
+    time_limit: Optional[TimeLimit] = None,
+    replay_path: Optional[str] = None,
+    collisions: bool = False,
+    metrics_path: Optional[str] = None,
+    metrics_format: str = 'json',
+    trace_path: Optional[str] = None,
+    trace_level: str = 'summary',
+    tracks_path: Optional[str] = None,
+    track_id: Optional[int] = None,
+    difficulty: Optional[int] = None,
+    frame_policy: str = 'drop',
+    frame_buffer_size: int = 64
 ):
-    queue: Queue[VisualizationData | VisualizationStopCommand] = Queue()
-    play_thread = Thread(target=run1, args=[cmdlines, queue, step_limit, seed])
+    # imported here so that headless runs don't pay for the OpenGL/Tk import
+    from ..visualization.gltk import visualize_game
+    frames: FrameBuffer | ReplayFrames
+    if frame_policy == 'record':
+        if replay_path is None:
+            raise RuntimeError("the record policy needs a replay path")
+        # the viewer follows the replay as it's written
+        done = Event()
+        frames = ReplayFrames(replay_path, done)
+        buffer = None
+    else:
+        done = None
+        frames = buffer = FrameBuffer(frame_buffer_size, frame_policy)
+    def play_target():
+        try:
+            run1(
+                cmdlines, buffer, step_limit, seed, time_limit, replay_path, collisions,
+                metrics_path, metrics_format, trace_path, trace_level, tracks_path, track_id, difficulty
+            )
+        finally:
+            if done is not None:
+                done.set()
+    play_thread = Thread(target=play_target)
     play_thread.daemon = False
     play_thread.start()
-    visualize_game(queue, window_scale, frame_duration)
+    visualize_game(frames, window_scale, frame_duration)
+
+def view_replay(replay_path: str, window_scale: float = 1/5, frame_duration: float = 0.3):
+    from ..visualization.gltk import visualize_game
+    visualize_game(ReplayFrames(replay_path), window_scale, frame_duration)
 
 def run1(
     cmdlines: list[str], 
-    queue: Optional[Queue[VisualizationData | VisualizationStopCommand]] = None, 
+    frames: Optional[FrameBuffer] = None,
     step_limit: int = 500,
-    seed: Optional[int] = None
+    seed: Optional[int] = None,
+    time_limit: Optional[TimeLimit] = None,
+    replay_path: Optional[str] = None,
+    collisions: bool = False,
+    metrics_path: Optional[str] = None,
+    metrics_format: str = 'json',
+    trace_path: Optional[str] = None,
+    trace_level: str = 'summary',
+    tracks_path: Optional[str] = None,
+    track_id: Optional[int] = None,
+    difficulty: Optional[int] = None
 ):
     strategies = [
-        Strategy(cmdline)
+        make_strategy(cmdline, time_limit)
         for cmdline
         in cmdlines
     ]
-    game = Game.create(len(strategies), 4, seed)
-    match queue:
+    game = Game.create(
+        len(strategies), 4, seed, collisions,
+        tracks=None if tracks_path is None else open_tracks(tracks_path),
+        track_id=track_id,
+        difficulty=difficulty
+    )
+    match frames:
         case None:
             vis_cb = None
         case _:
-            def vis_cb(data: VisualizationData):
-                queue.put(data)
-    res =  play(game, strategies, step_limit, vis_cb)
+            vis_cb = frames.put
+    metrics = None if metrics_path is None else Metrics()
+    try:
+        with TraceSink(trace_level, trace_path) as trace:
+            res =  play(game, strategies, step_limit, vis_cb, replay_path, metrics, trace)
+    finally:
+        if frames is not None:
+            frames.close()
+    if metrics is not None and metrics_path is not None:
+        metrics.dump(metrics_path, metrics_format)
     match res:
         case PlayResult.Limit():
             print("Step limit reached")
         case PlayResult.Win(pod_number):
             print(f"pod #{pod_number} won")
-    if queue is not None:
-        queue.put(VisualizationStopCommand())
+        case PlayResult.Forfeit(pod_number):
+            print(f"pod #{pod_number} forfeited by missing its time limit")
+    for i, timing in enumerate(res.strategy_timings):
+        print(format_timing(i, timing))
+    if frames is not None and frames.dropped > 0:
+        print(f"the viewer skipped {frames.dropped} frames")
+
+def format_timing(pod_number: int, timing: StrategyTiming) -> str:
+    def ms(x: Optional[float]) -> str:
+        return '-' if x is None else f'{x * 1000:.1f} ms'
+    return (
+        f"pod #{pod_number}: {timing.turns} turns, {timing.timeouts} timeouts, "
+        f"p50 {ms(timing.p50)}, p99 {ms(timing.p99)}, max {ms(timing.max)}, "
+        f"cpu {'-' if timing.cpu_time is None else f'{timing.cpu_time:.2f} s'}"
+    )
+
+def run_tournament_cmd(
+    cmdlines: list[str],
+    seeds: range,
+    settings: MatchSettings = MatchSettings(),
+    processes: Optional[int] = None,
+    rotate: bool = True,
+    metrics_path: Optional[str] = None,
+    metrics_format: str = 'json',
+    # filled with the positions of every match, needs MatchSettings.heatmap
+    heatmaps: Optional[Heatmaps] = None,
+    # per-track heatmaps, only for corpus tracks
+    heatmap_per_track: bool = False
+):
+    summary = TournamentSummary.create(cmdlines)
+    metrics = Metrics()
+    for match_result in run_tournament(cmdlines, seeds, settings, processes, rotate):
+        summary.add(match_result)
+        if match_result.metrics is not None:
+            metrics.merge(match_result.metrics)
+        if heatmaps is not None and match_result.positions is not None and match_result.checkpoints is not None:
+            heatmaps.add_match(
+                match_result.positions,
+                match_result.checkpoints,
+                [cmdlines[i] for i in match_result.strategy_order],
+                # random tracks never repeat, only corpus tracks get maps of their own
+                track_key(match_result.checkpoints) if heatmap_per_track and settings.tracks is not None else None
+            )
+        match match_result.result:
+            case PlayResult.Limit():
+                print(f"seed {match_result.seed}: step limit reached")
+            case PlayResult.Win(_, steps):
+                print(f"seed {match_result.seed}: {cmdlines[match_result.winner]} won in {steps} steps")
+            case PlayResult.Forfeit(pod_number, steps):
+                forfeited = cmdlines[match_result.strategy_order[pod_number]]
+                print(f"seed {match_result.seed}: {forfeited} forfeited on step {steps}")
+    print(summary.format())
+    if metrics_path is not None:
+        metrics.dump(metrics_path, metrics_format)
+
+def add_time_limit_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('-t', '--time-limit', type=float, help='per-turn time limit in ms')
+    parser.add_argument('-tf', '--first-turn-time-limit', type=float, help='first turn time limit in ms')
+    parser.add_argument('--on-timeout', choices=['forfeit', 'default'], default='forfeit')
+
+def add_metrics_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('-m', '--metrics', help='write per-phase timings and counters to this file')
+    parser.add_argument('--metrics-format', choices=['json', 'prometheus'], default='json')
+
+def add_trace_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--trace', help='write the trace to this file instead of stdout, gzip-compressed if it ends with .gz')
+    parser.add_argument('--trace-level', choices=TRACE_LEVELS, default='summary')
+
+def add_heatmap_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--heatmap-cell', type=float, default=DEFAULT_CELL, help='field heatmap cell size')
+    parser.add_argument('--approach-cell', type=float, default=DEFAULT_APPROACH_CELL, help='approach heatmap cell size')
+    parser.add_argument(
+        '--approach-extent', type=float, default=DEFAULT_APPROACH_EXTENT,
+        help='approach heatmaps reach this far from the checkpoint'
+    )
+    parser.add_argument('--heatmap-images', help='also write every heatmap as a PNG to this directory')
+    parser.add_argument(
+        '--per-track', action='store_true',
+        help='also keep field heatmaps of every track, for tracks that repeat like corpus ones'
+    )
+    parser.add_argument(
+        '--max-tracks', type=int, default=DEFAULT_MAX_TRACKS,
+        help='tracks with heatmaps of their own, later tracks only count in the heatmaps of all tracks'
+    )
+
+def heatmaps_from_args(args: argparse.Namespace) -> Heatmaps:
+    return Heatmaps(
+        cell=args.heatmap_cell,
+        approach_cell=args.approach_cell,
+        approach_extent=args.approach_extent,
+        max_tracks=args.max_tracks
+    )
+
+def write_heatmaps(heatmaps: Heatmaps, path: str, images_dir: Optional[str]):
+    heatmaps.save(path)
+    print(f"heatmaps of {sum(heatmaps.matches.values())} strategy matches written to {path}")
+    if images_dir is not None:
+        print(f"{len(write_heatmap_images(heatmaps, images_dir))} heatmap images written to {images_dir}")
+
+def add_cache_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--cache', help='result cache file, matches already in it are not played again')
+    parser.add_argument('--cache-size', type=float, default=1024, help='cache size in MB, least recently used results go first')
+    parser.add_argument(
+        '--no-cache', action='append', default=[], metavar='CMD',
+        help='a nondeterministic strategy, matches with it are always played, '
+             'time-budgeted builtins like builtin:rollout and matches with timeouts are never cached'
+    )
+
+def cache_settings_from_args(args: argparse.Namespace) -> dict:
+    return {'cache': args.cache, 'cache_size': int(args.cache_size * (1 << 20)), 'uncached': args.no_cache}
+
+def add_track_arguments(parser: argparse.ArgumentParser, track_id: bool = False):
+    parser.add_argument('--tracks', help='pick tracks from this corpus, see mad-pod-cmd tracks')
+    if track_id:
+        parser.add_argument('--track-id', type=int)
+    parser.add_argument('--difficulty', type=int, help='difficulty bucket of the corpus, 0 is the easiest')
+
+def time_limit_from_args(args: argparse.Namespace) -> Optional[TimeLimit]:
+    if args.time_limit is None and args.first_turn_time_limit is None:
+        return None
+    time_limit = TimeLimit(on_timeout=args.on_timeout)
+    if args.time_limit is not None:
+        time_limit.turn = args.time_limit / 1000
+    if args.first_turn_time_limit is not None:
+        time_limit.first_turn = args.first_turn_time_limit / 1000
+    return time_limit
+
+def parse_seed_range(s: str) -> range:
+    match s.split(':'):
+        case [stop]:
+            return range(int(stop))
+        case [start, stop]:
+            return range(int(start), int(stop))
+        case _:
+            raise argparse.ArgumentTypeError("seed range must be STOP or START:STOP")
+
+def tournament_main(argv: list[str]):
+    parser = argparse.ArgumentParser(prog='mad-pod-cmd tournament')
+    parser.add_argument('-c', '--cmd', action='append', required=True)
+    parser.add_argument('-s', '--seeds', type=parse_seed_range, required=True)
+    parser.add_argument('-l', '--limit', type=int)
+    parser.add_argument('-j', '--processes', type=int)
+    parser.add_argument('--no-rotate', action='store_true')
+    parser.add_argument('--pool-size', type=int, default=0)
+    parser.add_argument('--games-per-process', type=int, default=1)
+    parser.add_argument('--replay-dir')
+    parser.add_argument('--collisions', action='store_true')
+    parser.add_argument('--trace-dir', help='write a trace of every match to <seed>.jsonl in this directory')
+    parser.add_argument('--trace-level', choices=TRACE_LEVELS, default='summary')
+    parser.add_argument('--trace-gzip', action='store_true')
+    parser.add_argument(
+        '--multiplex', type=int, default=1,
+        help='matches every worker plays in lockstep, multi:CMD strategies serve all of them from one process '
+             'with one deadline per tick, a missed one forfeits all of its matches'
+    )
+    parser.add_argument('--heatmap', help='write occupancy heatmaps of every strategy to this .npz file')
+    add_time_limit_arguments(parser)
+    add_track_arguments(parser)
+    add_metrics_arguments(parser)
+    add_heatmap_arguments(parser)
+    add_cache_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.heatmap is not None and args.multiplex > 1:
+        parser.error("heatmaps aren't collected from multiplexed matches")
+    limit = 500 if args.limit is None else args.limit
+    settings = MatchSettings(
+        step_limit=limit,
+        pool_size=args.pool_size,
+        games_per_process=args.games_per_process,
+        time_limit=time_limit_from_args(args),
+        replay_dir=args.replay_dir,
+        collisions=args.collisions,
+        metrics=args.metrics is not None,
+        trace_dir=args.trace_dir,
+        trace_level=args.trace_level,
+        trace_gzip=args.trace_gzip,
+        tracks=args.tracks,
+        difficulty=args.difficulty,
+        multiplex=args.multiplex,
+        heatmap=args.heatmap is not None,
+        **cache_settings_from_args(args)
+    )
+    heatmaps = None if args.heatmap is None else heatmaps_from_args(args)
+    run_tournament_cmd(
+        args.cmd,
+        args.seeds,
+        settings,
+        processes=args.processes,
+        rotate=not args.no_rotate,
+        metrics_path=args.metrics,
+        metrics_format=args.metrics_format,
+        heatmaps=heatmaps,
+        heatmap_per_track=args.per_track
+    )
+    if heatmaps is not None:
+        write_heatmaps(heatmaps, args.heatmap, args.heatmap_images)
+
+def format_evaluation(evaluation: Evaluation) -> str:
+    params = ' '.join(f'{name}={format_value(value)}' for name, value in evaluation.candidate.items())
+    return (
+        f"generation {evaluation.generation} #{evaluation.index}: score {evaluation.score:.4f}, "
+        f"{evaluation.wins}/{evaluation.matches} wins, {params}"
+    )
+
+def optimize_main(argv: list[str]):
+    parser = argparse.ArgumentParser(prog='mad-pod-cmd optimize')
+    parser.add_argument('-c', '--cmd', required=True, help='command line of the tuned strategy, may use {name} placeholders')
+    parser.add_argument('-p', '--param', action='append', required=True, help='name=low:high, name=low:high:int or name=v1,v2,...')
+    parser.add_argument('-o', '--opponent', action='append', default=[], help='without opponents the strategy races alone')
+    parser.add_argument('-s', '--seeds', type=parse_seed_range, required=True)
+    parser.add_argument('-m', '--method', choices=['grid', 'random', 'cma'], default='cma')
+    parser.add_argument('-n', '--evaluations', type=int, default=100, help='candidates for random search and CMA-ES')
+    parser.add_argument('--grid-steps', type=int, default=5)
+    parser.add_argument('--random-seed', type=int, default=0)
+    parser.add_argument('--env-prefix', default='MAD_POD_')
+    parser.add_argument('--state', help='save progress to this file and resume from it')
+    parser.add_argument('-l', '--limit', type=int)
+    parser.add_argument('-j', '--processes', type=int)
+    parser.add_argument('--collisions', action='store_true')
+    add_time_limit_arguments(parser)
+    add_track_arguments(parser)
+    add_cache_arguments(parser)
+    args = parser.parse_args(argv)
+    settings = OptimizeSettings(
+        template=args.cmd,
+        parameters=[Parameter.parse(spec) for spec in args.param],
+        seeds=list(args.seeds),
+        opponents=args.opponent,
+        method=args.method,
+        evaluations=args.evaluations,
+        grid_steps=args.grid_steps,
+        random_seed=args.random_seed,
+        env_prefix=args.env_prefix,
+        match_settings=MatchSettings(
+            step_limit=500 if args.limit is None else args.limit,
+            time_limit=time_limit_from_args(args),
+            collisions=args.collisions,
+            tracks=args.tracks,
+            difficulty=args.difficulty,
+            **cache_settings_from_args(args)
+        )
+    )
+    optimizer = Optimizer(settings, args.state)
+    if optimizer.evaluations:
+        print(f"resuming after {len(optimizer.evaluations)} evaluated candidates")
+    for evaluation in optimizer.run(args.processes):
+        print(format_evaluation(evaluation), flush=True)
+    best = optimizer.best()
+    if best is not None:
+        print(f"best: {format_evaluation(best)}")
+
+def league_main(argv: list[str]):
+    parser = argparse.ArgumentParser(prog='mad-pod-cmd league')
+    parser.add_argument('db', help='SQLite file of the league, created if it does not exist')
+    commands = parser.add_subparsers(dest='command', required=True)
+    add = commands.add_parser('add', help='add a bot, or bring back a retired one')
+    add.add_argument('name')
+    add.add_argument('cmd')
+    retire = commands.add_parser('retire', help='stop scheduling a bot, its results are kept')
+    retire.add_argument('name')
+    commands.add_parser('table', help='print the ratings')
+    run = commands.add_parser('run', help='play the most informative matches, unfinished ones first')
+    run.add_argument('-n', '--matches', type=int, help='play at most this many matches')
+    run.add_argument('-j', '--processes', type=int)
+    run.add_argument('-l', '--limit', type=int, default=500)
+    run.add_argument('--collisions', action='store_true')
+    run.add_argument('--min-gain', type=float, default=1.0, help='skip pairings that would shrink the deviations by less')
+    run.add_argument('--seed-offset', type=int, default=0)
+    add_time_limit_arguments(run)
+    add_track_arguments(run)
+    add_cache_arguments(run)
+    args = parser.parse_args(argv)
+    settings = LeagueSettings()
+    if args.command == 'run':
+        settings = LeagueSettings(
+            match_settings=MatchSettings(
+                step_limit=args.limit,
+                time_limit=time_limit_from_args(args),
+                collisions=args.collisions,
+                tracks=args.tracks,
+                difficulty=args.difficulty,
+                **cache_settings_from_args(args)
+            ),
+            min_gain=args.min_gain,
+            seed_offset=args.seed_offset
+        )
+    with League(args.db, settings) as league:
+        match args.command:
+            case 'add':
+                bot = league.add_bot(args.name, args.cmd)
+                print(f"{bot.name}: rating {bot.rating:.0f} ± {2 * bot.deviation:.0f}")
+            case 'retire':
+                league.retire_bot(args.name)
+            case 'run':
+                pending = len(league.pending())
+                if pending:
+                    print(f"resuming {pending} unfinished matches")
+                played = 0
+                for match, match_result in league.run(args.matches, args.processes):
+                    played += 1
+                    if isinstance(match_result, Exception):
+                        print(f"{match.bot_a.name} vs {match.bot_b.name}, seed {match.seed}: failed: {match_result}", flush=True)
+                        continue
+                    match match_result.result:
+                        case PlayResult.Win(pod_number, steps):
+                            winner = [match.bot_a, match.bot_b][pod_number].name
+                            outcome = f"{winner} won in {steps} steps"
+                        case PlayResult.Forfeit(pod_number, steps):
+                            outcome = f"{[match.bot_a, match.bot_b][pod_number].name} forfeited on step {steps}"
+                        case _:
+                            outcome = "step limit reached"
+                    print(f"{match.bot_a.name} vs {match.bot_b.name}, seed {match.seed}: {outcome}", flush=True)
+                print(f"{played} matches played")
+                print(league.format())
+            case 'table':
+                print(league.format())
+
+def tracks_main(argv: list[str]):
+    parser = argparse.ArgumentParser(prog='mad-pod-cmd tracks')
+    parser.add_argument('-o', '--output', required=True)
+    parser.add_argument('-n', '--number', type=int, default=10000)
+    parser.add_argument('--min-checkpoints', type=int, default=3)
+    parser.add_argument('--max-checkpoints', type=int, default=MAX_CHECKPOINTS)
+    parser.add_argument('--min-spacing', type=float, default=DEFAULT_MIN_SPACING)
+    parser.add_argument('--buckets', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    records = generate_tracks(
+        args.number,
+        args.min_checkpoints,
+        args.max_checkpoints,
+        args.min_spacing,
+        args.buckets,
+        args.seed
+    )
+    write_tracks(args.output, records, args.buckets)
+    print(f"{'bucket':>6} {'tracks':>8} {'length':>8} {'sharpness':>9} {'max turn':>8}")
+    for bucket in range(args.buckets):
+        bucket_records = records[records['difficulty'] == bucket]
+        print(
+            f"{bucket:>6} {len(bucket_records):>8} {bucket_records['length'].mean():>8.0f} "
+            f"{bucket_records['sharpness'].mean():>9.2f} {bucket_records['max_turn'].mean():>8.2f}"
+        )
+
+def heatmap_main(argv: list[str]):
+    # replays are read one at a time and saved heatmaps are merged, memory doesn't grow with the corpus
+    from ..simulation.replay import Replay
+    parser = argparse.ArgumentParser(prog='mad-pod-cmd heatmap')
+    parser.add_argument('inputs', nargs='+', help='replays (.mpr) and heatmaps (.npz) to aggregate')
+    parser.add_argument('-o', '--output', required=True, help='.npz file of the aggregated heatmaps')
+    parser.add_argument(
+        '-n', '--name', action='append', default=[],
+        help='strategy of each pod in the replays in pod order, pods without one are named pod<number>'
+    )
+    add_heatmap_arguments(parser)
+    args = parser.parse_args(argv)
+    heatmaps = heatmaps_from_args(args)
+    for path in args.inputs:
+        if path.endswith('.npz'):
+            heatmaps.merge(Heatmaps.load(path))
+            continue
+        replay = Replay.open(path)
+        checkpoints = replay.checkpoints
+        names = [
+            args.name[pod_number] if pod_number < len(args.name) else f'pod{pod_number}'
+            for pod_number in range(replay.records.shape[1])
+        ]
+        heatmaps.add_match(replay.records['pos'], checkpoints, names, track_key(checkpoints) if args.per_track else None)
+    write_heatmaps(heatmaps, args.output, args.heatmap_images)
+
+def view_main(argv: list[str]):
+    parser = argparse.ArgumentParser(prog='mad-pod-cmd view')
+    parser.add_argument('replay')
+    parser.add_argument('-vs', '--vis-scale', type=float, default=1/5)
+    parser.add_argument('-vd', '--vis-frame-duration', type=float, default=0.3)
+    args = parser.parse_args(argv)
+    view_replay(args.replay, args.vis_scale, args.vis_frame_duration)
+
+def render_main(argv: list[str]):
+    # imported here so that the other subcommands don't pay for the OpenGL import
+    from ..visualization.clips import ClipSettings, CLIP_FORMATS, clip_path, render_replays, render_matches
+    from ..visualization.png import MAX_APNG_FPS
+    parser = argparse.ArgumentParser(prog='mad-pod-cmd render')
+    parser.add_argument('replays', nargs='*', help='replays to render, named after them in the output directory')
+    parser.add_argument('-o', '--output', required=True, help='output directory')
+    parser.add_argument('-c', '--cmd', action='append', help='play matches with these strategies and render them live')
+    parser.add_argument('-s', '--seeds', type=parse_seed_range, help='seeds of the live matches')
+    parser.add_argument('-l', '--limit', type=int, default=500)
+    parser.add_argument('--collisions', action='store_true')
+    parser.add_argument('-f', '--format', choices=CLIP_FORMATS, default='apng')
+    parser.add_argument('--width', type=int, default=800)
+    parser.add_argument('--fps', type=float, default=30.0)
+    parser.add_argument('--substeps', type=int, default=1, help='frames per step, the ones in between are interpolated')
+    parser.add_argument('--compression', type=int, default=6, choices=range(10))
+    parser.add_argument('--egl', action='store_true', help='render through EGL, for machines without a display')
+    parser.add_argument('-j', '--processes', type=int)
+    args = parser.parse_args(argv)
+    if (args.cmd is None) != (args.seeds is None):
+        parser.error("live matches need both --cmd and --seeds")
+    if args.cmd is None and not args.replays:
+        parser.error("nothing to render, give replays or --cmd and --seeds")
+    if not 0 < args.fps <= MAX_APNG_FPS:
+        parser.error(f"--fps must be above 0 and at most {MAX_APNG_FPS:g}")
+    settings = ClipSettings(
+        width=args.width,
+        format=args.format,
+        fps=args.fps,
+        substeps=args.substeps,
+        compression=args.compression,
+        backend='egl' if args.egl else None
+    )
+    os.makedirs(args.output, exist_ok=True)
+    if args.replays:
+        jobs = [
+            (replay, clip_path(args.output, os.path.splitext(os.path.basename(replay))[0], settings))
+            for replay in args.replays
+        ]
+        for replay, output_path, frames in render_replays(jobs, settings, args.processes):
+            print(f"{replay}: {frames} frames in {output_path}")
+    if args.cmd is not None:
+        for seed, output_path, result in render_matches(
+            args.cmd, args.seeds, args.output, settings, args.processes, args.limit, args.collisions
+        ):
+            print(f"seed {seed}: {type(result).__name__.lower()} in {output_path}")
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'league':
+        league_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == 'heatmap':
+        heatmap_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == 'render':
+        render_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == 'view':
+        view_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == 'tracks':
+        tracks_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == 'tournament':
+        tournament_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == 'optimize':
+        optimize_main(sys.argv[2:])
+        return
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', '--cmd', action='append', required=True)
     parser.add_argument('-v', '--vis', choices=['gltk'])
     parser.add_argument('-vs', '--vis-scale', type=float)
     parser.add_argument('-vd', '--vis-frame-duration', type=float)
+    parser.add_argument(
+        '-vp', '--vis-policy', choices=FRAME_POLICIES, default='drop',
+        help='when the viewer falls behind: drop frames, block the simulation, or record a replay (-r) and follow it'
+    )
+    parser.add_argument('-vb', '--vis-buffer', type=int, default=64, help='frames buffered for the viewer')
     parser.add_argument('-l', '--limit', type=int)
     parser.add_argument('-s', '--seed', type=int)
+    parser.add_argument('-r', '--replay')
+    parser.add_argument('--collisions', action='store_true')
+    add_time_limit_arguments(parser)
+    add_metrics_arguments(parser)
+    add_trace_arguments(parser)
+    add_track_arguments(parser, track_id=True)
     args = parser.parse_args()
+    if args.vis is not None and args.vis_policy == 'record' and args.replay is None:
+        parser.error("--vis-policy record needs --replay")
     limit = 500 if args.limit is None else args.limit
     window_scale = 1/5 if args.vis_scale is None else args.vis_scale
     frame_duration = 0.3 if args.vis_frame_duration is None else args.vis_frame_duration
     seed = None if args.seed == -1 else args.seed
+    time_limit = time_limit_from_args(args)
     if args.vis is not None:
         run_vis1_gltk(
             args.cmd, 
             step_limit=limit, 
             window_scale=window_scale, 
             frame_duration=frame_duration,
-            seed=seed
+            seed=seed,
+            time_limit=time_limit,
+            replay_path=args.replay,
+            collisions=args.collisions,
+            metrics_path=args.metrics,
+            metrics_format=args.metrics_format,
+            trace_path=args.trace,
+            trace_level=args.trace_level,
+            tracks_path=args.tracks,
+            track_id=args.track_id,
+            difficulty=args.difficulty,
+            frame_policy=args.vis_policy,
+            frame_buffer_size=args.vis_buffer
         )
     else:
-        run1(args.cmd, step_limit=limit, seed=seed)
+        run1(
+            args.cmd,
+            step_limit=limit,
+            seed=seed,
+            time_limit=time_limit,
+            replay_path=args.replay,
+            collisions=args.collisions,
+            metrics_path=args.metrics,
+            metrics_format=args.metrics_format,
+            trace_path=args.trace,
+            trace_level=args.trace_level,
+            tracks_path=args.tracks,
+            track_id=args.track_id,
+            difficulty=args.difficulty
+        )
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
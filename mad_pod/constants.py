@@ -6,3 +6,5 @@ POD_RADIUS = 200
 WORLD_W = 16000
 WORLD_H = 9000
 CHECKPOINT_RADIUS = 600
+
+MIN_COLLISION_IMPULSE = 120
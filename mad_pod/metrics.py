@@ -0,0 +1,167 @@
+from __future__ import annotations
+from typing import Optional
+from dataclasses import dataclass, field
+
+import bisect
+import json
+
+# upper bounds of histogram buckets in seconds, from 10 us to 10 s
+DEFAULT_BUCKETS = (
+    1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+    1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 7.5e-2,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+_Labels = tuple[tuple[str, str], ...]
+
+
+def _labels(labels: dict[str, object]) -> _Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+@dataclass
+class Histogram:
+    buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    # counts[i] is the number of values in (buckets[i - 1], buckets[i]], the last one is for values above all buckets
+    counts: list[int] = field(default_factory=lambda: [])
+    count: int = 0
+    sum: float = 0.0
+    max: float = 0.0
+
+    def __post_init__(self):
+        if not self.counts:
+            self.counts = [0] * (len(self.buckets) + 1)
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: Histogram):
+        if self.buckets != other.buckets:
+            raise RuntimeError("can't merge histograms with different buckets")
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> float:
+        # upper bound of the bucket holding the q-th value, max for the overflow bucket
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics:
+    # counters and histograms keyed by name and labels, cheap enough to keep on for every match
+    def __init__(self):
+        self.counters: dict[tuple[str, _Labels], float] = {}
+        self.histograms: dict[tuple[str, _Labels], Histogram] = {}
+
+    def inc(self, name: str, value: float = 1, **labels: object):
+        key = (name, _labels(labels))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: object):
+        key = (name, _labels(labels))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def relabel(self, label: str, mapping: dict[str, str], new_label: Optional[str] = None):
+        # replaces values of one label, e.g. pod numbers with the strategies that drove them,
+        # and renames the label to new_label if it's given
+        renamed = label if new_label is None else new_label
+        def relabel_key(key: tuple[str, _Labels]) -> tuple[str, _Labels]:
+            name, labels = key
+            return name, tuple(sorted(
+                (renamed, mapping.get(v, v)) if k == label else (k, v) for k, v in labels
+            ))
+        counters, histograms = self.counters, self.histograms
+        self.counters, self.histograms = {}, {}
+        for key, value in counters.items():
+            self.counters[relabel_key(key)] = self.counters.get(relabel_key(key), 0) + value
+        for key, histogram in histograms.items():
+            new_key = relabel_key(key)
+            if new_key in self.histograms:
+                self.histograms[new_key].merge(histogram)
+            else:
+                self.histograms[new_key] = histogram
+
+    def merge(self, other: Metrics):
+        for key, value in other.counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+        for key, histogram in other.histograms.items():
+            if key in self.histograms:
+                self.histograms[key].merge(histogram)
+            else:
+                merged = self.histograms[key] = Histogram(buckets=histogram.buckets)
+                merged.merge(histogram)
+
+    def to_json(self) -> str:
+        return json.dumps({
+            'counters': [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self.counters.items())
+            ],
+            'histograms': [
+                {
+                    'name': name,
+                    'labels': dict(labels),
+                    'count': histogram.count,
+                    'sum': histogram.sum,
+                    'max': histogram.max,
+                    'p50': histogram.quantile(0.5),
+                    'p99': histogram.quantile(0.99),
+                    'buckets': list(histogram.buckets),
+                    'counts': histogram.counts,
+                }
+                for (name, labels), histogram in sorted(self.histograms.items())
+            ],
+        }, indent=2)
+
+    def to_prometheus(self, prefix: str = 'mad_pod_') -> str:
+        def escape(value: str) -> str:
+            # label values are strategy command lines after relabel, with quotes and backslashes
+            return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        def format_labels(labels: _Labels, extra: _Labels = ()) -> str:
+            all_labels = labels + extra
+            if not all_labels:
+                return ''
+            return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in all_labels) + '}'
+
+        lines = []
+        typed: set[str] = set()
+        for (name, labels), value in sorted(self.counters.items()):
+            full_name = f'{prefix}{name}_total'
+            if full_name not in typed:
+                lines.append(f'# TYPE {full_name} counter')
+                typed.add(full_name)
+            lines.append(f'{full_name}{format_labels(labels)} {value}')
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            full_name = f'{prefix}{name}'
+            if full_name not in typed:
+                lines.append(f'# TYPE {full_name} histogram')
+                typed.add(full_name)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{full_name}_bucket{format_labels(labels, (("le", repr(bound)),))} {cumulative}')
+            lines.append(f'{full_name}_bucket{format_labels(labels, (("le", "+Inf"),))} {histogram.count}')
+            lines.append(f'{full_name}_sum{format_labels(labels)} {histogram.sum}')
+            lines.append(f'{full_name}_count{format_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path: str, format: str = 'json'):
+        with open(path, 'w') as f:
+            f.write(self.to_prometheus() if format == 'prometheus' else self.to_json())
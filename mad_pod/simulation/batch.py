@@ -0,0 +1,207 @@
+from __future__ import annotations
+from typing import Optional
+from dataclasses import dataclass
+
+import math
+
+import numpy as np
+
+from ..constants import POD_ROTATION_SPEED, POD_SPEED_REDUCTION, CHECKPOINT_RADIUS
+from ..vector import Vector
+from ..strategy_communication.messages import StrategyOutput
+from .game import Game
+from .pod_physics import Pods, Pod
+
+
+def move_arrays(
+    pos: np.ndarray,
+    vel: np.ndarray,
+    ang: np.ndarray,
+    target_angle: np.ndarray,
+    thrust: np.ndarray
+):
+    # same operations in the same order as Pods.move, so results match bit for bit
+    relative_angle = np.mod(target_angle + np.pi - ang, 2 * np.pi) - np.pi
+    ang += np.clip(relative_angle, -POD_ROTATION_SPEED, POD_ROTATION_SPEED)
+    vel[..., 0] += thrust * np.cos(ang)
+    vel[..., 1] += thrust * np.sin(ang)
+    pos += vel
+    vel *= POD_SPEED_REDUCTION
+
+
+_libm_atan2 = np.frompyfunc(math.atan2, 2, 1)
+
+def arctan2(y: np.ndarray, x: np.ndarray, exact: bool = True) -> np.ndarray:
+    # numpy's SIMD arctan2 may differ from math.atan2 in the last bit,
+    # which is enough for batched games to drift away from Game.step
+    if exact:
+        return _libm_atan2(y, x).astype(np.float64)
+    return np.arctan2(y, x)
+
+
+def strategy_outputs_to_arrays(strategy_outputs: list[list[StrategyOutput]]) -> tuple[np.ndarray, np.ndarray]:
+    target_pos = np.array(
+        [[strategy_output.target_pos for strategy_output in game_outputs] for game_outputs in strategy_outputs],
+        dtype=np.float64
+    )
+    thrust = np.array(
+        [
+            [200.0 if strategy_output.thrust == 'BOOST' else float(strategy_output.thrust) for strategy_output in game_outputs]
+            for game_outputs in strategy_outputs
+        ],
+        dtype=np.float64
+    )
+    return target_pos, thrust
+
+
+@dataclass
+class BatchGame:
+    # pods state, shape (games, pods, 2) for vectors and (games, pods) for scalars
+    pos: np.ndarray
+    vel: np.ndarray
+    ang: np.ndarray
+    # checkpoints padded to the longest track, shape (games, checkpoints, 2)
+    checkpoints: np.ndarray
+    number_of_checkpoints: np.ndarray
+    pods_next_checkpoint: np.ndarray
+    pods_laps: np.ndarray
+    # games that have not been won yet, finished games are frozen
+    active: np.ndarray
+    random_seeds: list[Optional[int]]
+    # exact=False trades bit-for-bit equality with Game.step for a faster arctan2
+    exact: bool = True
+
+    @classmethod
+    def create(
+        cls,
+        number_of_pods: int,
+        number_of_checkpoints: int,
+        random_seeds: list[int],
+        exact: bool = True
+    ) -> BatchGame:
+        return cls.from_games([
+            Game.create(number_of_pods, number_of_checkpoints, random_seed)
+            for random_seed in random_seeds
+        ], exact)
+
+    @classmethod
+    def from_games(cls, games: list[Game], exact: bool = True) -> BatchGame:
+        if len(games) < 1:
+            raise RuntimeError("at least one game is required")
+        number_of_pods = len(games[0].pods)
+        if any(len(game.pods) != number_of_pods for game in games):
+            raise RuntimeError("all games must have the same number of pods")
+        if any(game.pods.collisions for game in games):
+            raise RuntimeError("batched games don't simulate pod collisions")
+        max_checkpoints = max(len(game.checkpoints) for game in games)
+        checkpoints = np.zeros((len(games), max_checkpoints, 2), dtype=np.float64)
+        for i, game in enumerate(games):
+            checkpoints[i, :len(game.checkpoints)] = [(c.x, c.y) for c in game.checkpoints]
+        return BatchGame(
+            pos=np.array([np.stack([game.pods.x, game.pods.y], axis=-1) for game in games], dtype=np.float64),
+            vel=np.array([np.stack([game.pods.vx, game.pods.vy], axis=-1) for game in games], dtype=np.float64),
+            ang=np.array([game.pods.ang for game in games], dtype=np.float64),
+            checkpoints=checkpoints,
+            number_of_checkpoints=np.array([len(game.checkpoints) for game in games], dtype=np.int64),
+            pods_next_checkpoint=np.array([game.pods_next_checkpoint for game in games], dtype=np.int64),
+            pods_laps=np.array([game.pods_laps for game in games], dtype=np.int64),
+            active=np.ones(len(games), dtype=bool),
+            random_seeds=[game.random_seed for game in games],
+            exact=exact
+        )
+
+    def __len__(self):
+        return self.pos.shape[0]
+
+    @property
+    def number_of_pods(self) -> int:
+        return self.pos.shape[1]
+
+    def get_game(self, game_number: int) -> Game:
+        pods = Pods()
+        for pos, vel, ang in zip(self.pos[game_number], self.vel[game_number], self.ang[game_number]):
+            pods.add(Pod(
+                pos=Vector(x=float(pos[0]), y=float(pos[1])),
+                vel=Vector(x=float(vel[0]), y=float(vel[1])),
+                ang=float(ang)
+            ))
+        return Game(
+            pods=pods,
+            checkpoints=[
+                Vector(x=float(x), y=float(y))
+                for x, y in self.checkpoints[game_number, :self.number_of_checkpoints[game_number]]
+            ],
+            pods_next_checkpoint=[int(x) for x in self.pods_next_checkpoint[game_number]],
+            pods_laps=[int(x) for x in self.pods_laps[game_number]],
+            random_seed=self.random_seeds[game_number]
+        )
+
+    def set_game(self, game_number: int, game: Game):
+        # replaces one game of the batch, e.g. to start a new race where the old one is finished
+        if len(game.pods) != self.number_of_pods:
+            raise RuntimeError("all games must have the same number of pods")
+        if game.pods.collisions:
+            raise RuntimeError("batched games don't simulate pod collisions")
+        if len(game.checkpoints) > self.checkpoints.shape[1]:
+            padding = len(game.checkpoints) - self.checkpoints.shape[1]
+            self.checkpoints = np.pad(self.checkpoints, ((0, 0), (0, padding), (0, 0)))
+        self.pos[game_number, :, 0] = game.pods.x
+        self.pos[game_number, :, 1] = game.pods.y
+        self.vel[game_number, :, 0] = game.pods.vx
+        self.vel[game_number, :, 1] = game.pods.vy
+        self.ang[game_number] = game.pods.ang
+        self.checkpoints[game_number] = 0
+        self.checkpoints[game_number, :len(game.checkpoints)] = [(c.x, c.y) for c in game.checkpoints]
+        self.number_of_checkpoints[game_number] = len(game.checkpoints)
+        self.pods_next_checkpoint[game_number] = game.pods_next_checkpoint
+        self.pods_laps[game_number] = game.pods_laps
+        self.active[game_number] = True
+        self.random_seeds[game_number] = game.random_seed
+
+    def current_checkpoints(self) -> np.ndarray:
+        return self.checkpoints[np.arange(len(self))[:, None], self.pods_next_checkpoint]
+
+    @dataclass
+    class StepResult:
+        # games won on this step, the winning pod (-1 where nobody won)
+        # and games that are still running
+        win: np.ndarray
+        winner: np.ndarray
+        cont: np.ndarray
+
+    def step(self, target_pos: np.ndarray, thrust: np.ndarray) -> BatchGame.StepResult:
+        if target_pos.shape != self.pos.shape or thrust.shape != self.ang.shape:
+            raise RuntimeError("shape of controls does not match shape of pods")
+        target_vect = target_pos - self.pos
+        target_angle = arctan2(target_vect[..., 1], target_vect[..., 0], self.exact)
+
+        active = self.active
+        if active.all():
+            move_arrays(self.pos, self.vel, self.ang, target_angle, thrust)
+        else:
+            pos, vel, ang = self.pos[active], self.vel[active], self.ang[active]
+            move_arrays(pos, vel, ang, target_angle[active], thrust[active])
+            self.pos[active], self.vel[active], self.ang[active] = pos, vel, ang
+
+        checkpoint_vect = self.current_checkpoints() - self.pos
+        checkpoint_dist = np.sqrt(checkpoint_vect[..., 0] * checkpoint_vect[..., 0] + checkpoint_vect[..., 1] * checkpoint_vect[..., 1])
+        hit = (checkpoint_dist <= CHECKPOINT_RADIUS) & active[:, None]
+
+        next_checkpoint = self.pods_next_checkpoint + hit
+        lap_done = next_checkpoint == self.number_of_checkpoints[:, None]
+        next_checkpoint[lap_done] = 0
+        laps = self.pods_laps - lap_done
+        pod_win = lap_done & (laps == 0)
+        win = pod_win.any(axis=1)
+        winner = np.where(win, pod_win.argmax(axis=1), -1)
+
+        # Game.step returns as soon as a pod wins, so pods after the winner keep their checkpoint
+        applied = hit & ~(win[:, None] & (np.arange(self.number_of_pods) > winner[:, None]))
+        self.pods_next_checkpoint = np.where(applied, next_checkpoint, self.pods_next_checkpoint)
+        self.pods_laps = np.where(applied, laps, self.pods_laps)
+        self.active = active & ~win
+
+        return BatchGame.StepResult(win=win, winner=winner, cont=self.active.copy())
+
+    def step_strategy_outputs(self, strategy_outputs: list[list[StrategyOutput]]) -> BatchGame.StepResult:
+        return self.step(*strategy_outputs_to_arrays(strategy_outputs))
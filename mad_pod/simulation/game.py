@@ -1,40 +1,78 @@
 from __future__ import annotations
 from dataclasses import dataclass
 from typing import Optional
+from array import array
 
 import random
+import struct
 import sys
 import math
 
 from ..vector import Vector
 from ..constants import WORLD_H, WORLD_W, CHECKPOINT_RADIUS, POD_RADIUS
-from .pod_physics import Pods, Pod, PodControl
+from .pod_physics import Pods, Pod
+from .tracks import TrackCorpus
 from ..utils import get_relative_angle, degrees
 from ..strategy_communication.messages import StrategyInput, StrategyOutput
 from ..visualization.data import VisualizationData, PodVisualizationData
 
+@dataclass
+class GameSnapshot:
+    # everything that changes during a game in one flat buffer:
+    # x, y, vx, vy, ang of all pods, then their next checkpoints and laps
+    state: array
+
+    def to_bytes(self) -> bytes:
+        return self.state.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> GameSnapshot:
+        state = array('d')
+        state.frombytes(data)
+        return GameSnapshot(state)
+
+
+# number of pods, number of checkpoints, flags, seed; then checkpoints and a snapshot
+_GAME_HEADER_FORMAT = '<IIIq'
+_FLAG_COLLISIONS = 1
+_FLAG_HAS_SEED = 2
+
 @dataclass
 class Game:
     pods: Pods
     checkpoints: list[Vector]
     pods_next_checkpoint: list[int]
     pods_laps: list[int]
+    random_seed: Optional[int] = None
 
     @classmethod
-    def create(cls, number_of_pods: int, number_of_checkpoints: int, random_seed: Optional[int] = None) -> Game:
+    def create(
+        cls,
+        number_of_pods: int,
+        number_of_checkpoints: int,
+        random_seed: Optional[int] = None,
+        collisions: bool = False,
+        tracks: Optional[TrackCorpus] = None,
+        track_id: Optional[int] = None,
+        difficulty: Optional[int] = None
+    ) -> Game:
+        # with tracks the checkpoints come from the corpus instead, number_of_checkpoints is ignored:
+        # track track_id, or a track of the difficulty bucket (any bucket if it's None) picked by the seed
         if number_of_checkpoints < 2:
             raise RuntimeError("number_of_checkpoints must be >= 2")
         if number_of_pods < 1:
             raise RuntimeError("number_of_pods must be >= 1")
         random_seed = random.randrange(sys.maxsize) if random_seed is None else random_seed
         rand = random.Random(random_seed)
-        print(f"Seed is {random_seed}")
         checkpoints: list[Vector] = []
-        for i in range(number_of_checkpoints):
-            x = rand.randint(int(WORLD_W*0.1), int(WORLD_W*0.9))
-            y = rand.randint(int(WORLD_H*0.1), int(WORLD_H*0.9))
-            checkpoints.append(Vector(x=x, y=y))
-        pods = Pods()
+        if tracks is not None:
+            checkpoints = tracks.checkpoints(tracks.sample(rand, difficulty) if track_id is None else track_id)
+        else:
+            for i in range(number_of_checkpoints):
+                x = rand.randint(int(WORLD_W*0.1), int(WORLD_W*0.9))
+                y = rand.randint(int(WORLD_H*0.1), int(WORLD_H*0.9))
+                checkpoints.append(Vector(x=x, y=y))
+        pods = Pods(collisions=collisions)
         pod_start_vec = checkpoints[1] - checkpoints[0]
         pod_start_vec /=pod_start_vec.rho
         pod_start_vec = pod_start_vec.rotate(-math.pi / 2)
@@ -52,28 +90,88 @@ class Game:
             pods=pods,
             checkpoints=checkpoints,
             pods_next_checkpoint=[1]*number_of_pods,
-            pods_laps=[3]*number_of_pods
+            pods_laps=[3]*number_of_pods,
+            random_seed=random_seed
+        )
+
+    def snapshot(self) -> GameSnapshot:
+        pods = self.pods
+        state = pods.x + pods.y + pods.vx + pods.vy + pods.ang
+        state.extend(self.pods_next_checkpoint)
+        state.extend(self.pods_laps)
+        return GameSnapshot(state)
+
+    def restore(self, snapshot: GameSnapshot):
+        # the snapshot must come from a game with the same number of pods
+        pods = self.pods
+        n = len(pods)
+        state = snapshot.state
+        if len(state) != 7 * n:
+            raise RuntimeError("snapshot does not match number of pods")
+        pods.x[:] = state[0:n]
+        pods.y[:] = state[n:2 * n]
+        pods.vx[:] = state[2 * n:3 * n]
+        pods.vy[:] = state[3 * n:4 * n]
+        pods.ang[:] = state[4 * n:5 * n]
+        self.pods_next_checkpoint[:] = [int(x) for x in state[5 * n:6 * n]]
+        self.pods_laps[:] = [int(x) for x in state[6 * n:7 * n]]
+
+    def to_bytes(self) -> bytes:
+        # the whole game including the track, to send it to another process
+        flags = (_FLAG_COLLISIONS if self.pods.collisions else 0) | (0 if self.random_seed is None else _FLAG_HAS_SEED)
+        header = struct.pack(
+            _GAME_HEADER_FORMAT,
+            len(self.pods),
+            len(self.checkpoints),
+            flags,
+            0 if self.random_seed is None else self.random_seed
         )
+        checkpoints = array('d')
+        for checkpoint in self.checkpoints:
+            checkpoints.append(checkpoint.x)
+            checkpoints.append(checkpoint.y)
+        return header + checkpoints.tobytes() + self.snapshot().to_bytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> Game:
+        number_of_pods, number_of_checkpoints, flags, random_seed = struct.unpack_from(_GAME_HEADER_FORMAT, data)
+        offset = struct.calcsize(_GAME_HEADER_FORMAT)
+        checkpoints = array('d')
+        checkpoints.frombytes(data[offset:offset + number_of_checkpoints * 2 * 8])
+        offset += number_of_checkpoints * 2 * 8
+        pods = Pods(collisions=bool(flags & _FLAG_COLLISIONS))
+        for _ in range(number_of_pods):
+            pods.add(Pod(pos=Vector(x=0, y=0), vel=Vector(x=0, y=0), ang=0))
+        game = Game(
+            pods=pods,
+            checkpoints=[Vector(x=checkpoints[2 * i], y=checkpoints[2 * i + 1]) for i in range(number_of_checkpoints)],
+            pods_next_checkpoint=[0] * number_of_pods,
+            pods_laps=[0] * number_of_pods,
+            random_seed=random_seed if flags & _FLAG_HAS_SEED else None
+        )
+        game.restore(GameSnapshot.from_bytes(data[offset:]))
+        return game
 
     def get_strategy_input(self, pod_number: int) -> StrategyInput:
-        pod = self.pods[pod_number]
+        pods = self.pods
         checkpoint_pos = self.checkpoints[self.pods_next_checkpoint[pod_number]]
-        pod_pos = pod.pos
-        checkpoint_vect = checkpoint_pos - pod_pos
-        checkpoint_dist = checkpoint_vect.rho
-        checkpoint_angle = get_relative_angle(checkpoint_vect.phi, pod.ang)
-        if len(self.pods) >= 2:
-            enemy_pod = self.pods[(pod_number + 1) % len(self.pods)]
-            enemy_pos = enemy_pod.pos
+        pod_x, pod_y = pods.x[pod_number], pods.y[pod_number]
+        checkpoint_vect_x = checkpoint_pos.x - pod_x
+        checkpoint_vect_y = checkpoint_pos.y - pod_y
+        checkpoint_dist = math.sqrt(checkpoint_vect_x * checkpoint_vect_x + checkpoint_vect_y * checkpoint_vect_y)
+        checkpoint_angle = get_relative_angle(math.atan2(checkpoint_vect_y, checkpoint_vect_x), pods.ang[pod_number])
+        if len(pods) >= 2:
+            enemy_number = (pod_number + 1) % len(pods)
+            enemy_pos = (int(pods.x[enemy_number]), int(pods.y[enemy_number]))
         else:
-            enemy_pos = Vector(x=0, y=0)
+            enemy_pos = (0, 0)
 
         return StrategyInput(
-            pod_pos=(int(pod_pos.x), int(pod_pos.y)),
+            pod_pos=(int(pod_x), int(pod_y)),
             checkpoint_pos=(int(checkpoint_pos.x), int(checkpoint_pos.y)),
             checkpoint_dist=int(checkpoint_dist),
             checkpoint_angle=int(degrees(checkpoint_angle)),
-            enemy_pos=(int(enemy_pos.x), int(enemy_pos.y))
+            enemy_pos=enemy_pos
         )
 
     @dataclass
@@ -86,26 +184,25 @@ class Game:
     def step(self, strategy_outputs: list[StrategyOutput]) -> Game.ResultWin | Game.ResultContinue:
         if len(strategy_outputs) != len(self.pods):
             raise RuntimeError("number of strategy outputs is not equal to number of pods")
-        pod_controls = []
-        for pod, strategy_output in zip(self.pods, strategy_outputs):
-            target_angle = (Vector(*strategy_output.target_pos) - pod.pos).phi
+        pods = self.pods
+        thrusts = []
+        target_angles = []
+        for i, strategy_output in enumerate(strategy_outputs):
+            target_x, target_y = strategy_output.target_pos
+            target_angles.append(math.atan2(target_y - pods.y[i], target_x - pods.x[i]))
             match strategy_output.thrust:
                 case 'BOOST':
-                    thrust = 200.0
+                    thrusts.append(200.0)
                 case int(x):
-                    thrust = float(x)
-            pod_control = PodControl(
-                thrust=thrust,
-                target_angle=target_angle
-            )
-            pod_controls.append(pod_control)
-        
-        self.pods.move(pod_controls=pod_controls)
+                    thrusts.append(float(x))
+
+        pods.move_raw(thrusts, target_angles)
 
-        for i, pod in enumerate(self.pods):
+        for i in range(len(pods)):
             checkpoint = self.checkpoints[self.pods_next_checkpoint[i]]
-            checkpoint_dist = (checkpoint - pod.pos).rho
-            if checkpoint_dist <= CHECKPOINT_RADIUS:
+            dx = checkpoint.x - pods.x[i]
+            dy = checkpoint.y - pods.y[i]
+            if dx * dx + dy * dy <= CHECKPOINT_RADIUS * CHECKPOINT_RADIUS:
                 self.pods_next_checkpoint[i] += 1
                 if self.pods_next_checkpoint[i] == len(self.checkpoints):
                     self.pods_next_checkpoint[i] = 0
@@ -120,9 +217,9 @@ class Game:
             checkpoints=self.checkpoints,
             pods=[
                 PodVisualizationData(
-                    pos=Vector(x=pod.pos.x, y=pod.pos.y),
-                    ang=pod.ang
+                    pos=Vector(x=x, y=y),
+                    ang=ang
                 )
-                for pod in self.pods
+                for x, y, ang in zip(self.pods.x, self.pods.y, self.pods.ang)
             ]
         )
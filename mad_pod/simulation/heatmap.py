@@ -0,0 +1,251 @@
+from __future__ import annotations
+from typing import Optional
+from dataclasses import dataclass, field
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from ..constants import WORLD_W, WORLD_H, CHECKPOINT_RADIUS
+from ..visualization.data import VisualizationData
+
+# Occupancy heatmaps of pod positions, accumulated one match at a time into fixed-size count grids,
+# so memory depends on the number of strategies and tracks, not on the number of matches.
+#   field maps:    the WORLD_W x WORLD_H field, per strategy over all tracks, and per strategy and track
+#                  for at most max_tracks tracks, only when tracks are passed
+#   approach maps: positions around the checkpoint the pod is closest to in its lap order, per strategy.
+#                  The previous checkpoint is to the left on the x axis and the next one above it,
+#                  so racing lines, wide turns and overshoots of all checkpoints pile up in one picture
+
+DEFAULT_CELL = 50.0
+DEFAULT_APPROACH_CELL = 25.0
+DEFAULT_APPROACH_EXTENT = 3000.0
+DEFAULT_MAX_TRACKS = 32
+
+
+def _bin(points: np.ndarray, origin: tuple[float, float], cell: float, shape: tuple[int, int]) -> np.ndarray:
+    # counts of points (n, 2) per cell of a (rows, columns) grid, points outside it are dropped
+    rows, columns = shape
+    column = np.floor((points[:, 0] - origin[0]) / cell).astype(np.int64)
+    row = np.floor((points[:, 1] - origin[1]) / cell).astype(np.int64)
+    inside = (column >= 0) & (column < columns) & (row >= 0) & (row < rows)
+    return np.bincount(row[inside] * columns + column[inside], minlength=rows * columns).reshape(shape)
+
+
+def next_checkpoints(positions: np.ndarray, checkpoints: np.ndarray) -> np.ndarray:
+    # the checkpoint every pod heads to at every record of positions (records, pods, 2), derived like Game.step does.
+    # Record 0 is the start, pods head to checkpoint 1
+    records, pods, _ = positions.shape
+    result = np.empty((records, pods), dtype=np.int64)
+    current = np.ones(pods, dtype=np.int64) % len(checkpoints)
+    for record in range(records):
+        result[record] = current
+        vect = checkpoints[current] - positions[record]
+        reached = (vect * vect).sum(axis=1) <= CHECKPOINT_RADIUS * CHECKPOINT_RADIUS
+        current = np.where(reached, (current + 1) % len(checkpoints), current)
+    return result
+
+
+def approach_points(positions: np.ndarray, checkpoints: np.ndarray) -> np.ndarray:
+    # positions (records, pods, 2) in the frame of the closer of the checkpoint each pod heads to and the one it passed,
+    # returned as (records, pods, 2). The start on checkpoint 0 counts as passing it
+    n = len(checkpoints)
+    heading_to = next_checkpoints(positions, checkpoints)
+    passed = (heading_to - 1) % n
+    to_next = np.linalg.norm(checkpoints[heading_to] - positions, axis=-1)
+    to_passed = np.linalg.norm(checkpoints[passed] - positions, axis=-1)
+    anchor = np.where(to_passed < to_next, passed, heading_to)
+
+    center = checkpoints[anchor]
+    incoming = center - checkpoints[(anchor - 1) % n]
+    outgoing = checkpoints[(anchor + 1) % n] - center
+    incoming /= np.maximum(np.linalg.norm(incoming, axis=-1, keepdims=True), 1e-9)
+    relative = positions - center
+    x = (relative * incoming).sum(axis=-1)
+    y = relative[..., 1] * incoming[..., 0] - relative[..., 0] * incoming[..., 1]
+    # mirrored so that the track always turns towards +y after the checkpoint
+    turn = incoming[..., 0] * outgoing[..., 1] - incoming[..., 1] * outgoing[..., 0]
+    y = np.where(turn < 0, -y, y)
+    return np.stack([x, y], axis=-1)
+
+
+@dataclass
+class Heatmaps:
+    cell: float = DEFAULT_CELL
+    approach_cell: float = DEFAULT_APPROACH_CELL
+    approach_extent: float = DEFAULT_APPROACH_EXTENT
+    # (strategy, track) -> counts, track None is every track
+    field_counts: dict[tuple[str, Optional[str]], np.ndarray] = field(default_factory=lambda: {})
+    approach_counts: dict[str, np.ndarray] = field(default_factory=lambda: {})
+    matches: dict[str, int] = field(default_factory=lambda: {})
+    # tracks with maps of their own, the ones after them only count in the maps of every track
+    max_tracks: int = DEFAULT_MAX_TRACKS
+
+    @property
+    def field_shape(self) -> tuple[int, int]:
+        return int(np.ceil(WORLD_H / self.cell)), int(np.ceil(WORLD_W / self.cell))
+
+    @property
+    def approach_shape(self) -> tuple[int, int]:
+        size = int(np.ceil(2 * self.approach_extent / self.approach_cell))
+        return size, size
+
+    @property
+    def tracks(self) -> set[str]:
+        return {track for _, track in self.field_counts if track is not None}
+
+    def _keeps_track(self, track: Optional[str]) -> bool:
+        if track is None:
+            return False
+        tracks = self.tracks
+        return track in tracks or len(tracks) < self.max_tracks
+
+    def _accumulate(self, counts: dict, key, grid: np.ndarray):
+        if key in counts:
+            counts[key] += grid
+        else:
+            counts[key] = grid.astype(np.int64)
+
+    def add_positions(self, positions: np.ndarray, strategy: str, track: Optional[str] = None):
+        # positions (n, 2) of one strategy's pods, only the field maps
+        grid = _bin(np.asarray(positions, dtype=np.float64).reshape(-1, 2), (0.0, 0.0), self.cell, self.field_shape)
+        self._accumulate(self.field_counts, (strategy, None), grid)
+        if self._keeps_track(track):
+            self._accumulate(self.field_counts, (strategy, track), grid)
+
+    def add_match(
+        self,
+        positions: np.ndarray,
+        checkpoints: np.ndarray,
+        strategies: list[str],
+        track: Optional[str] = None
+    ):
+        # positions (records, pods, 2) of one match, strategies[pod_number] drove that pod.
+        # Pass track only for tracks that repeat, e.g. from a corpus, the first max_tracks get their own maps
+        positions = np.asarray(positions, dtype=np.float64)
+        checkpoints = np.asarray(checkpoints, dtype=np.float64)
+        approach = approach_points(positions, checkpoints)
+        extent = self.approach_extent
+        for strategy in set(strategies):
+            pods = [pod_number for pod_number, s in enumerate(strategies) if s == strategy]
+            self.add_positions(positions[:, pods].reshape(-1, 2), strategy, track)
+            grid = _bin(approach[:, pods].reshape(-1, 2), (-extent, -extent), self.approach_cell, self.approach_shape)
+            self._accumulate(self.approach_counts, strategy, grid)
+            self.matches[strategy] = self.matches.get(strategy, 0) + 1
+
+    def merge(self, other: Heatmaps):
+        if (other.cell, other.approach_cell, other.approach_extent) != (self.cell, self.approach_cell, self.approach_extent):
+            raise RuntimeError("heatmaps of different resolutions can't be merged")
+        for (strategy, track), grid in other.field_counts.items():
+            if track is None or self._keeps_track(track):
+                self._accumulate(self.field_counts, (strategy, track), grid)
+        for strategy, grid in other.approach_counts.items():
+            self._accumulate(self.approach_counts, strategy, grid)
+        for strategy, matches in other.matches.items():
+            self.matches[strategy] = self.matches.get(strategy, 0) + matches
+
+    def save(self, path: str):
+        # one npz: the grids as field_<i> and approach_<i>, what they are in the 'index' json
+        arrays: dict[str, np.ndarray] = {}
+        index: dict = {
+            'cell': self.cell,
+            'approach_cell': self.approach_cell,
+            'approach_extent': self.approach_extent,
+            'matches': self.matches,
+            'max_tracks': self.max_tracks,
+            'field': [],
+            'approach': [],
+        }
+        for i, ((strategy, track), grid) in enumerate(self.field_counts.items()):
+            arrays[f'field_{i}'] = grid
+            index['field'].append({'strategy': strategy, 'track': track})
+        for i, (strategy, grid) in enumerate(self.approach_counts.items()):
+            arrays[f'approach_{i}'] = grid
+            index['approach'].append({'strategy': strategy})
+        np.savez_compressed(path, index=np.array(json.dumps(index)), **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> Heatmaps:
+        with np.load(path) as data:
+            index = json.loads(str(data['index']))
+            heatmaps = Heatmaps(
+                cell=index['cell'],
+                approach_cell=index['approach_cell'],
+                approach_extent=index['approach_extent'],
+                matches=index['matches'],
+                # files written before it was saved
+                max_tracks=index.get('max_tracks', DEFAULT_MAX_TRACKS)
+            )
+            for i, entry in enumerate(index['field']):
+                heatmaps.field_counts[(entry['strategy'], entry['track'])] = data[f'field_{i}']
+            for i, entry in enumerate(index['approach']):
+                heatmaps.approach_counts[entry['strategy']] = data[f'approach_{i}']
+        return heatmaps
+
+
+class PositionRecorder:
+    # a visualization callback of play() keeping the pod positions of one match, at most records of them
+    def __init__(self, number_of_pods: int, records: int):
+        self.positions = np.empty((records, number_of_pods, 2), dtype=np.float32)
+        self.checkpoints: Optional[np.ndarray] = None
+        self.records = 0
+
+    def __call__(self, frame: VisualizationData):
+        if self.checkpoints is None:
+            self.checkpoints = np.array([(c.x, c.y) for c in frame.checkpoints], dtype=np.float64)
+        if self.records < len(self.positions):
+            self.positions[self.records] = [(pod.pos.x, pod.pos.y) for pod in frame.pods]
+            self.records += 1
+
+    def recorded(self) -> np.ndarray:
+        return self.positions[:self.records]
+
+
+def track_key(checkpoints: np.ndarray) -> str:
+    # stable name of a track by its checkpoints
+    return 'track-' + '-'.join(f'{int(x)}_{int(y)}' for x, y in checkpoints)
+
+
+def heatmap_image(counts: np.ndarray) -> np.ndarray:
+    # log-scaled counts as a (rows, columns, 3) uint8 image, white is empty, dark red the busiest cell
+    level = np.log1p(counts.astype(np.float64))
+    top = level.max()
+    if top > 0:
+        level /= top
+    image = np.empty(counts.shape + (3,), dtype=np.float64)
+    # white -> yellow -> red -> dark red
+    image[..., 0] = 1.0 - 0.5 * np.clip(level * 3 - 2, 0, 1)
+    image[..., 1] = 1.0 - np.clip(level * 1.5, 0, 1)
+    image[..., 2] = 1.0 - np.clip(level * 3, 0, 1)
+    return (image * 255).round().astype(np.uint8)
+
+
+def _safe_name(name: str) -> str:
+    # readable but lossy, the hash of the whole name keeps different names apart
+    digest = hashlib.sha256(name.encode()).hexdigest()[:8]
+    return ''.join(c if c.isalnum() or c in '-_.' else '_' for c in name)[:100] + '_' + digest
+
+
+def write_heatmap_images(heatmaps: Heatmaps, directory: str) -> list[str]:
+    # one PNG per map, checkpoint circles outlined on the approach maps; returns the written paths
+    from ..visualization.png import write_png
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for (strategy, track), grid in heatmaps.field_counts.items():
+        name = f'field_{_safe_name(strategy)}' + ('' if track is None else f'_{_safe_name(track)}')
+        paths.append(os.path.join(directory, name + '.png'))
+        write_png(paths[-1], heatmap_image(grid))
+    for strategy, grid in heatmaps.approach_counts.items():
+        image = heatmap_image(grid)
+        rows, columns = grid.shape
+        y, x = np.mgrid[0:rows, 0:columns]
+        x = (x + 0.5) * heatmaps.approach_cell - heatmaps.approach_extent
+        y = (y + 0.5) * heatmaps.approach_cell - heatmaps.approach_extent
+        ring = np.abs(np.hypot(x, y) - CHECKPOINT_RADIUS) < heatmaps.approach_cell / 2
+        image[ring] = (0, 0, 255)
+        paths.append(os.path.join(directory, f'approach_{_safe_name(strategy)}.png'))
+        # rows grow downwards in images, +y is up in the map
+        write_png(paths[-1], image[::-1].copy())
+    return paths
@@ -0,0 +1,354 @@
+from __future__ import annotations
+from typing import Optional, Iterator
+from dataclasses import dataclass, field, asdict
+from concurrent.futures import ProcessPoolExecutor, Future, FIRST_COMPLETED, wait
+
+import json
+import math
+import os
+import sqlite3
+import time
+
+from .play import PlayResult
+from .tournament import MatchSettings, MatchResult, run_match
+
+# A standing league of two-pod matches kept in one SQLite file.
+# Ratings are Glicko: an Elo rating plus a deviation saying how sure it is, updated after every match.
+# The scheduler always plays the pairing expected to shrink the deviations the most, so a new bot,
+# which starts unsure, mostly plays opponents near its rating until it's placed, and settled pairings
+# are left alone. Matches are written as scheduled before they're played and rated in the same
+# transaction that stores their result, so after a crash the unfinished ones are simply played again.
+# A match that fails to play, e.g. because a bot doesn't start, is stored as 'error' and rates nobody.
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bots (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    cmdline TEXT NOT NULL,
+    active INTEGER NOT NULL DEFAULT 1,
+    rating REAL NOT NULL,
+    deviation REAL NOT NULL,
+    matches INTEGER NOT NULL DEFAULT 0,
+    wins INTEGER NOT NULL DEFAULT 0,
+    draws INTEGER NOT NULL DEFAULT 0,
+    added REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS matches (
+    id INTEGER PRIMARY KEY,
+    -- pod 0 is bot_a, pod 1 bot_b
+    bot_a INTEGER NOT NULL REFERENCES bots(id),
+    bot_b INTEGER NOT NULL REFERENCES bots(id),
+    seed INTEGER NOT NULL,
+    -- 'scheduled' until the result is stored, then 'win', 'limit' or 'forfeit', or 'error' if it couldn't be played
+    status TEXT NOT NULL DEFAULT 'scheduled',
+    winner INTEGER REFERENCES bots(id),
+    steps INTEGER,
+    played REAL
+);
+CREATE INDEX IF NOT EXISTS matches_status ON matches(status);
+'''
+
+_Q = math.log(10) / 400
+
+
+@dataclass
+class LeagueSettings:
+    match_settings: MatchSettings = field(default_factory=MatchSettings)
+    initial_rating: float = 1500.0
+    initial_deviation: float = 350.0
+    # deviations never get lower, so ratings keep following bots that change behind the same name
+    min_deviation: float = 30.0
+    # pairings expected to shrink the deviations by less than this are not worth playing
+    min_gain: float = 1.0
+    # seeds of a pairing are seed_offset, seed_offset + 1, ..., pods swap places on odd seeds
+    seed_offset: int = 0
+
+    def fingerprint(self) -> dict:
+        # what the stored results must have been played with
+        match_settings = self.match_settings
+        return {
+            'step_limit': match_settings.step_limit,
+            'collisions': match_settings.collisions,
+            'tracks': match_settings.tracks,
+            'difficulty': match_settings.difficulty,
+            'time_limit': None if match_settings.time_limit is None else asdict(match_settings.time_limit),
+            'seed_offset': self.seed_offset,
+        }
+
+
+@dataclass
+class Bot:
+    id: int
+    name: str
+    cmdline: str
+    active: bool
+    rating: float
+    deviation: float
+    matches: int
+    wins: int
+    draws: int
+
+
+@dataclass
+class LeagueMatch:
+    id: int
+    bot_a: Bot
+    bot_b: Bot
+    seed: int
+
+    @property
+    def cmdlines(self) -> list[str]:
+        return [self.bot_a.cmdline, self.bot_b.cmdline]
+
+
+def _g(deviation: float) -> float:
+    return 1 / math.sqrt(1 + 3 * _Q * _Q * deviation * deviation / (math.pi * math.pi))
+
+
+def expected_score(bot: Bot, opponent: Bot) -> float:
+    return 1 / (1 + 10 ** (-_g(opponent.deviation) * (bot.rating - opponent.rating) / 400))
+
+
+def _updated(bot: Bot, opponent: Bot, score: float) -> tuple[float, float]:
+    # Glicko rating and deviation of bot after one game scoring 1, 0.5 or 0 against opponent
+    g = _g(opponent.deviation)
+    e = expected_score(bot, opponent)
+    inv_d2 = _Q * _Q * g * g * e * (1 - e)
+    precision = 1 / (bot.deviation * bot.deviation) + inv_d2
+    return bot.rating + _Q / precision * g * (score - e), math.sqrt(1 / precision)
+
+
+def expected_gain(a: Bot, b: Bot) -> float:
+    # how much one more game between a and b is expected to shrink their deviations, the score doesn't matter
+    return sum(
+        bot.deviation - _updated(bot, opponent, 0.5)[1]
+        for bot, opponent in ((a, b), (b, a))
+    )
+
+
+def _score(match_result: MatchResult) -> float:
+    # score of pod 0
+    match match_result.result:
+        case PlayResult.Win(pod_number):
+            return 1.0 if pod_number == 0 else 0.0
+        case PlayResult.Forfeit(pod_number):
+            return 0.0 if pod_number == 0 else 1.0
+        case _:
+            return 0.5
+
+
+class League:
+    def __init__(self, path: str, settings: LeagueSettings = LeagueSettings()):
+        self.path = path
+        self.settings = settings
+        self.db = sqlite3.connect(path)
+        self.db.executescript(_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self) -> League:
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _check_settings(self):
+        # stored with the first match, results played under other settings can't be mixed in
+        fingerprint = json.dumps(self.settings.fingerprint(), sort_keys=True)
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'settings'").fetchone()
+        if row is None:
+            with self.db:
+                self.db.execute("INSERT INTO meta (key, value) VALUES ('settings', ?)", (fingerprint,))
+        elif row[0] != fingerprint:
+            raise RuntimeError(f"{self.path} was played with different match settings: {row[0]}")
+
+    def _bot(self, row: tuple) -> Bot:
+        id, name, cmdline, active, rating, deviation, matches, wins, draws = row
+        return Bot(id, name, cmdline, bool(active), rating, deviation, matches, wins, draws)
+
+    _BOT_COLUMNS = 'id, name, cmdline, active, rating, deviation, matches, wins, draws'
+
+    def bots(self, active_only: bool = False) -> list[Bot]:
+        # best first
+        rows = self.db.execute(
+            f"SELECT {self._BOT_COLUMNS} FROM bots {'WHERE active' if active_only else ''} ORDER BY rating DESC"
+        ).fetchall()
+        return [self._bot(row) for row in rows]
+
+    def bot(self, name: str) -> Optional[Bot]:
+        row = self.db.execute(f"SELECT {self._BOT_COLUMNS} FROM bots WHERE name = ?", (name,)).fetchone()
+        return None if row is None else self._bot(row)
+
+    def add_bot(self, name: str, cmdline: str) -> Bot:
+        # adding a retired bot again brings it back with its rating
+        bot = self.bot(name)
+        if bot is not None and bot.cmdline != cmdline:
+            raise RuntimeError(f"bot {name!r} is already in the league as {bot.cmdline!r}")
+        with self.db:
+            if bot is None:
+                self.db.execute(
+                    "INSERT INTO bots (name, cmdline, rating, deviation, added) VALUES (?, ?, ?, ?, ?)",
+                    (name, cmdline, self.settings.initial_rating, self.settings.initial_deviation, time.time())
+                )
+            else:
+                self.db.execute("UPDATE bots SET active = 1 WHERE id = ?", (bot.id,))
+        bot = self.bot(name)
+        assert bot is not None
+        return bot
+
+    def retire_bot(self, name: str):
+        # a retired bot keeps its results but isn't scheduled anymore, its unplayed matches are dropped
+        bot = self.bot(name)
+        if bot is None:
+            raise RuntimeError(f"no bot {name!r} in the league")
+        with self.db:
+            self.db.execute("UPDATE bots SET active = 0 WHERE id = ?", (bot.id,))
+            self.db.execute(
+                "DELETE FROM matches WHERE status = 'scheduled' AND (bot_a = ? OR bot_b = ?)", (bot.id, bot.id)
+            )
+
+    def pending(self) -> list[LeagueMatch]:
+        # scheduled but not played, e.g. by a run that crashed
+        bots = {bot.id: bot for bot in self.bots()}
+        rows = self.db.execute(
+            "SELECT id, bot_a, bot_b, seed FROM matches WHERE status = 'scheduled' ORDER BY id"
+        ).fetchall()
+        return [LeagueMatch(id, bots[a], bots[b], seed) for id, a, b, seed in rows]
+
+    def _pair_counts(self) -> dict[tuple[int, int], tuple[int, int]]:
+        # (lower id, higher id) -> (all matches of the pair, unplayed ones)
+        rows = self.db.execute(
+            "SELECT MIN(bot_a, bot_b), MAX(bot_a, bot_b), COUNT(*), SUM(status = 'scheduled') FROM matches GROUP BY 1, 2"
+        ).fetchall()
+        return {(a, b): (count, scheduled) for a, b, count, scheduled in rows}
+
+    def schedule(self, exclude: frozenset[tuple[int, int]] = frozenset()) -> Optional[LeagueMatch]:
+        # the most informative pairing of the active bots, its unplayed matches count against it.
+        # None when there's nothing worth playing. exclude holds (lower id, higher id) pairs to skip
+        bots = self.bots(active_only=True)
+        counts = self._pair_counts()
+        best: Optional[tuple[float, Bot, Bot]] = None
+        for i, a in enumerate(bots):
+            for b in bots[i + 1:]:
+                gain = expected_gain(a, b)
+                if gain < self.settings.min_gain:
+                    continue
+                key = (min(a.id, b.id), max(a.id, b.id))
+                if key in exclude:
+                    continue
+                priority = gain / (1 + counts.get(key, (0, 0))[1])
+                if best is None or priority > best[0]:
+                    best = priority, a, b
+        if best is None:
+            return None
+        _, a, b = best
+        a, b = (a, b) if a.id < b.id else (b, a)
+        seed = self.settings.seed_offset + counts.get((a.id, b.id), (0, 0))[0]
+        if seed % 2 == 1:
+            a, b = b, a
+        with self.db:
+            cursor = self.db.execute("INSERT INTO matches (bot_a, bot_b, seed) VALUES (?, ?, ?)", (a.id, b.id, seed))
+        assert cursor.lastrowid is not None
+        return LeagueMatch(cursor.lastrowid, a, b, seed)
+
+    def record(self, match: LeagueMatch, match_result: MatchResult):
+        # stores the result and rates both bots with their current ratings in one transaction
+        a = self.bot(match.bot_a.name)
+        b = self.bot(match.bot_b.name)
+        assert a is not None and b is not None
+        score = _score(match_result)
+        rating_a, deviation_a = _updated(a, b, score)
+        rating_b, deviation_b = _updated(b, a, 1 - score)
+        min_deviation = self.settings.min_deviation
+        winner = None if score == 0.5 else (a.id if score == 1 else b.id)
+        status = type(match_result.result).__name__.lower()
+        match match_result.result:
+            case PlayResult.Win(_, steps) | PlayResult.Forfeit(_, steps):
+                pass
+            case _:
+                steps = self.settings.match_settings.step_limit
+        with self.db:
+            self.db.execute(
+                "UPDATE matches SET status = ?, winner = ?, steps = ?, played = ? WHERE id = ?",
+                (status, winner, steps, time.time(), match.id)
+            )
+            for bot, rating, deviation, bot_score in (
+                (a, rating_a, deviation_a, score),
+                (b, rating_b, deviation_b, 1 - score)
+            ):
+                self.db.execute(
+                    "UPDATE bots SET rating = ?, deviation = ?, matches = matches + 1, "
+                    "wins = wins + ?, draws = draws + ? WHERE id = ?",
+                    (rating, max(deviation, min_deviation), int(bot_score == 1), int(bot_score == 0.5), bot.id)
+                )
+
+    def record_error(self, match: LeagueMatch):
+        # no result, so no ratings change, but the match isn't left scheduled
+        with self.db:
+            self.db.execute(
+                "UPDATE matches SET status = 'error', played = ? WHERE id = ?", (time.time(), match.id)
+            )
+
+    def run(
+        self,
+        max_matches: Optional[int] = None,
+        processes: Optional[int] = None
+    ) -> Iterator[tuple[LeagueMatch, MatchResult | Exception]]:
+        # unfinished matches first, then one informative pairing at a time until max_matches are played
+        # or nothing is worth playing. Every match is scheduled with the ratings of all matches finished before.
+        # A match that raises is yielded with its exception and its pairing isn't scheduled again in this run
+        self._check_settings()
+        processes = processes or os.cpu_count() or 1
+        backlog = self.pending()
+        played = 0
+        failed: set[tuple[int, int]] = set()
+
+        def next_match(in_flight: int) -> Optional[LeagueMatch]:
+            if max_matches is not None and played + in_flight >= max_matches:
+                return None
+            if backlog:
+                return backlog.pop(0)
+            return self.schedule(frozenset(failed))
+
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures: dict[Future[MatchResult], LeagueMatch] = {}
+
+            def submit() -> bool:
+                match = next_match(len(futures))
+                if match is None:
+                    return False
+                futures[executor.submit(run_match, match.cmdlines, match.seed, self.settings.match_settings)] = match
+                return True
+
+            # a couple of matches queued per worker, more would be scheduled with staler ratings
+            while len(futures) < 2 * processes and submit():
+                pass
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    match = futures.pop(future)
+                    try:
+                        match_result: MatchResult | Exception = future.result()
+                    except Exception as e:
+                        match_result = e
+                        self.record_error(match)
+                        failed.add((min(match.bot_a.id, match.bot_b.id), max(match.bot_a.id, match.bot_b.id)))
+                    else:
+                        self.record(match, match_result)
+                    played += 1
+                    yield match, match_result
+                    submit()
+
+    def format(self) -> str:
+        lines = [f"{'rank':>4} {'rating':>7} {'±':>5} {'matches':>8} {'wins':>6} {'draws':>6}  bot"]
+        for rank, bot in enumerate(self.bots(active_only=True), 1):
+            lines.append(
+                f"{rank:>4} {bot.rating:>7.0f} {2 * bot.deviation:>5.0f} {bot.matches:>8} "
+                f"{bot.wins:>6} {bot.draws:>6}  {bot.name}"
+            )
+        return '\n'.join(lines)
@@ -0,0 +1,391 @@
+from __future__ import annotations
+from typing import Optional, Iterator
+from dataclasses import dataclass, field, asdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import itertools
+import json
+import math
+import os
+
+import numpy as np
+
+from .play import PlayResult
+from .tournament import MatchSettings, run_match
+
+# Parameters of a parametric strategy are substituted into its command line, "python3 strat.py --k {k}",
+# and passed as environment variables, MAD_POD_K for k with the default prefix.
+# Every candidate plays the same seeds, so differences between candidates are not drowned in track noise:
+# against opponents it plays every seed twice against each of them, once as pod 0 and once as pod 1,
+# and scores its win rate; alone it races every seed and scores minus the mean number of steps.
+
+Candidate = dict[str, float]
+# result of a match and the index of the winning strategy, 0 is the candidate
+_Outcome = tuple[PlayResult.Win | PlayResult.Limit | PlayResult.Forfeit, Optional[int]]
+
+
+@dataclass
+class Parameter:
+    name: str
+    low: float = 0.0
+    high: float = 1.0
+    # a fixed set of values instead of a range
+    values: Optional[list[float]] = None
+    integer: bool = False
+
+    @classmethod
+    def parse(cls, spec: str) -> Parameter:
+        # "name=low:high", "name=low:high:int" or "name=v1,v2,v3"
+        name, sep, rest = spec.partition('=')
+        if not sep or not name:
+            raise RuntimeError(f"parameter must look like 'name=low:high' or 'name=v1,v2', got {spec!r}")
+        if ',' in rest:
+            return Parameter(name=name, values=[float(v) for v in rest.split(',')])
+        parts = rest.split(':')
+        match parts:
+            case [low, high]:
+                return Parameter(name=name, low=float(low), high=float(high))
+            case [low, high, 'int']:
+                return Parameter(name=name, low=float(low), high=float(high), integer=True)
+            case _:
+                raise RuntimeError(f"parameter must look like 'name=low:high' or 'name=v1,v2', got {spec!r}")
+
+    def from_unit(self, u: float) -> float:
+        # maps [0, 1] onto the range or the set of values
+        u = min(max(u, 0.0), 1.0)
+        if self.values is not None:
+            return self.values[min(int(u * len(self.values)), len(self.values) - 1)]
+        value = self.low + u * (self.high - self.low)
+        return float(round(value)) if self.integer else value
+
+    def grid(self, steps: int) -> list[float]:
+        if self.values is not None:
+            return list(self.values)
+        values = [self.from_unit(i / (steps - 1)) for i in range(steps)] if steps > 1 else [self.from_unit(0.5)]
+        return sorted(set(values)) if self.integer else values
+
+
+def format_value(value: float) -> str:
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+def candidate_cmdline(template: str, candidate: Candidate) -> str:
+    try:
+        return template.format_map({name: format_value(value) for name, value in candidate.items()})
+    except (KeyError, IndexError, ValueError) as e:
+        raise RuntimeError(f"can't substitute parameters into {template!r}: {e!r}")
+
+
+def candidate_env(candidate: Candidate, prefix: str) -> dict[str, str]:
+    return {prefix + name.upper(): format_value(value) for name, value in candidate.items()}
+
+
+class GridSearch:
+    def __init__(self, parameters: list[Parameter], steps: int):
+        self.points = [
+            dict(zip([p.name for p in parameters], values))
+            for values in itertools.product(*[p.grid(steps) for p in parameters])
+        ]
+        self.generation = 0
+
+    def done(self) -> bool:
+        return self.generation > 0
+
+    def ask(self) -> list[Candidate]:
+        return self.points
+
+    def tell(self, scores: list[float]):
+        self.generation += 1
+
+    def state(self) -> dict:
+        return {'generation': self.generation}
+
+    def load_state(self, state: dict):
+        self.generation = state['generation']
+
+
+class RandomSearch:
+    def __init__(self, parameters: list[Parameter], evaluations: int, seed: int):
+        self.parameters = parameters
+        self.evaluations = evaluations
+        self.seed = seed
+        self.generation = 0
+
+    def done(self) -> bool:
+        return self.generation > 0
+
+    def ask(self) -> list[Candidate]:
+        rng = np.random.default_rng(self.seed)
+        return [
+            {p.name: p.from_unit(float(u)) for p, u in zip(self.parameters, rng.random(len(self.parameters)))}
+            for _ in range(self.evaluations)
+        ]
+
+    def tell(self, scores: list[float]):
+        self.generation += 1
+
+    def state(self) -> dict:
+        return {'generation': self.generation}
+
+    def load_state(self, state: dict):
+        self.generation = state['generation']
+
+
+class CMAES:
+    # (mu/mu_w, lambda)-CMA-ES maximizing the score, searching [0, 1] per parameter.
+    # Samples of a generation depend only on the seed, the generation and the saved state,
+    # so an interrupted generation is sampled again identically on resume
+    def __init__(self, parameters: list[Parameter], evaluations: int, seed: int, sigma: float = 0.3):
+        n = len(parameters)
+        self.parameters = parameters
+        self.seed = seed
+        self.popsize = 4 + int(3 * math.log(n))
+        self.generations = max(evaluations // self.popsize, 1)
+        self.mu = self.popsize // 2
+        weights = math.log(self.mu + 0.5) - np.log(np.arange(1, self.mu + 1))
+        self.weights = weights / weights.sum()
+        self.mueff = 1 / np.sum(self.weights ** 2)
+        self.cc = (4 + self.mueff / n) / (n + 4 + 2 * self.mueff / n)
+        self.cs = (self.mueff + 2) / (n + self.mueff + 5)
+        self.c1 = 2 / ((n + 1.3) ** 2 + self.mueff)
+        self.cmu = min(1 - self.c1, 2 * (self.mueff - 2 + 1 / self.mueff) / ((n + 2) ** 2 + self.mueff))
+        self.damps = 1 + 2 * max(0.0, math.sqrt((self.mueff - 1) / (n + 1)) - 1) + self.cs
+        self.chi_n = math.sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n * n))
+        self.mean = np.full(n, 0.5)
+        self.sigma = sigma
+        self.cov = np.eye(n)
+        self.pc = np.zeros(n)
+        self.ps = np.zeros(n)
+        self.generation = 0
+
+    def done(self) -> bool:
+        return self.generation >= self.generations
+
+    def _samples(self) -> np.ndarray:
+        eigenvalues, eigenvectors = np.linalg.eigh(self.cov)
+        scale = np.sqrt(np.maximum(eigenvalues, 0.0))
+        z = np.random.default_rng([self.seed, self.generation]).standard_normal((self.popsize, len(self.mean)))
+        return self.mean + self.sigma * (z * scale) @ eigenvectors.T
+
+    def ask(self) -> list[Candidate]:
+        return [
+            {p.name: p.from_unit(float(u)) for p, u in zip(self.parameters, x)}
+            for x in self._samples()
+        ]
+
+    def tell(self, scores: list[float]):
+        n = len(self.mean)
+        samples = self._samples()
+        selected = samples[np.argsort(scores)[::-1][:self.mu]]
+        old_mean = self.mean
+        self.mean = self.weights @ selected
+        y = (self.mean - old_mean) / self.sigma
+        eigenvalues, eigenvectors = np.linalg.eigh(self.cov)
+        inv_sqrt = eigenvectors @ np.diag(1 / np.sqrt(np.maximum(eigenvalues, 1e-20))) @ eigenvectors.T
+        self.ps = (1 - self.cs) * self.ps + math.sqrt(self.cs * (2 - self.cs) * self.mueff) * inv_sqrt @ y
+        ps_norm = float(np.linalg.norm(self.ps))
+        hsig = ps_norm / math.sqrt(1 - (1 - self.cs) ** (2 * (self.generation + 1))) / self.chi_n < 1.4 + 2 / (n + 1)
+        self.pc = (1 - self.cc) * self.pc + hsig * math.sqrt(self.cc * (2 - self.cc) * self.mueff) * y
+        steps = (selected - old_mean) / self.sigma
+        self.cov = (
+            (1 - self.c1 - self.cmu) * self.cov
+            + self.c1 * (np.outer(self.pc, self.pc) + (1 - hsig) * self.cc * (2 - self.cc) * self.cov)
+            + self.cmu * steps.T @ np.diag(self.weights) @ steps
+        )
+        self.sigma *= math.exp(self.cs / self.damps * (ps_norm / self.chi_n - 1))
+        self.generation += 1
+
+    def state(self) -> dict:
+        return {
+            'generation': self.generation,
+            'mean': self.mean.tolist(),
+            'sigma': self.sigma,
+            'cov': self.cov.tolist(),
+            'pc': self.pc.tolist(),
+            'ps': self.ps.tolist(),
+        }
+
+    def load_state(self, state: dict):
+        self.generation = state['generation']
+        self.mean = np.array(state['mean'])
+        self.sigma = state['sigma']
+        self.cov = np.array(state['cov'])
+        self.pc = np.array(state['pc'])
+        self.ps = np.array(state['ps'])
+
+
+Search = GridSearch | RandomSearch | CMAES
+
+
+@dataclass
+class OptimizeSettings:
+    # command line of the tuned strategy with {name} placeholders
+    template: str
+    parameters: list[Parameter]
+    seeds: list[int]
+    opponents: list[str] = field(default_factory=lambda: [])
+    method: str = 'cma'
+    # candidates for random search and CMA-ES
+    evaluations: int = 100
+    grid_steps: int = 5
+    random_seed: int = 0
+    env_prefix: str = 'MAD_POD_'
+    match_settings: MatchSettings = field(default_factory=MatchSettings)
+
+    def create_search(self) -> Search:
+        match self.method:
+            case 'grid':
+                return GridSearch(self.parameters, self.grid_steps)
+            case 'random':
+                return RandomSearch(self.parameters, self.evaluations, self.random_seed)
+            case 'cma':
+                return CMAES(self.parameters, self.evaluations, self.random_seed)
+            case _:
+                raise RuntimeError(f"unknown optimization method {self.method!r}")
+
+    def fingerprint(self) -> dict:
+        # what a state file must have been written with to be resumed, match settings included
+        # since scores played under different ones can't be compared
+        match_settings = self.match_settings
+        return {
+            'template': self.template,
+            'parameters': [asdict(p) for p in self.parameters],
+            'seeds': self.seeds,
+            'opponents': self.opponents,
+            'method': self.method,
+            'evaluations': self.evaluations,
+            'grid_steps': self.grid_steps,
+            'random_seed': self.random_seed,
+            'step_limit': match_settings.step_limit,
+            'collisions': match_settings.collisions,
+            'tracks': match_settings.tracks,
+            'difficulty': match_settings.difficulty,
+            'time_limit': None if match_settings.time_limit is None else asdict(match_settings.time_limit),
+        }
+
+
+@dataclass
+class Evaluation:
+    generation: int
+    index: int
+    candidate: Candidate
+    score: float
+    matches: int
+    wins: int
+
+
+@dataclass
+class _Job:
+    # one match of one candidate
+    index: int
+    cmdlines: list[str]
+    envs: list[Optional[dict[str, str]]]
+    seed: int
+    strategy_order: list[int]
+
+
+def _jobs(settings: OptimizeSettings, index: int, candidate: Candidate) -> list[_Job]:
+    cmdline = candidate_cmdline(settings.template, candidate)
+    env = candidate_env(candidate, settings.env_prefix)
+    if not settings.opponents:
+        return [_Job(index, [cmdline], [env], seed, [0]) for seed in settings.seeds]
+    return [
+        _Job(index, [cmdline, opponent], [env, None], seed, order)
+        for seed in settings.seeds
+        for opponent in settings.opponents
+        for order in ([0, 1], [1, 0])
+    ]
+
+
+def _run_job(job: _Job, match_settings: MatchSettings) -> tuple[int, _Outcome]:
+    match_result = run_match(job.cmdlines, job.seed, match_settings, job.strategy_order, job.envs)
+    return job.index, (match_result.result, match_result.winner)
+
+
+def _score(settings: OptimizeSettings, results: list[_Outcome]) -> tuple[float, int]:
+    wins = sum(1 for _, winner in results if winner == 0)
+    if settings.opponents:
+        return wins / len(results), wins
+    steps = [
+        result.steps if isinstance(result, PlayResult.Win) else settings.match_settings.step_limit
+        for result, _ in results
+    ]
+    return -sum(steps) / len(steps), wins
+
+
+class Optimizer:
+    def __init__(self, settings: OptimizeSettings, state_path: Optional[str] = None):
+        self.settings = settings
+        self.state_path = state_path
+        self.search = settings.create_search()
+        self.evaluations: list[Evaluation] = []
+        if state_path is not None and os.path.exists(state_path):
+            self._load()
+
+    def _load(self):
+        assert self.state_path is not None
+        with open(self.state_path) as f:
+            state = json.load(f)
+        fingerprint = json.loads(json.dumps(self.settings.fingerprint()))
+        if state['settings'] != fingerprint:
+            different = sorted(
+                key for key in state['settings'].keys() | fingerprint.keys()
+                if state['settings'].get(key) != fingerprint.get(key)
+            )
+            raise RuntimeError(
+                f"{self.state_path} was written by an optimization with different settings: {', '.join(different)}"
+            )
+        self.search.load_state(state['search'])
+        self.evaluations = [Evaluation(**e) for e in state['evaluations']]
+
+    def _save(self):
+        if self.state_path is None:
+            return
+        state = {
+            'settings': self.settings.fingerprint(),
+            'search': self.search.state(),
+            'evaluations': [asdict(e) for e in self.evaluations],
+        }
+        # written next to the old state and renamed, so an interruption never leaves a broken file
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def best(self) -> Optional[Evaluation]:
+        return max(self.evaluations, key=lambda e: e.score, default=None)
+
+    def run(self, processes: Optional[int] = None) -> Iterator[Evaluation]:
+        # yields every candidate as soon as all of its matches are played
+        with ProcessPoolExecutor(max_workers=processes or os.cpu_count()) as executor:
+            while not self.search.done():
+                generation = self.search.generation
+                candidates = self.search.ask()
+                done = {e.index: e for e in self.evaluations if e.generation == generation}
+                jobs = [
+                    job
+                    for index, candidate in enumerate(candidates) if index not in done
+                    for job in _jobs(self.settings, index, candidate)
+                ]
+                matches = len(self.settings.seeds) * (2 * len(self.settings.opponents) or 1)
+                results: dict[int, list[_Outcome]] = {job.index: [] for job in jobs}
+                futures = [executor.submit(_run_job, job, self.settings.match_settings) for job in jobs]
+                for future in as_completed(futures):
+                    index, outcome = future.result()
+                    results[index].append(outcome)
+                    if len(results[index]) == matches:
+                        score, wins = _score(self.settings, results[index])
+                        evaluation = Evaluation(
+                            generation=generation,
+                            index=index,
+                            candidate=candidates[index],
+                            score=score,
+                            matches=matches,
+                            wins=wins
+                        )
+                        self.evaluations.append(evaluation)
+                        done[index] = evaluation
+                        self._save()
+                        yield evaluation
+                self.search.tell([done[index].score for index in range(len(candidates))])
+                self._save()
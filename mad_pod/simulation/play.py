@@ -1,26 +1,46 @@
 from typing import Optional, Callable
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from queue import Queue
 
+import time
+
 from .game import Game
-from ..strategy_communication.communication import Strategy
-from ..strategy_communication.messages import StrategyInput
+from .replay import ReplayWriter
+from .trace import TraceSink
+from ..strategy_communication.communication import AbstractStrategy, react_all, await_order
+from ..strategy_communication.messages import StrategyInput, StrategyOutput
+from ..strategy_communication.multiplex import AbstractMultiStrategy
+from ..strategy_communication.timing import StrategyTimeout, StrategyTiming
 from ..visualization.data import VisualizationData
+from ..metrics import Metrics
 
 class PlayResult:
     @dataclass
     class Win:
         pod_number: int
+        steps: int = 0
+        strategy_timings: list[StrategyTiming] = field(default_factory=lambda: [])
 
+    @dataclass
     class Limit:
-        pass
+        strategy_timings: list[StrategyTiming] = field(default_factory=lambda: [])
+
+    @dataclass
+    class Forfeit:
+        # the pod whose strategy missed its deadline
+        pod_number: int
+        steps: int = 0
+        strategy_timings: list[StrategyTiming] = field(default_factory=lambda: [])
 
 def play(
     game: Game, 
-    strategies: list[Strategy], 
+    strategies: list[AbstractStrategy], 
     step_limit: int = 1000, 
-    visualization_data_callback: Optional[Callable[[VisualizationData], None]] = None
-) -> PlayResult.Win | PlayResult.Limit:
+    visualization_data_callback: Optional[Callable[[VisualizationData], None]] = None,
+    replay_path: Optional[str] = None,
+    metrics: Optional[Metrics] = None,
+    trace: Optional[TraceSink] = None
+) -> PlayResult.Win | PlayResult.Limit | PlayResult.Forfeit:
     match visualization_data_callback:
         case None:
             vis_cb = lambda x: None
@@ -28,23 +48,158 @@ def play(
             vis_cb = visualization_data_callback
     if len(game.pods) != len(strategies):
         raise RuntimeError("number of pods and strategies must match")
+    match metrics:
+        case None:
+            def observe(name: str, start: float):
+                pass
+        case _:
+            def observe(name: str, start: float):
+                metrics.observe(name, time.perf_counter() - start)
+    result: PlayResult.Win | PlayResult.Limit | PlayResult.Forfeit = PlayResult.Limit()
+    replay = None if replay_path is None else ReplayWriter(replay_path, game)
+    match_start = time.perf_counter()
+    steps = 0
+    step_trace = trace if trace is not None and trace.per_step else None
+    if trace is not None:
+        trace.start(game)
     try:
         vis_cb(game.get_visualization_data())
         states = [game.get_strategy_input(i) for i in range(len(strategies))]
         for i in range(step_limit):
-            print(f"step {i}")
-            strategy_outputs = [strategy.react(state) for strategy, state in zip(strategies, states)]
-            print(strategy_outputs)
+            start = time.perf_counter()
+            try:
+                strategy_outputs = react_all(strategies, states, metrics)
+            except StrategyTimeout as e:
+                assert e.strategy_number is not None
+                result = PlayResult.Forfeit(e.strategy_number, i)
+                break
+            finally:
+                observe('strategies_seconds', start)
+            start = time.perf_counter()
             step_result = game.step(strategy_outputs)
+            observe('physics_seconds', start)
+            steps += 1
+            if step_trace is not None:
+                step_trace.step(i, game, strategy_outputs)
+            if replay is not None:
+                start = time.perf_counter()
+                replay.write_step(game, strategy_outputs)
+                observe('replay_seconds', start)
+            start = time.perf_counter()
             vis_cb(game.get_visualization_data())
+            observe('visualization_seconds', start)
             match step_result:
                 case Game.ResultWin(n):
-                    return PlayResult.Win(n)
+                    result = PlayResult.Win(n, i + 1)
+                    break
                 case Game.ResultContinue():
+                    start = time.perf_counter()
                     states = [game.get_strategy_input(i) for i in range(len(strategies))]
-            print(states)
+                    observe('observation_seconds', start)
     finally:
         for strategy in strategies:
             strategy.stop()
-    
-    return PlayResult.Limit()
\ No newline at end of file
+        if replay is not None:
+            replay.close()
+
+    result.strategy_timings = [strategy.timing() for strategy in strategies]
+    if trace is not None:
+        trace.end(result, steps)
+    if metrics is not None:
+        metrics.inc('matches', result=type(result).__name__.lower())
+        metrics.inc('steps', steps)
+        for pod_number, timing in enumerate(result.strategy_timings):
+            metrics.inc('strategy_timeouts', timing.timeouts, pod=pod_number)
+        observe('match_seconds', match_start)
+    return result
+
+
+def play_multi(
+    games: list[Game],
+    strategies: list[AbstractMultiStrategy],
+    step_limit: int = 1000,
+    # strategy_orders[game_id][pod_number] is the index of the strategy driving that pod, the identity by default
+    strategy_orders: Optional[list[list[int]]] = None,
+    metrics: Optional[Metrics] = None
+) -> list[PlayResult.Win | PlayResult.Limit | PlayResult.Forfeit]:
+    # plays the games in lockstep, game ids are indices in games. Every tick each strategy gets
+    # one batch with its pod of every game still running, so a strategy process serves all the games at once
+    number_of_pods = len(strategies)
+    if strategy_orders is None:
+        strategy_orders = [list(range(number_of_pods)) for _ in games]
+    if len(strategy_orders) != len(games):
+        raise RuntimeError("number of games and strategy orders must match")
+    for game, order in zip(games, strategy_orders):
+        if len(game.pods) != number_of_pods or sorted(order) != list(range(number_of_pods)):
+            raise RuntimeError("every strategy must drive exactly one pod of every game")
+    match metrics:
+        case None:
+            def observe(name: str, start: float):
+                pass
+        case _:
+            def observe(name: str, start: float):
+                metrics.observe(name, time.perf_counter() - start)
+    # pod_numbers[game_id][strategy_number] is the pod the strategy drives in that game
+    pod_numbers = [[order.index(s) for s in range(number_of_pods)] for order in strategy_orders]
+    results: list[PlayResult.Win | PlayResult.Limit | PlayResult.Forfeit] = [PlayResult.Limit() for _ in games]
+    steps = [0] * len(games)
+    match_start = time.perf_counter()
+    try:
+        running = list(range(len(games)))
+        states = [[game.get_strategy_input(i) for i in range(number_of_pods)] for game in games]
+        for i in range(step_limit):
+            if not running:
+                break
+            start = time.perf_counter()
+            for s, strategy in enumerate(strategies):
+                strategy.begin_react_batch({g: states[g][pod_numbers[g][s]] for g in running})
+            outputs: list[list[Optional[StrategyOutput]]] = [[None] * number_of_pods for _ in games]
+            forfeits: dict[int, int] = {}
+            for s in await_order(strategies):
+                wait_start = time.perf_counter()
+                strategy_outputs = strategies[s].end_react_batch()
+                if metrics is not None:
+                    # like react_all, labeled by strategy number since pods differ between games
+                    metrics.observe('strategy_wait_seconds', time.perf_counter() - wait_start, strategy=s)
+                for g in running:
+                    if g in strategy_outputs:
+                        outputs[g][pod_numbers[g][s]] = strategy_outputs[g]
+                    elif g not in forfeits:
+                        # like react_all, the first strategy to miss its deadline forfeits
+                        forfeits[g] = pod_numbers[g][s]
+            observe('strategies_seconds', start)
+
+            start = time.perf_counter()
+            still_running = []
+            for g in running:
+                if g in forfeits:
+                    results[g] = PlayResult.Forfeit(forfeits[g], i)
+                    continue
+                game_outputs = [output for output in outputs[g] if output is not None]
+                step_result = games[g].step(game_outputs)
+                steps[g] += 1
+                match step_result:
+                    case Game.ResultWin(n):
+                        results[g] = PlayResult.Win(n, i + 1)
+                    case Game.ResultContinue():
+                        states[g] = [games[g].get_strategy_input(pod) for pod in range(number_of_pods)]
+                        still_running.append(g)
+            observe('physics_seconds', start)
+            for g in set(running) - set(still_running):
+                for strategy in strategies:
+                    strategy.finish(g)
+            running = still_running
+    finally:
+        for strategy in strategies:
+            strategy.stop()
+
+    for g, result in enumerate(results):
+        result.strategy_timings = [strategies[s].timing(g) for s in strategy_orders[g]]
+        if metrics is not None:
+            metrics.inc('matches', result=type(result).__name__.lower())
+            metrics.inc('steps', steps[g])
+            # a missed tick of a multi protocol strategy counts once for every game it served
+            for s, timing in zip(strategy_orders[g], result.strategy_timings):
+                metrics.inc('strategy_timeouts', timing.timeouts, strategy=s)
+    observe('multiplexed_seconds', match_start)
+    return results
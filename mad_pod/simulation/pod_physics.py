@@ -1,44 +1,316 @@
-from dataclasses import dataclass, field
+from __future__ import annotations
+from typing import Optional, Iterator, Sequence
+from dataclasses import dataclass
+from array import array
 
-from ..constants import POD_ROTATION_SPEED, POD_SPEED_REDUCTION
-from ..utils import get_relative_angle, clamp
+import heapq
+import math
+
+from ..constants import POD_ROTATION_SPEED, POD_SPEED_REDUCTION, POD_RADIUS, MIN_COLLISION_IMPULSE
 from ..vector import Vector
 
 
-@dataclass
+@dataclass(slots=True)
 class PodControl:
     thrust: float
     target_angle: float
 
-@dataclass
+@dataclass(slots=True)
 class Pod:
     pos: Vector
     vel: Vector
     ang: float
 
-@dataclass
+
+class VectorView(Vector):
+    # a Vector stored in two arrays of Pods, writes go to the arrays
+    __slots__ = ('_xs', '_ys', '_i')
+
+    def __init__(self, xs: array, ys: array, i: int):
+        self._xs = xs
+        self._ys = ys
+        self._i = i
+
+    @property  # type: ignore[override]
+    def x(self) -> float:
+        return self._xs[self._i]
+
+    @x.setter
+    def x(self, value: float):
+        self._xs[self._i] = value
+
+    @property  # type: ignore[override]
+    def y(self) -> float:
+        return self._ys[self._i]
+
+    @y.setter
+    def y(self, value: float):
+        self._ys[self._i] = value
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Vector):
+            return NotImplemented
+        return self.x == other.x and self.y == other.y
+
+    def __repr__(self) -> str:
+        return f'Vector(x={self.x!r}, y={self.y!r})'
+
+
+class PodView:
+    # a Pod stored in Pods, behaves like Pod and writes through to the arrays
+    __slots__ = ('_pods', '_i')
+
+    def __init__(self, pods: Pods, i: int):
+        self._pods = pods
+        self._i = i
+
+    @property
+    def pos(self) -> Vector:
+        return VectorView(self._pods.x, self._pods.y, self._i)
+
+    @pos.setter
+    def pos(self, value: Vector):
+        self._pods.x[self._i] = value.x
+        self._pods.y[self._i] = value.y
+
+    @property
+    def vel(self) -> Vector:
+        return VectorView(self._pods.vx, self._pods.vy, self._i)
+
+    @vel.setter
+    def vel(self, value: Vector):
+        self._pods.vx[self._i] = value.x
+        self._pods.vy[self._i] = value.y
+
+    @property
+    def ang(self) -> float:
+        return self._pods.ang[self._i]
+
+    @ang.setter
+    def ang(self, value: float):
+        self._pods.ang[self._i] = value
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, (Pod, PodView)):
+            return NotImplemented
+        return self.pos == other.pos and self.vel == other.vel and self.ang == other.ang
+
+    def __repr__(self) -> str:
+        return f'Pod(pos={self.pos!r}, vel={self.vel!r}, ang={self.ang!r})'
+
+
 class Pods:
-    pods: list[Pod] = field(default_factory=lambda: [])
+    # struct of arrays: pod i is (x[i], y[i]), (vx[i], vy[i]), ang[i]
+    def __init__(self, pods: Optional[list[Pod]] = None, collisions: bool = False):
+        self.collisions = collisions
+        self.x = array('d')
+        self.y = array('d')
+        self.vx = array('d')
+        self.vy = array('d')
+        self.ang = array('d')
+        for pod in pods or []:
+            self.add(pod)
 
     def add(self, pod: Pod):
-        self.pods.append(pod)
-    
-    def __getitem__(self, i: int) -> Pod:
-        return self.pods[i]
-    
+        self.x.append(pod.pos.x)
+        self.y.append(pod.pos.y)
+        self.vx.append(pod.vel.x)
+        self.vy.append(pod.vel.y)
+        self.ang.append(pod.ang)
+
+    def __getitem__(self, i: int) -> PodView:
+        if not -len(self) <= i < len(self):
+            raise IndexError("pod index out of range")
+        return PodView(self, i % len(self))
+
     def __len__(self):
-        return len(self.pods)
-    
-    def __iter__(self):
-        return iter(self.pods)
-    
+        return len(self.ang)
+
+    def __iter__(self) -> Iterator[PodView]:
+        return (PodView(self, i) for i in range(len(self)))
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Pods):
+            return NotImplemented
+        return (
+            self.collisions == other.collisions
+            and self.x == other.x and self.y == other.y
+            and self.vx == other.vx and self.vy == other.vy
+            and self.ang == other.ang
+        )
+
+    def __repr__(self) -> str:
+        return f'Pods(pods={list(self)!r})'
+
     def move(self, pod_controls: list[PodControl]):
-        if len(self.pods) != len(pod_controls):
+        if len(self) != len(pod_controls):
             raise RuntimeError("number of pod_controls must be equal to number of pods")
-        for pod, pod_control in zip(self.pods, pod_controls):
-            relative_angle = get_relative_angle(pod_control.target_angle, pod.ang)
-            pod.ang += clamp(relative_angle, -POD_ROTATION_SPEED, POD_ROTATION_SPEED)
-            pod.vel += pod_control.thrust * Vector(x=1, y=0).rotate(pod.ang)
-            pod.pos += pod.vel
-            pod.vel *= POD_SPEED_REDUCTION
-        
+        self.move_raw(
+            [pod_control.thrust for pod_control in pod_controls],
+            [pod_control.target_angle for pod_control in pod_controls]
+        )
+
+    def move_raw(self, thrusts: Sequence[float], target_angles: Sequence[float]):
+        # updates the arrays in place, without creating vectors
+        if len(self) != len(thrusts) or len(self) != len(target_angles):
+            raise RuntimeError("number of controls must be equal to number of pods")
+        xs, ys, vxs, vys, angs = self.x, self.y, self.vx, self.vy, self.ang
+        pi = math.pi
+        if self.collisions:
+            for i in range(len(angs)):
+                ang = angs[i]
+                relative_angle = (target_angles[i] + pi - ang) % (2 * pi) - pi
+                ang += min(max(relative_angle, -POD_ROTATION_SPEED), POD_ROTATION_SPEED)
+                vxs[i] += thrusts[i] * math.cos(ang)
+                vys[i] += thrusts[i] * math.sin(ang)
+                angs[i] = ang
+            self._move_with_collisions()
+            for i in range(len(angs)):
+                vxs[i] *= POD_SPEED_REDUCTION
+                vys[i] *= POD_SPEED_REDUCTION
+            return
+        for i in range(len(angs)):
+            ang = angs[i]
+            # inlined get_relative_angle and clamp
+            relative_angle = (target_angles[i] + pi - ang) % (2 * pi) - pi
+            ang += min(max(relative_angle, -POD_ROTATION_SPEED), POD_ROTATION_SPEED)
+            thrust = thrusts[i]
+            vx = vxs[i] + thrust * math.cos(ang)
+            vy = vys[i] + thrust * math.sin(ang)
+            xs[i] += vx
+            ys[i] += vy
+            vxs[i] = vx * POD_SPEED_REDUCTION
+            vys[i] = vy * POD_SPEED_REDUCTION
+            angs[i] = ang
+
+    def _move_with_collisions(self):
+        _CollisionSolver(self).run()
+
+
+class _CollisionSolver:
+    # Moves pods through one turn, resolving collisions in the order they happen.
+    # Pods are advanced lazily: pod k is at (x[k], y[k]) at time times[k] of the turn.
+    # Candidate pairs come from a uniform grid over the paths the pods take until the end of the turn,
+    # after a bounce only the two pods involved are re-inserted and re-checked
+    CELL_SIZE = 4 * POD_RADIUS
+
+    def __init__(self, pods: Pods):
+        self.pods = pods
+        n = len(pods)
+        self.times = [0.0] * n
+        self.versions = [0] * n
+        self.cells: dict[tuple[int, int], set[int]] = {}
+        self.pod_cells: list[list[tuple[int, int]]] = [[] for _ in range(n)]
+        self.events: list[tuple[float, int, int, int, int]] = []
+
+    def _pos_at(self, k: int, t: float) -> tuple[float, float]:
+        dt = t - self.times[k]
+        return self.pods.x[k] + self.pods.vx[k] * dt, self.pods.y[k] + self.pods.vy[k] * dt
+
+    def _advance(self, k: int, t: float):
+        self.pods.x[k], self.pods.y[k] = self._pos_at(k, t)
+        self.times[k] = t
+
+    def _insert(self, k: int):
+        x_start, y_start = self._pos_at(k, self.times[k])
+        x_end, y_end = self._pos_at(k, 1.0)
+        x_min = int(math.floor((min(x_start, x_end) - POD_RADIUS) / self.CELL_SIZE))
+        x_max = int(math.floor((max(x_start, x_end) + POD_RADIUS) / self.CELL_SIZE))
+        y_min = int(math.floor((min(y_start, y_end) - POD_RADIUS) / self.CELL_SIZE))
+        y_max = int(math.floor((max(y_start, y_end) + POD_RADIUS) / self.CELL_SIZE))
+        for cx in range(x_min, x_max + 1):
+            for cy in range(y_min, y_max + 1):
+                self.cells.setdefault((cx, cy), set()).add(k)
+                self.pod_cells[k].append((cx, cy))
+
+    def _remove(self, k: int):
+        for cell in self.pod_cells[k]:
+            self.cells[cell].discard(k)
+        self.pod_cells[k] = []
+
+    def _neighbours(self, k: int) -> set[int]:
+        result: set[int] = set()
+        for cell in self.pod_cells[k]:
+            result |= self.cells[cell]
+        result.discard(k)
+        return result
+
+    def _collision_time(self, i: int, j: int, t: float) -> Optional[float]:
+        # first moment in [t, 1] when pods i and j touch while approaching each other
+        pods = self.pods
+        xi, yi = self._pos_at(i, t)
+        xj, yj = self._pos_at(j, t)
+        dx = xi - xj
+        dy = yi - yj
+        dvx = pods.vx[i] - pods.vx[j]
+        dvy = pods.vy[i] - pods.vy[j]
+        a = dvx * dvx + dvy * dvy
+        b = 2 * (dx * dvx + dy * dvy)
+        if a == 0 or b >= 0:
+            return None
+        c = dx * dx + dy * dy - 4 * POD_RADIUS * POD_RADIUS
+        if c <= 0:
+            return t
+        discriminant = b * b - 4 * a * c
+        if discriminant < 0:
+            return None
+        collision_time = t + (-b - math.sqrt(discriminant)) / (2 * a)
+        return collision_time if collision_time <= 1.0 else None
+
+    def _schedule(self, i: int, j: int, t: float):
+        collision_time = self._collision_time(i, j, t)
+        if collision_time is not None:
+            heapq.heappush(self.events, (collision_time, i, j, self.versions[i], self.versions[j]))
+
+    def _bounce(self, i: int, j: int):
+        # elastic collision of two pods of equal mass with the minimal impulse of the real game
+        pods = self.pods
+        nx = pods.x[i] - pods.x[j]
+        ny = pods.y[i] - pods.y[j]
+        nn = nx * nx + ny * ny
+        if nn == 0:
+            return
+        dvx = pods.vx[i] - pods.vx[j]
+        dvy = pods.vy[i] - pods.vy[j]
+        product = nx * dvx + ny * dvy
+        fx = nx * product / (nn * 2)
+        fy = ny * product / (nn * 2)
+        impulse = math.sqrt(fx * fx + fy * fy)
+        # the first half of the impulse stops the pods, the second one pushes them apart
+        second_fx, second_fy = fx, fy
+        if 0 < impulse < MIN_COLLISION_IMPULSE:
+            second_fx *= MIN_COLLISION_IMPULSE / impulse
+            second_fy *= MIN_COLLISION_IMPULSE / impulse
+        pods.vx[i] -= fx + second_fx
+        pods.vy[i] -= fy + second_fy
+        pods.vx[j] += fx + second_fx
+        pods.vy[j] += fy + second_fy
+
+    def run(self):
+        n = len(self.pods)
+        for k in range(n):
+            self._insert(k)
+        for i in range(n):
+            for j in self._neighbours(i):
+                if i < j:
+                    self._schedule(i, j, 0.0)
+        # a safety net against endless chains of touching pods
+        budget = n * n + 16
+        while self.events and budget > 0:
+            t, i, j, version_i, version_j = heapq.heappop(self.events)
+            if version_i != self.versions[i] or version_j != self.versions[j]:
+                continue
+            budget -= 1
+            self._advance(i, t)
+            self._advance(j, t)
+            self._bounce(i, j)
+            for k in (i, j):
+                self.versions[k] += 1
+                self._remove(k)
+                self._insert(k)
+            for k in (i, j):
+                for other in self._neighbours(k):
+                    if other != i and other != j:
+                        self._schedule(min(k, other), max(k, other), t)
+        for k in range(n):
+            self._advance(k, 1.0)
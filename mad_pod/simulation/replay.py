@@ -0,0 +1,131 @@
+from __future__ import annotations
+from typing import Optional, BinaryIO
+from dataclasses import dataclass
+
+import os
+import struct
+
+import numpy as np
+
+from .game import Game
+from ..vector import Vector
+from ..strategy_communication.messages import StrategyOutput
+from ..visualization.data import VisualizationData, PodVisualizationData
+
+# Layout of a replay file, all little endian:
+#   header, HEADER_SIZE bytes: magic, version, number of pods, number of checkpoints, flags, seed
+#   checkpoints: number of checkpoints x (x, y) float64
+#   records: one STEP_DTYPE record per pod per step, the number of steps follows from the file size.
+#   Record 0 is the initial state, record k is the state after step k
+#   together with the thrust and the target that produced it
+
+REPLAY_MAGIC = b'MADPODRP'
+REPLAY_VERSION = 1
+_HEADER_FORMAT = '<8sIIIIq'
+HEADER_SIZE = 64
+_FLAG_HAS_SEED = 1
+
+STEP_DTYPE = np.dtype([
+    ('pos', '<f8', (2,)),
+    ('vel', '<f8', (2,)),
+    ('ang', '<f8'),
+    ('thrust', '<f4'),
+    ('target', '<i4', (2,)),
+])
+
+
+def _data_offset(number_of_checkpoints: int) -> int:
+    return HEADER_SIZE + number_of_checkpoints * 2 * 8
+
+
+class ReplayWriter:
+    def __init__(self, path: str, game: Game):
+        self.path = path
+        self.number_of_pods = len(game.pods)
+        self._file: BinaryIO = open(path, 'wb')
+        header = struct.pack(
+            _HEADER_FORMAT,
+            REPLAY_MAGIC,
+            REPLAY_VERSION,
+            self.number_of_pods,
+            len(game.checkpoints),
+            0 if game.random_seed is None else _FLAG_HAS_SEED,
+            0 if game.random_seed is None else game.random_seed
+        )
+        self._file.write(header.ljust(HEADER_SIZE, b'\0'))
+        self._file.write(np.array([(c.x, c.y) for c in game.checkpoints], dtype='<f8').tobytes())
+        self._record = np.zeros(self.number_of_pods, dtype=STEP_DTYPE)
+        self.write_step(game, None)
+
+    def write_step(self, game: Game, strategy_outputs: Optional[list[StrategyOutput]]):
+        record = self._record
+        pods = game.pods
+        record['pos'][:, 0] = pods.x
+        record['pos'][:, 1] = pods.y
+        record['vel'][:, 0] = pods.vx
+        record['vel'][:, 1] = pods.vy
+        record['ang'] = pods.ang
+        if strategy_outputs is not None:
+            for i, strategy_output in enumerate(strategy_outputs):
+                record[i]['thrust'] = 200.0 if strategy_output.thrust == 'BOOST' else strategy_output.thrust
+                record[i]['target'] = strategy_output.target_pos
+        self._file.write(record.tobytes())
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self) -> ReplayWriter:
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+@dataclass
+class Replay:
+    seed: Optional[int]
+    checkpoints: np.ndarray
+    # memory-mapped records, shape (steps + 1, pods)
+    records: np.ndarray
+
+    @classmethod
+    def open(cls, path: str) -> Replay:
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+        if len(header) != HEADER_SIZE:
+            raise RuntimeError(f"{path} is too short to be a replay")
+        magic, version, number_of_pods, number_of_checkpoints, flags, seed = struct.unpack_from(_HEADER_FORMAT, header)
+        if magic != REPLAY_MAGIC:
+            raise RuntimeError(f"{path} is not a replay")
+        if version != REPLAY_VERSION:
+            raise RuntimeError(f"unsupported replay version {version}")
+        checkpoints = np.memmap(path, dtype='<f8', mode='r', offset=HEADER_SIZE, shape=(number_of_checkpoints, 2))
+        offset = _data_offset(number_of_checkpoints)
+        # a partially written last step is ignored
+        number_of_records = (os.path.getsize(path) - offset) // (STEP_DTYPE.itemsize * number_of_pods)
+        records = np.memmap(path, dtype=STEP_DTYPE, mode='r', offset=offset, shape=(number_of_records, number_of_pods))
+        return Replay(
+            seed=seed if flags & _FLAG_HAS_SEED else None,
+            checkpoints=checkpoints,
+            records=records
+        )
+
+    def __len__(self):
+        return self.records.shape[0]
+
+    @property
+    def number_of_pods(self) -> int:
+        return self.records.shape[1]
+
+    def get_visualization_data(self, record_number: int) -> VisualizationData:
+        record = self.records[record_number]
+        return VisualizationData(
+            checkpoints=[Vector(x=float(x), y=float(y)) for x, y in self.checkpoints],
+            pods=[
+                PodVisualizationData(
+                    pos=Vector(x=float(pod['pos'][0]), y=float(pod['pos'][1])),
+                    ang=float(pod['ang'])
+                )
+                for pod in record
+            ]
+        )
@@ -0,0 +1,192 @@
+from __future__ import annotations
+from typing import Optional, Any
+
+import hashlib
+import importlib.util
+import json
+import os
+import pickle
+import shlex
+import shutil
+import sqlite3
+import time
+
+# Results of matches kept in one SQLite file, addressed by a hash of everything that decides them:
+# the simulator's source, every strategy's command line and the contents of the files it names,
+# the seed, the pod order and the match settings. Changing a bot's binary or script, or any source
+# of this package, changes the key, so stale results are never returned, only evicted eventually.
+# Rows are evicted least recently used first once their pickled results add up to more than max_bytes.
+# The file itself isn't shrunk, SQLite reuses the freed pages, so it stays a bit above max_bytes.
+
+DEFAULT_CACHE_SIZE = 1 << 30
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_used ON results(used);
+-- 'total' is the sum of results.size, kept up to date by every put so that it isn't summed each time
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+'''
+
+# file hashes of the current process by (path, size, mtime), bot binaries can be large
+_file_hashes: dict[tuple[str, int, int], str] = {}
+_simulator_hash: Optional[str] = None
+
+
+def file_hash(path: str) -> str:
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    if key not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while chunk := f.read(1 << 20):
+                digest.update(chunk)
+        _file_hashes[key] = digest.hexdigest()
+    return _file_hashes[key]
+
+
+def simulator_hash() -> str:
+    # every python file of the package, builtin bots included
+    global _simulator_hash
+    if _simulator_hash is None:
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        digest = hashlib.sha256()
+        for directory, dirs, files in sorted(os.walk(root)):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith('.py'):
+                    path = os.path.join(directory, name)
+                    digest.update(os.path.relpath(path, root).encode())
+                    digest.update(file_hash(path).encode())
+        _simulator_hash = digest.hexdigest()
+    return _simulator_hash
+
+
+def strategy_fingerprint(spec: str) -> Optional[dict[str, Any]]:
+    # the spec and the hashes of the files it runs, None if its files can't be found
+    from ..strategy_communication.factory import (
+        PYTHON_STRATEGY_PREFIX, is_python_strategy, is_builtin_strategy, parse_process_spec
+    )
+    files: dict[str, str] = {}
+    if is_builtin_strategy(spec):
+        # part of the simulator hash
+        pass
+    elif is_python_strategy(spec):
+        # "package.module:name" or "path/to/file.py:name", like in_process.load_object
+        module = spec[len(PYTHON_STRATEGY_PREFIX):].rpartition(':')[0]
+        if module.endswith('.py'):
+            if not os.path.isfile(module):
+                return None
+            files[module] = file_hash(module)
+        else:
+            try:
+                module_spec = importlib.util.find_spec(module)
+            except (ImportError, ValueError):
+                return None
+            if module_spec is None:
+                return None
+            if module_spec.origin is not None and os.path.isfile(module_spec.origin):
+                files[module] = file_hash(module_spec.origin)
+    else:
+        cmd_line, _ = parse_process_spec(spec)
+        for i, token in enumerate(shlex.split(cmd_line)):
+            # the program through PATH, then every argument that is a file: scripts, weights, configs
+            path = shutil.which(token) if i == 0 and not os.path.isfile(token) else token
+            if path is not None and os.path.isfile(path):
+                files[token] = file_hash(path)
+    return {'spec': spec, 'files': files}
+
+
+def match_key(
+    cmdlines: list[str],
+    seed: int,
+    strategy_order: list[int],
+    envs: list[Optional[dict[str, str]]],
+    settings: dict[str, Any]
+) -> Optional[str]:
+    # settings are the MatchSettings fields that change results, see tournament._cache_settings.
+    # None when a strategy can't be fingerprinted, its matches aren't cached
+    strategies = [strategy_fingerprint(cmdline) for cmdline in cmdlines]
+    if any(strategy is None for strategy in strategies):
+        return None
+    key = {
+        'simulator': simulator_hash(),
+        'strategies': strategies,
+        'envs': envs,
+        'seed': seed,
+        'strategy_order': strategy_order,
+        'settings': settings,
+    }
+    if settings.get('tracks') is not None:
+        key['tracks_hash'] = file_hash(settings['tracks'])
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, path: str, max_bytes: int = DEFAULT_CACHE_SIZE):
+        self.path = path
+        self.max_bytes = max_bytes
+        # workers of a tournament share the file, they wait for each other's writes
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(_SCHEMA)
+        with self.db:
+            # files written before the running total
+            self.db.execute(
+                "INSERT OR IGNORE INTO meta (key, value) SELECT 'total', COALESCE(SUM(size), 0) FROM results"
+            )
+
+    def close(self):
+        self.db.close()
+
+    def get(self, key: str) -> Optional[Any]:
+        row = self.db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        with self.db:
+            self.db.execute("UPDATE results SET used = ? WHERE key = ?", (time.time(), key))
+        return pickle.loads(row[0])
+
+    def put(self, key: str, value: Any):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.db:
+            # the first write takes the lock, so the replaced row's size can't change before the insert
+            self.db.execute(
+                "UPDATE meta SET value = value + ? - COALESCE((SELECT size FROM results WHERE key = ?), 0) "
+                "WHERE key = 'total'",
+                (len(data), key)
+            )
+            self.db.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, used) VALUES (?, ?, ?, ?)",
+                (key, data, len(data), time.time())
+            )
+            total = self._total()
+            if total > self.max_bytes:
+                self._evict(total - self.max_bytes)
+
+    def _total(self) -> int:
+        return self.db.execute("SELECT value FROM meta WHERE key = 'total'").fetchone()[0]
+
+    def _evict(self, excess: int):
+        evicted = []
+        evicted_size = 0
+        for key, size in self.db.execute("SELECT key, size FROM results ORDER BY used"):
+            if evicted_size >= excess:
+                break
+            evicted.append((key,))
+            evicted_size += size
+        self.db.executemany("DELETE FROM results WHERE key = ?", evicted)
+        self.db.execute("UPDATE meta SET value = value - ? WHERE key = 'total'", (evicted_size,))
+
+    def stats(self) -> tuple[int, int]:
+        # number of results and their bytes
+        count = self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        return count, self._total()
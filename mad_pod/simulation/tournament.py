@@ -0,0 +1,347 @@
+from __future__ import annotations
+from typing import Optional, Iterable, Iterator
+from dataclasses import dataclass, field, asdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import os
+
+import numpy as np
+
+from .game import Game
+from .heatmap import PositionRecorder
+from .result_cache import ResultCache, match_key, DEFAULT_CACHE_SIZE
+from .play import play, play_multi, PlayResult
+from .trace import TraceSink
+from .tracks import open_tracks
+from ..strategy_communication.communication import AbstractStrategy, StrategyPool
+from ..strategy_communication.factory import (
+    make_strategy, make_multi_strategy, is_in_process_strategy, parse_process_spec,
+    is_time_budgeted_strategy
+)
+from ..strategy_communication.timing import TimeLimit, StrategyTiming
+from ..metrics import Metrics
+
+
+@dataclass
+class MatchSettings:
+    step_limit: int = 500
+    # warm processes kept per strategy in every worker, 0 starts a fresh process per match
+    pool_size: int = 0
+    games_per_process: int = 1
+    time_limit: Optional[TimeLimit] = None
+    collisions: bool = False
+    # collect per-phase metrics of every match
+    metrics: bool = False
+    # directory where a replay of every match is written as <seed>.mpr
+    replay_dir: Optional[str] = None
+    # directory where a trace of every match is written as <seed>.jsonl, or <seed>.jsonl.gz with trace_gzip
+    trace_dir: Optional[str] = None
+    trace_level: str = 'summary'
+    trace_gzip: bool = False
+    # track corpus file, tracks are then picked by seed, from one difficulty bucket if it's set
+    tracks: Optional[str] = None
+    difficulty: Optional[int] = None
+    # matches a worker plays in lockstep, "multi:" strategies serve all of them from one process.
+    # Such a strategy has one deadline per tick for all its games: missing it with on_timeout 'forfeit'
+    # forfeits every game of the batch at once, with 'default' all of them get the default move.
+    # Replays, traces and heatmap positions are only kept for matches that aren't multiplexed,
+    # metrics are summed over the batch
+    multiplex: int = 1
+    # return the pod positions of every match for heatmaps, see heatmap.Heatmaps.add_match
+    heatmap: bool = False
+    # result cache file, matches already played with the same strategy files, seed and settings aren't played again.
+    # Matches writing replays, traces or heatmaps are always played
+    cache: Optional[str] = None
+    cache_size: int = DEFAULT_CACHE_SIZE
+    # nondeterministic strategies, matches with any of them are never cached, nor are those with time-budgeted builtins
+    uncached: list[str] = field(default_factory=lambda: [])
+
+
+@dataclass
+class MatchResult:
+    seed: int
+    # strategy_order[pod_number] is the index of the strategy driving that pod
+    strategy_order: list[int]
+    result: PlayResult.Win | PlayResult.Limit | PlayResult.Forfeit
+    # labeled by strategy command line instead of pod number
+    metrics: Optional[Metrics] = None
+    # (records, pods, 2) float32 and the track's checkpoints with MatchSettings.heatmap
+    positions: Optional[np.ndarray] = None
+    checkpoints: Optional[np.ndarray] = None
+    # the result comes from MatchSettings.cache
+    cached: bool = False
+
+    @property
+    def winner(self) -> Optional[int]:
+        match self.result:
+            case PlayResult.Win(pod_number):
+                return self.strategy_order[pod_number]
+            case _:
+                return None
+
+
+# warm strategy processes of the current worker process, one pool per command line
+_pools: dict[str, StrategyPool] = {}
+
+def _get_pool(spec: str, size: int, games_per_process: int) -> StrategyPool:
+    if spec not in _pools:
+        cmd_line, protocol = parse_process_spec(spec)
+        _pools[spec] = StrategyPool(cmd_line, size, games_per_process, protocol)
+    return _pools[spec]
+
+
+def _make_strategy(spec: str, settings: MatchSettings, env: Optional[dict[str, str]] = None) -> AbstractStrategy:
+    if settings.pool_size == 0 or is_in_process_strategy(spec) or env is not None:
+        return make_strategy(spec, settings.time_limit, env)
+    return _get_pool(spec, settings.pool_size, settings.games_per_process).strategy(settings.time_limit)
+
+
+# result caches of the current worker process by path
+_caches: dict[str, ResultCache] = {}
+
+def _get_cache(settings: MatchSettings) -> Optional[ResultCache]:
+    if settings.cache is None:
+        return None
+    if settings.replay_dir is not None or settings.trace_dir is not None or settings.heatmap:
+        return None
+    if settings.cache not in _caches:
+        _caches[settings.cache] = ResultCache(settings.cache, settings.cache_size)
+    return _caches[settings.cache]
+
+
+def _cache_settings(settings: MatchSettings) -> dict:
+    # the settings that change the result of a match
+    return {
+        'step_limit': settings.step_limit,
+        'collisions': settings.collisions,
+        'tracks': settings.tracks,
+        'difficulty': settings.difficulty,
+        'time_limit': None if settings.time_limit is None else asdict(settings.time_limit),
+        'metrics': settings.metrics,
+    }
+
+
+def _cache_lookup(
+    cache: Optional[ResultCache],
+    cmdlines: list[str],
+    seed: int,
+    strategy_order: list[int],
+    envs: list[Optional[dict[str, str]]],
+    settings: MatchSettings
+) -> tuple[Optional[str], Optional[tuple]]:
+    # the key to store the result under, None if it must not be cached, and the cached (result, metrics)
+    if cache is None or any(
+        cmdlines[i] in settings.uncached or is_time_budgeted_strategy(cmdlines[i]) for i in strategy_order
+    ):
+        return None, None
+    key = match_key(cmdlines, seed, strategy_order, envs, _cache_settings(settings))
+    if key is None:
+        return None, None
+    return key, cache.get(key)
+
+
+def _cacheable(result: PlayResult.Win | PlayResult.Limit | PlayResult.Forfeit) -> bool:
+    # a missed deadline depends on the machine's load, not only on the strategies
+    match result:
+        case PlayResult.Forfeit():
+            return False
+    return all(timing.timeouts == 0 for timing in result.strategy_timings)
+
+
+def run_match(
+    cmdlines: list[str],
+    seed: int,
+    settings: MatchSettings = MatchSettings(),
+    strategy_order: Optional[list[int]] = None,
+    # extra environment variables of every strategy, strategies with them are never pooled
+    envs: Optional[list[Optional[dict[str, str]]]] = None
+) -> MatchResult:
+    strategy_order = list(range(len(cmdlines))) if strategy_order is None else strategy_order
+    envs = [None] * len(cmdlines) if envs is None else envs
+    cache = _get_cache(settings)
+    key, cached = _cache_lookup(cache, cmdlines, seed, strategy_order, envs, settings)
+    if cached is not None:
+        result, metrics = cached
+        return MatchResult(seed=seed, strategy_order=strategy_order, result=result, metrics=metrics, cached=True)
+    strategies = [_make_strategy(cmdlines[i], settings, envs[i]) for i in strategy_order]
+    game = _create_game(len(strategies), seed, settings)
+    replay_path = None if settings.replay_dir is None else os.path.join(settings.replay_dir, f'{seed}.mpr')
+    metrics = Metrics() if settings.metrics else None
+    trace = None
+    if settings.trace_dir is not None:
+        trace_name = f'{seed}.jsonl.gz' if settings.trace_gzip else f'{seed}.jsonl'
+        trace = TraceSink(settings.trace_level, os.path.join(settings.trace_dir, trace_name))
+    recorder = PositionRecorder(len(strategies), settings.step_limit + 1) if settings.heatmap else None
+    try:
+        result = play(
+            game, strategies, settings.step_limit, recorder,
+            replay_path=replay_path, metrics=metrics, trace=trace
+        )
+    finally:
+        if trace is not None:
+            trace.close()
+    if metrics is not None:
+        metrics.relabel(
+            'pod', {str(pod_number): cmdlines[i] for pod_number, i in enumerate(strategy_order)}, 'strategy'
+        )
+    if cache is not None and key is not None and _cacheable(result):
+        cache.put(key, (result, metrics))
+    match_result = MatchResult(seed=seed, strategy_order=strategy_order, result=result, metrics=metrics)
+    if recorder is not None:
+        match_result.positions = recorder.recorded()
+        match_result.checkpoints = recorder.checkpoints
+    return match_result
+
+
+def _create_game(number_of_pods: int, seed: int, settings: MatchSettings) -> Game:
+    return Game.create(
+        number_of_pods, 4, seed, settings.collisions,
+        tracks=None if settings.tracks is None else open_tracks(settings.tracks),
+        difficulty=settings.difficulty
+    )
+
+
+def run_matches(
+    cmdlines: list[str],
+    seeds: list[int],
+    settings: MatchSettings = MatchSettings(),
+    strategy_orders: Optional[list[list[int]]] = None
+) -> list[MatchResult]:
+    # the matches of seeds played in lockstep, see play_multi
+    if settings.replay_dir is not None or settings.trace_dir is not None or settings.heatmap:
+        raise RuntimeError("multiplexed matches write neither replays, traces nor heatmaps")
+    strategy_orders = [list(range(len(cmdlines))) for _ in seeds] if strategy_orders is None else strategy_orders
+    envs: list[Optional[dict[str, str]]] = [None] * len(cmdlines)
+    # cached results are shared with run_match, except with metrics, which are only known for the whole batch
+    cache = None if settings.metrics else _get_cache(settings)
+    match_results: list[Optional[MatchResult]] = []
+    keys: list[Optional[str]] = []
+    for seed, order in zip(seeds, strategy_orders):
+        key, cached = _cache_lookup(cache, cmdlines, seed, order, envs, settings)
+        keys.append(key)
+        match_results.append(
+            None if cached is None else MatchResult(seed=seed, strategy_order=order, result=cached[0], cached=True)
+        )
+    to_play = [i for i, match_result in enumerate(match_results) if match_result is None]
+    metrics = Metrics() if settings.metrics else None
+    if to_play:
+        strategies = [
+            make_multi_strategy(spec, settings.time_limit, factory=lambda spec=spec: _make_strategy(spec, settings))
+            for spec in cmdlines
+        ]
+        games = [_create_game(len(cmdlines), seeds[i], settings) for i in to_play]
+        results = play_multi(games, strategies, settings.step_limit, [strategy_orders[i] for i in to_play], metrics)
+        for i, result in zip(to_play, results):
+            match_results[i] = MatchResult(seed=seeds[i], strategy_order=strategy_orders[i], result=result)
+            key = keys[i]
+            if cache is not None and key is not None and _cacheable(result):
+                cache.put(key, (result, None))
+    if metrics is not None:
+        metrics.relabel('strategy', {str(i): cmdline for i, cmdline in enumerate(cmdlines)})
+    played = [match_result for match_result in match_results if match_result is not None]
+    # metrics of the whole batch, they are merged anyway
+    if played:
+        played[0].metrics = metrics
+    return played
+
+
+def _rotated_order(number_of_strategies: int, seed: int) -> list[int]:
+    shift = seed % number_of_strategies
+    return [(i + shift) % number_of_strategies for i in range(number_of_strategies)]
+
+
+def run_tournament(
+    cmdlines: list[str],
+    seeds: Iterable[int],
+    settings: MatchSettings = MatchSettings(),
+    processes: Optional[int] = None,
+    rotate: bool = True
+) -> Iterator[MatchResult]:
+    # matches are yielded as soon as they finish, not in seed order
+    def order(seed: int) -> list[int]:
+        return _rotated_order(len(cmdlines), seed) if rotate else list(range(len(cmdlines)))
+
+    with ProcessPoolExecutor(max_workers=processes or os.cpu_count()) as executor:
+        if settings.multiplex > 1:
+            seed_list = list(seeds)
+            chunks = [seed_list[i:i + settings.multiplex] for i in range(0, len(seed_list), settings.multiplex)]
+            for future in as_completed([
+                executor.submit(run_matches, cmdlines, chunk, settings, [order(seed) for seed in chunk])
+                for chunk in chunks
+            ]):
+                yield from future.result()
+            return
+        futures = [
+            executor.submit(run_match, cmdlines, seed, settings, order(seed))
+            for seed in seeds
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+@dataclass
+class StrategyStats:
+    cmdline: str
+    matches: int = 0
+    wins: int = 0
+    forfeits: int = 0
+    win_steps: list[int] = field(default_factory=lambda: [])
+    # worst per-match response times in seconds
+    max_p99: Optional[float] = None
+    max_latency: Optional[float] = None
+
+    def add_timing(self, timing: StrategyTiming):
+        if timing.p99 is not None:
+            self.max_p99 = timing.p99 if self.max_p99 is None else max(self.max_p99, timing.p99)
+        if timing.max is not None:
+            self.max_latency = timing.max if self.max_latency is None else max(self.max_latency, timing.max)
+
+    @property
+    def mean_steps_to_finish(self) -> Optional[float]:
+        if len(self.win_steps) == 0:
+            return None
+        return sum(self.win_steps) / len(self.win_steps)
+
+
+@dataclass
+class TournamentSummary:
+    strategies: list[StrategyStats]
+    limits: int = 0
+    cached: int = 0
+
+    @classmethod
+    def create(cls, cmdlines: list[str]) -> TournamentSummary:
+        return TournamentSummary(strategies=[StrategyStats(cmdline) for cmdline in cmdlines])
+
+    def add(self, match_result: MatchResult):
+        if match_result.cached:
+            self.cached += 1
+        for i in match_result.strategy_order:
+            self.strategies[i].matches += 1
+        for i, timing in zip(match_result.strategy_order, match_result.result.strategy_timings):
+            self.strategies[i].add_timing(timing)
+        match match_result.result:
+            case PlayResult.Win(pod_number, steps):
+                stats = self.strategies[match_result.strategy_order[pod_number]]
+                stats.wins += 1
+                stats.win_steps.append(steps)
+            case PlayResult.Forfeit(pod_number):
+                self.strategies[match_result.strategy_order[pod_number]].forfeits += 1
+            case PlayResult.Limit():
+                self.limits += 1
+
+    def format(self) -> str:
+        def ms(x: Optional[float]) -> str:
+            return '-' if x is None else f'{x * 1000:.1f}'
+        lines = [f"{'wins':>6} {'matches':>8} {'forfeits':>8} {'mean steps':>10} {'p99 ms':>8} {'max ms':>8}  strategy"]
+        for stats in sorted(self.strategies, key=lambda s: -s.wins):
+            mean_steps = stats.mean_steps_to_finish
+            mean_steps_str = '-' if mean_steps is None else f'{mean_steps:.1f}'
+            lines.append(
+                f"{stats.wins:>6} {stats.matches:>8} {stats.forfeits:>8} {mean_steps_str:>10} "
+                f"{ms(stats.max_p99):>8} {ms(stats.max_latency):>8}  {stats.cmdline}"
+            )
+        lines.append(f"step limit reached in {self.limits} matches")
+        if self.cached > 0:
+            lines.append(f"{self.cached} results from the cache")
+        return '\n'.join(lines)
@@ -0,0 +1,84 @@
+from __future__ import annotations
+from typing import Optional, TextIO
+
+import gzip
+import json
+import sys
+
+from .game import Game
+from ..strategy_communication.messages import StrategyOutput
+
+# off: nothing, summary: one record when a match starts and one when it ends, step: also one record per step
+TRACE_LEVELS = ('off', 'summary', 'step')
+
+
+class TraceSink:
+    # Writes trace records as JSON lines to stdout or to a file, gzip-compressed when the path ends with .gz.
+    # Records are collected in memory and written in chunks of buffer_records
+    def __init__(self, level: str = 'summary', path: Optional[str] = None, buffer_records: int = 256):
+        if level not in TRACE_LEVELS:
+            raise RuntimeError(f"trace level must be one of {', '.join(TRACE_LEVELS)}")
+        self.level = level
+        self.path = path
+        self.buffer_records = buffer_records
+        self.summary = level != 'off'
+        self.per_step = level == 'step'
+        self._records: list[str] = []
+        self._file: TextIO
+        if path is None:
+            self._file = sys.stdout
+        elif path.endswith('.gz'):
+            self._file = gzip.open(path, 'wt', compresslevel=6)
+        else:
+            self._file = open(path, 'w', buffering=1 << 16)
+
+    def _write(self, record: dict):
+        self._records.append(json.dumps(record, separators=(',', ':')))
+        if len(self._records) >= self.buffer_records:
+            self.flush()
+
+    def start(self, game: Game):
+        if self.summary:
+            self._write({
+                'event': 'start',
+                'seed': game.random_seed,
+                'pods': len(game.pods),
+                'checkpoints': [(c.x, c.y) for c in game.checkpoints],
+            })
+
+    def step(self, step_number: int, game: Game, strategy_outputs: list[StrategyOutput]):
+        # the state after the step together with the outputs that produced it
+        if self.per_step:
+            pods = game.pods
+            self._write({
+                'event': 'step',
+                'step': step_number,
+                'outputs': [(*o.target_pos, o.thrust) for o in strategy_outputs],
+                'pods': list(zip(pods.x, pods.y, pods.vx, pods.vy, pods.ang)),
+            })
+
+    def end(self, result: object, steps: int):
+        if self.summary:
+            self._write({
+                'event': 'end',
+                'result': type(result).__name__.lower(),
+                'pod': getattr(result, 'pod_number', None),
+                'steps': steps,
+            })
+
+    def flush(self):
+        if self._records:
+            self._file.write('\n'.join(self._records) + '\n')
+            self._records = []
+        self._file.flush()
+
+    def close(self):
+        self.flush()
+        if self.path is not None:
+            self._file.close()
+
+    def __enter__(self) -> TraceSink:
+        return self
+
+    def __exit__(self, *args):
+        self.close()
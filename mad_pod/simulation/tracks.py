@@ -0,0 +1,192 @@
+from __future__ import annotations
+from typing import Optional
+from dataclasses import dataclass, field
+
+import os
+import random
+import struct
+
+import numpy as np
+
+from ..constants import WORLD_W, WORLD_H, CHECKPOINT_RADIUS
+from ..vector import Vector
+
+# Layout of a track corpus file, all little endian:
+#   header, HEADER_SIZE bytes: magic, version, number of tracks, max checkpoints per track, number of difficulty buckets
+#   records: one TRACK_DTYPE record per track, track i is record i.
+# Checkpoints of a track are checkpoints[:count], the rest is zero padding
+
+TRACKS_MAGIC = b'MADPODTR'
+TRACKS_VERSION = 1
+_HEADER_FORMAT = '<8sIIII'
+HEADER_SIZE = 32
+
+MAX_CHECKPOINTS = 8
+# checkpoints closer than this overlap or nearly do
+DEFAULT_MIN_SPACING = 2 * CHECKPOINT_RADIUS + 400
+
+
+def track_dtype(max_checkpoints: int) -> np.dtype:
+    return np.dtype([
+        ('checkpoints', '<i4', (max_checkpoints, 2)),
+        ('count', '<u1'),
+        ('difficulty', '<u1'),
+        # total length of one lap
+        ('length', '<f4'),
+        # mean and max of the turn the pods make at the checkpoints, radians
+        ('sharpness', '<f4'),
+        ('max_turn', '<f4'),
+    ])
+
+
+def _sample_candidates(
+    rng: np.random.Generator,
+    size: int,
+    min_checkpoints: int,
+    max_checkpoints: int,
+    min_spacing: float
+) -> tuple[np.ndarray, np.ndarray]:
+    # same bounds as Game.create, invalid tracks are rejected all at once
+    counts = rng.integers(min_checkpoints, max_checkpoints + 1, size)
+    checkpoints = np.empty((size, max_checkpoints, 2), dtype=np.int64)
+    checkpoints[..., 0] = rng.integers(int(WORLD_W * 0.1), int(WORLD_W * 0.9) + 1, (size, max_checkpoints))
+    checkpoints[..., 1] = rng.integers(int(WORLD_H * 0.1), int(WORLD_H * 0.9) + 1, (size, max_checkpoints))
+    index = np.arange(max_checkpoints)
+    used = index[None, :] < counts[:, None]
+    diff = checkpoints[:, :, None, :] - checkpoints[:, None, :, :]
+    dist2 = (diff * diff).sum(axis=-1)
+    pairs = used[:, :, None] & used[:, None, :] & (index[:, None] < index[None, :])
+    too_close = pairs & (dist2 < min_spacing * min_spacing)
+    valid = ~too_close.any(axis=(1, 2))
+    return checkpoints[valid], counts[valid]
+
+
+def track_metrics(checkpoints: np.ndarray, counts: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # lap length, mean and max turn angle of every track, padding is ignored
+    max_checkpoints = checkpoints.shape[1]
+    index = np.arange(max_checkpoints)
+    used = index[None, :] < counts[:, None]
+    tracks = np.arange(len(counts))[:, None]
+    following = checkpoints[tracks, (index[None, :] + 1) % counts[:, None]].astype(np.float64)
+    preceding = checkpoints[tracks, (index[None, :] - 1) % counts[:, None]].astype(np.float64)
+    outgoing = following - checkpoints
+    incoming = checkpoints - preceding
+    length = np.where(used, np.hypot(outgoing[..., 0], outgoing[..., 1]), 0.0).sum(axis=1)
+    turn = np.abs(np.mod(
+        np.arctan2(outgoing[..., 1], outgoing[..., 0]) - np.arctan2(incoming[..., 1], incoming[..., 0]) + np.pi,
+        2 * np.pi
+    ) - np.pi)
+    turn = np.where(used, turn, 0.0)
+    return length, turn.sum(axis=1) / counts, turn.max(axis=1)
+
+
+def generate_tracks(
+    number_of_tracks: int,
+    min_checkpoints: int = 3,
+    max_checkpoints: int = MAX_CHECKPOINTS,
+    min_spacing: float = DEFAULT_MIN_SPACING,
+    buckets: int = 3,
+    seed: int = 0
+) -> np.ndarray:
+    if not 2 <= min_checkpoints <= max_checkpoints:
+        raise RuntimeError("checkpoint counts must satisfy 2 <= min_checkpoints <= max_checkpoints")
+    rng = np.random.default_rng(seed)
+    accepted_checkpoints: list[np.ndarray] = []
+    accepted_counts: list[np.ndarray] = []
+    accepted = 0
+    attempts = 0
+    while accepted < number_of_tracks:
+        checkpoints, counts = _sample_candidates(
+            rng, min(max(1024, 2 * (number_of_tracks - accepted)), 16384),
+            min_checkpoints, max_checkpoints, min_spacing
+        )
+        accepted_checkpoints.append(checkpoints)
+        accepted_counts.append(counts)
+        accepted += len(counts)
+        attempts += 1
+        if attempts > 1000 and accepted == 0:
+            raise RuntimeError("no valid tracks, min_spacing is too large for so many checkpoints")
+    checkpoints = np.concatenate(accepted_checkpoints)[:number_of_tracks]
+    counts = np.concatenate(accepted_counts)[:number_of_tracks]
+    checkpoints *= np.arange(max_checkpoints)[None, :, None] < counts[:, None, None]
+
+    records = np.zeros(number_of_tracks, dtype=track_dtype(max_checkpoints))
+    records['checkpoints'] = checkpoints
+    records['count'] = counts
+    length, sharpness, max_turn = track_metrics(checkpoints, counts)
+    records['length'] = length
+    records['sharpness'] = sharpness
+    records['max_turn'] = max_turn
+    # buckets of equal size by turning per unit of lap length: many sharp turns close to each other are hard,
+    # the mean turn alone mostly follows the number of checkpoints
+    turning = sharpness * counts / length
+    edges = np.quantile(turning, np.arange(1, buckets) / buckets)
+    records['difficulty'] = np.searchsorted(edges, turning, side='right')
+    return records
+
+
+def write_tracks(path: str, records: np.ndarray, buckets: int):
+    max_checkpoints = records.dtype['checkpoints'].shape[0]
+    with open(path, 'wb') as f:
+        header = struct.pack(_HEADER_FORMAT, TRACKS_MAGIC, TRACKS_VERSION, len(records), max_checkpoints, buckets)
+        f.write(header.ljust(HEADER_SIZE, b'\0'))
+        f.write(records.astype(track_dtype(max_checkpoints)).tobytes())
+
+
+@dataclass
+class TrackCorpus:
+    # memory-mapped records, track ids are record indices
+    records: np.ndarray
+    buckets: int
+    _bucket_ids: dict[int, np.ndarray] = field(default_factory=lambda: {}, repr=False, compare=False)
+
+    @classmethod
+    def open(cls, path: str) -> TrackCorpus:
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+        if len(header) != HEADER_SIZE:
+            raise RuntimeError(f"{path} is too short to be a track corpus")
+        magic, version, number_of_tracks, max_checkpoints, buckets = struct.unpack_from(_HEADER_FORMAT, header)
+        if magic != TRACKS_MAGIC:
+            raise RuntimeError(f"{path} is not a track corpus")
+        if version != TRACKS_VERSION:
+            raise RuntimeError(f"unsupported track corpus version {version}")
+        dtype = track_dtype(max_checkpoints)
+        if os.path.getsize(path) < HEADER_SIZE + number_of_tracks * dtype.itemsize:
+            raise RuntimeError(f"{path} is truncated")
+        records = np.memmap(path, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(number_of_tracks,))
+        return TrackCorpus(records=records, buckets=buckets)
+
+    def __len__(self):
+        return len(self.records)
+
+    def checkpoints(self, track_id: int) -> list[Vector]:
+        if not 0 <= track_id < len(self.records):
+            raise RuntimeError(f"there is no track {track_id}, the corpus has {len(self.records)}")
+        record = self.records[track_id]
+        return [Vector(x=int(x), y=int(y)) for x, y in record['checkpoints'][:record['count']]]
+
+    def bucket(self, difficulty: int) -> np.ndarray:
+        # ids of the tracks of one difficulty bucket, 0 is the easiest
+        if not 0 <= difficulty < self.buckets:
+            raise RuntimeError(f"difficulty must be in [0, {self.buckets})")
+        if difficulty not in self._bucket_ids:
+            self._bucket_ids[difficulty] = np.flatnonzero(self.records['difficulty'] == difficulty)
+        return self._bucket_ids[difficulty]
+
+    def sample(self, rand: random.Random, difficulty: Optional[int] = None) -> int:
+        if difficulty is None:
+            return rand.randrange(len(self.records))
+        ids = self.bucket(difficulty)
+        if len(ids) == 0:
+            raise RuntimeError(f"no tracks of difficulty {difficulty}")
+        return int(ids[rand.randrange(len(ids))])
+
+
+# opened corpora by path, so that matches of a worker process share the mapping
+_corpora: dict[str, TrackCorpus] = {}
+
+def open_tracks(path: str) -> TrackCorpus:
+    if path not in _corpora:
+        _corpora[path] = TrackCorpus.open(path)
+    return _corpora[path]
@@ -0,0 +1,141 @@
+from __future__ import annotations
+from typing import Optional, Sequence
+
+import numpy as np
+
+from .batch import BatchGame, arctan2
+from .game import Game
+
+# Columns of an observation, one row per pod. Vectors to other objects are relative to the pod,
+# angles are in radians and nothing is rounded, unlike in StrategyInput
+OBSERVATION_FIELDS = (
+    'x', 'y', 'vx', 'vy', 'ang',
+    'checkpoint_dx', 'checkpoint_dy', 'checkpoint_dist', 'checkpoint_angle',
+    'next_checkpoint_dx', 'next_checkpoint_dy',
+    'enemy_dx', 'enemy_dy',
+    'laps',
+)
+OBSERVATION_SIZE = len(OBSERVATION_FIELDS)
+# target_x, target_y, thrust; thrust is clipped to [0, 200], 200 being a boost
+ACTION_SIZE = 3
+MAX_THRUST = 200.0
+
+
+class VecEnv:
+    # K games stepped together, in the style of gymnasium's vector environments:
+    #   observations, info = env.reset(seeds)
+    #   observations, rewards, terminated, truncated, info = env.step(actions)
+    # observations have shape (K, pods, OBSERVATION_SIZE), actions (K, pods, ACTION_SIZE),
+    # rewards (K, pods), terminated and truncated (K,).
+    # Every pod is controlled by the actions, a finished game is replaced by a new one right away,
+    # its last observation is in info['final_observation']
+    def __init__(
+        self,
+        number_of_games: int,
+        number_of_pods: int = 2,
+        number_of_checkpoints: int = 4,
+        step_limit: int = 500,
+        checkpoint_reward: float = 1.0,
+        win_reward: float = 10.0,
+        # reward for every 1000 units the pod gets closer to its checkpoint, 0 disables shaping
+        distance_reward: float = 0.0,
+        exact: bool = False
+    ):
+        if number_of_games < 1:
+            raise RuntimeError("number_of_games must be >= 1")
+        self.number_of_games = number_of_games
+        self.number_of_pods = number_of_pods
+        self.number_of_checkpoints = number_of_checkpoints
+        self.step_limit = step_limit
+        self.checkpoint_reward = checkpoint_reward
+        self.win_reward = win_reward
+        self.distance_reward = distance_reward
+        self.exact = exact
+        self.batch: Optional[BatchGame] = None
+        self.steps = np.zeros(number_of_games, dtype=np.int64)
+        self._rng = np.random.default_rng()
+        self._enemy = (np.arange(number_of_pods) + 1) % number_of_pods
+
+    def _new_game(self, random_seed: int) -> Game:
+        return Game.create(self.number_of_pods, self.number_of_checkpoints, random_seed)
+
+    def _next_seed(self) -> int:
+        return int(self._rng.integers(2**63 - 1))
+
+    def reset(self, seeds: Optional[Sequence[int]] = None) -> tuple[np.ndarray, dict]:
+        # seeds of the first K games, the games that follow get seeds derived from them
+        if seeds is None:
+            self._rng = np.random.default_rng()
+            seeds = [self._next_seed() for _ in range(self.number_of_games)]
+        else:
+            if len(seeds) != self.number_of_games:
+                raise RuntimeError("number of seeds must be equal to number of games")
+            self._rng = np.random.default_rng(list(seeds))
+        self.batch = BatchGame.from_games([self._new_game(seed) for seed in seeds], self.exact)
+        self.steps[:] = 0
+        return self._observe(), {'seed': np.array(self.batch.random_seeds, dtype=np.int64)}
+
+    def _observe(self) -> np.ndarray:
+        batch = self.batch
+        assert batch is not None
+        observation = np.empty((len(batch), batch.number_of_pods, OBSERVATION_SIZE), dtype=np.float32)
+        games = np.arange(len(batch))[:, None]
+        checkpoint = batch.checkpoints[games, batch.pods_next_checkpoint]
+        after_next = (batch.pods_next_checkpoint + 1) % batch.number_of_checkpoints[:, None]
+        next_checkpoint = batch.checkpoints[games, after_next]
+        checkpoint_vect = checkpoint - batch.pos
+        checkpoint_angle = arctan2(checkpoint_vect[..., 1], checkpoint_vect[..., 0], self.exact) - batch.ang
+        observation[..., 0:2] = batch.pos
+        observation[..., 2:4] = batch.vel
+        observation[..., 4] = batch.ang
+        observation[..., 5:7] = checkpoint_vect
+        observation[..., 7] = np.hypot(checkpoint_vect[..., 0], checkpoint_vect[..., 1])
+        observation[..., 8] = np.mod(checkpoint_angle + np.pi, 2 * np.pi) - np.pi
+        observation[..., 9:11] = next_checkpoint - checkpoint
+        if batch.number_of_pods >= 2:
+            observation[..., 11:13] = batch.pos[:, self._enemy] - batch.pos
+        else:
+            observation[..., 11:13] = 0
+        observation[..., 13] = batch.pods_laps
+        return observation
+
+    def step(self, actions: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, dict]:
+        batch = self.batch
+        if batch is None:
+            raise RuntimeError("reset must be called before step")
+        actions = np.asarray(actions, dtype=np.float64)
+        if actions.shape != (len(batch), batch.number_of_pods, ACTION_SIZE):
+            raise RuntimeError(f"actions must have shape {(len(batch), batch.number_of_pods, ACTION_SIZE)}")
+        checkpoint = batch.current_checkpoints()
+        next_checkpoint_before = batch.pods_next_checkpoint
+        laps_before = batch.pods_laps
+        pos_before = batch.pos.copy() if self.distance_reward != 0.0 else batch.pos
+
+        result = batch.step(actions[..., 0:2], np.clip(actions[..., 2], 0.0, MAX_THRUST))
+        self.steps += 1
+
+        passed = (batch.pods_next_checkpoint != next_checkpoint_before) | (batch.pods_laps != laps_before)
+        rewards = self.checkpoint_reward * passed.astype(np.float64)
+        won = np.zeros(passed.shape, dtype=bool)
+        won[result.win, result.winner[result.win]] = True
+        rewards += self.win_reward * won
+        if self.distance_reward != 0.0:
+            # how much closer the pod got to the checkpoint it was heading to
+            distance_before = np.hypot(checkpoint[..., 0] - pos_before[..., 0], checkpoint[..., 1] - pos_before[..., 1])
+            distance = np.hypot(checkpoint[..., 0] - batch.pos[..., 0], checkpoint[..., 1] - batch.pos[..., 1])
+            rewards += self.distance_reward * (distance_before - distance) / 1000
+
+        terminated = result.win
+        truncated = ~terminated & (self.steps >= self.step_limit)
+        done = terminated | truncated
+        observation = self._observe()
+        info: dict = {'winner': result.winner, 'steps': self.steps.copy()}
+        if done.any():
+            info['final_observation'] = observation.copy()
+            info['seed'] = np.array(batch.random_seeds, dtype=np.int64)
+            for game_number in np.flatnonzero(done):
+                batch.set_game(int(game_number), self._new_game(self._next_seed()))
+            self.steps[done] = 0
+            observation[done] = self._observe()[done]
+        return observation, rewards.astype(np.float32), terminated, truncated, info
+
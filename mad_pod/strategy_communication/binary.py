@@ -0,0 +1,205 @@
+from __future__ import annotations
+from typing import Optional, Callable, BinaryIO
+
+import struct
+import sys
+
+from .messages import StrategyInput, StrategyOutput
+
+# Binary strategy protocol, an opt-in replacement of the text one for self-play.
+# The host starts with the text line HANDSHAKE, a strategy that speaks the protocol answers with HANDSHAKE_REPLY,
+# after that both sides exchange frames: a little endian uint32 payload length and the payload.
+#   input payload:  int32 x, y, checkpoint x, checkpoint y, checkpoint dist, checkpoint angle, enemy x, enemy y
+#   output payload: int32 target x, target y, thrust; thrust THRUST_BOOST is a boost
+# Readers take the fields they know from the start of a payload and skip the rest,
+# so fields can be appended without breaking older strategies.
+# protocol/mad_pod_binary.h implements the strategy side in C.
+
+HANDSHAKE = b'mad_pod binary 1\n'
+HANDSHAKE_REPLY = b'binary 1\n'
+THRUST_BOOST = -1
+
+FRAME_HEADER = struct.Struct('<I')
+INPUT_PAYLOAD = struct.Struct('<8i')
+OUTPUT_PAYLOAD = struct.Struct('<3i')
+# header and payload packed in one call
+_INPUT_FRAME = struct.Struct('<I8i')
+_OUTPUT_FRAME = struct.Struct('<I3i')
+
+
+def encode_input(strategy_input: StrategyInput) -> bytes:
+    pod_x, pod_y = strategy_input.pod_pos
+    checkpoint_x, checkpoint_y = strategy_input.checkpoint_pos
+    enemy_x, enemy_y = strategy_input.enemy_pos
+    return _INPUT_FRAME.pack(
+        INPUT_PAYLOAD.size,
+        pod_x, pod_y,
+        checkpoint_x, checkpoint_y,
+        strategy_input.checkpoint_dist, strategy_input.checkpoint_angle,
+        enemy_x, enemy_y
+    )
+
+
+def decode_input(payload: bytes) -> StrategyInput:
+    if len(payload) < INPUT_PAYLOAD.size:
+        raise ValueError('input frame is too short')
+    pod_x, pod_y, checkpoint_x, checkpoint_y, dist, angle, enemy_x, enemy_y = INPUT_PAYLOAD.unpack_from(payload)
+    return StrategyInput(
+        pod_pos=(pod_x, pod_y),
+        checkpoint_pos=(checkpoint_x, checkpoint_y),
+        checkpoint_dist=dist,
+        checkpoint_angle=angle,
+        enemy_pos=(enemy_x, enemy_y)
+    )
+
+
+def encode_output(strategy_output: StrategyOutput) -> bytes:
+    x, y = strategy_output.target_pos
+    thrust = THRUST_BOOST if strategy_output.thrust == 'BOOST' else strategy_output.thrust
+    return _OUTPUT_FRAME.pack(OUTPUT_PAYLOAD.size, x, y, thrust)
+
+
+def decode_output(payload: bytes) -> StrategyOutput:
+    if len(payload) < OUTPUT_PAYLOAD.size:
+        raise ValueError('output frame is too short')
+    x, y, thrust = OUTPUT_PAYLOAD.unpack_from(payload)
+    return StrategyOutput(target_pos=(x, y), thrust='BOOST' if thrust == THRUST_BOOST else thrust)
+
+
+def read_frame(stream: BinaryIO) -> Optional[bytes]:
+    # the payload of the next frame, None at the end of the stream
+    header = stream.read(FRAME_HEADER.size)
+    if len(header) < FRAME_HEADER.size:
+        return None
+    length, = FRAME_HEADER.unpack(header)
+    payload = stream.read(length)
+    if len(payload) < length:
+        return None
+    return payload
+
+
+def serve(
+    react: Callable[[StrategyInput], StrategyOutput],
+    stdin: Optional[BinaryIO] = None,
+    stdout: Optional[BinaryIO] = None
+):
+    # strategy side of both protocols: answers in binary after the handshake, otherwise in text,
+    # so the same bot keeps working in contests
+    stdin = sys.stdin.buffer if stdin is None else stdin
+    stdout = sys.stdout.buffer if stdout is None else stdout
+    first_line = stdin.readline()
+    if first_line == HANDSHAKE:
+        stdout.write(HANDSHAKE_REPLY)
+        stdout.flush()
+        while (payload := read_frame(stdin)) is not None:
+            stdout.write(encode_output(react(decode_input(payload))))
+            stdout.flush()
+        return
+    line = first_line
+    while line:
+        pod_x, pod_y, checkpoint_x, checkpoint_y, dist, angle = [int(x) for x in line.split()]
+        enemy_x, enemy_y = [int(x) for x in stdin.readline().split()]
+        strategy_output = react(StrategyInput(
+            pod_pos=(pod_x, pod_y),
+            checkpoint_pos=(checkpoint_x, checkpoint_y),
+            checkpoint_dist=dist,
+            checkpoint_angle=angle,
+            enemy_pos=(enemy_x, enemy_y)
+        ))
+        x, y = strategy_output.target_pos
+        stdout.write(f'{x} {y} {strategy_output.thrust}\n'.encode())
+        stdout.flush()
+        line = stdin.readline()
+
+
+# Multiplexed variant: one strategy process serves many games at once.
+# The handshake is MULTI_HANDSHAKE and MULTI_HANDSHAKE_REPLY, then every tick is one frame in each direction:
+#   input payload:  uint32 count, then count times uint32 game id and the 8 input fields
+#   output payload: uint32 count, then count times uint32 game id and the 3 output fields
+# Outputs may come in any order but there must be one for every game of the input frame.
+
+MULTI_HANDSHAKE = b'mad_pod multi 1\n'
+MULTI_HANDSHAKE_REPLY = b'multi 1\n'
+
+BATCH_COUNT = struct.Struct('<I')
+INPUT_RECORD = struct.Struct('<I8i')
+OUTPUT_RECORD = struct.Struct('<I3i')
+
+
+def encode_input_batch(strategy_inputs: dict[int, StrategyInput]) -> bytes:
+    records = [BATCH_COUNT.pack(len(strategy_inputs))]
+    for game_id, strategy_input in strategy_inputs.items():
+        pod_x, pod_y = strategy_input.pod_pos
+        checkpoint_x, checkpoint_y = strategy_input.checkpoint_pos
+        enemy_x, enemy_y = strategy_input.enemy_pos
+        records.append(INPUT_RECORD.pack(
+            game_id,
+            pod_x, pod_y,
+            checkpoint_x, checkpoint_y,
+            strategy_input.checkpoint_dist, strategy_input.checkpoint_angle,
+            enemy_x, enemy_y
+        ))
+    payload = b''.join(records)
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def decode_input_batch(payload: bytes) -> dict[int, StrategyInput]:
+    if len(payload) < BATCH_COUNT.size:
+        raise ValueError('input frame is too short')
+    count, = BATCH_COUNT.unpack_from(payload)
+    if len(payload) < BATCH_COUNT.size + count * INPUT_RECORD.size:
+        raise ValueError('input frame is too short')
+    result = {}
+    for game_id, pod_x, pod_y, checkpoint_x, checkpoint_y, dist, angle, enemy_x, enemy_y in INPUT_RECORD.iter_unpack(
+        payload[BATCH_COUNT.size:BATCH_COUNT.size + count * INPUT_RECORD.size]
+    ):
+        result[game_id] = StrategyInput(
+            pod_pos=(pod_x, pod_y),
+            checkpoint_pos=(checkpoint_x, checkpoint_y),
+            checkpoint_dist=dist,
+            checkpoint_angle=angle,
+            enemy_pos=(enemy_x, enemy_y)
+        )
+    return result
+
+
+def encode_output_batch(strategy_outputs: dict[int, StrategyOutput]) -> bytes:
+    records = [BATCH_COUNT.pack(len(strategy_outputs))]
+    for game_id, strategy_output in strategy_outputs.items():
+        x, y = strategy_output.target_pos
+        thrust = THRUST_BOOST if strategy_output.thrust == 'BOOST' else strategy_output.thrust
+        records.append(OUTPUT_RECORD.pack(game_id, x, y, thrust))
+    payload = b''.join(records)
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def decode_output_batch(payload: bytes) -> dict[int, StrategyOutput]:
+    if len(payload) < BATCH_COUNT.size:
+        raise ValueError('output frame is too short')
+    count, = BATCH_COUNT.unpack_from(payload)
+    if len(payload) < BATCH_COUNT.size + count * OUTPUT_RECORD.size:
+        raise ValueError('output frame is too short')
+    return {
+        game_id: StrategyOutput(target_pos=(x, y), thrust='BOOST' if thrust == THRUST_BOOST else thrust)
+        for game_id, x, y, thrust in OUTPUT_RECORD.iter_unpack(
+            payload[BATCH_COUNT.size:BATCH_COUNT.size + count * OUTPUT_RECORD.size]
+        )
+    }
+
+
+def serve_multi(
+    react_batch: Callable[[dict[int, StrategyInput]], dict[int, StrategyOutput]],
+    stdin: Optional[BinaryIO] = None,
+    stdout: Optional[BinaryIO] = None
+):
+    # strategy side of the multiplexed protocol, react_batch gets the inputs of every running game by game id.
+    # Game ids are not reused while a process runs, so state can be kept per game id
+    stdin = sys.stdin.buffer if stdin is None else stdin
+    stdout = sys.stdout.buffer if stdout is None else stdout
+    if stdin.readline() != MULTI_HANDSHAKE:
+        raise RuntimeError("the host did not ask for the multiplexed protocol")
+    stdout.write(MULTI_HANDSHAKE_REPLY)
+    stdout.flush()
+    while (payload := read_frame(stdin)) is not None:
+        stdout.write(encode_output_batch(react_batch(decode_input_batch(payload))))
+        stdout.flush()
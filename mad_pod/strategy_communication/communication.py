@@ -1,57 +1,230 @@
-from typing import Optional, Generator
+from __future__ import annotations
+from typing import Optional
+from abc import ABC, abstractmethod
 from subprocess import Popen, PIPE
 from queue import Queue, Empty
-from threading import Thread
+from threading import Thread, Lock
+
+import os
+import shlex
+import time
 
 from .messages import StrategyInput, StrategyOutput
+from .binary import (
+    HANDSHAKE, HANDSHAKE_REPLY, MULTI_HANDSHAKE, MULTI_HANDSHAKE_REPLY,
+    encode_input, decode_output, encode_input_batch, decode_output_batch, read_frame
+)
+from ..metrics import Metrics
+from .timing import TimeLimit, StrategyTimeout, StrategyTiming, default_output, process_cpu_time
 
 
-class Strategy:
-    class _StopCommand: pass
-    _CoroutineType = Generator[StrategyOutput, StrategyInput | _StopCommand | None, None]
-    
-    def __init__(self, cmd_line: str):
-        self.cmd_line = cmd_line
-        self._coroutine: Optional[Strategy._CoroutineType] = None
+class AbstractStrategy(ABC):
+    _pending_input: Optional[StrategyInput] = None
+    # whether the strategy thinks between begin_react and end_react without this process, like a subprocess.
+    # Otherwise it reacts in end_react and holds the GIL, delaying the threads that timestamp other answers
+    thinks_in_background = False
+
+    def __init__(self, time_limit: Optional[TimeLimit] = None):
+        self.time_limit = time_limit
+        self.latencies: list[float] = []
+        self.timeouts = 0
+
+    @abstractmethod
+    def react(self, strategy_input: StrategyInput) -> StrategyOutput: ...
+
+    @abstractmethod
+    def stop(self): ...
+
+    # react split in two halves, so that several strategies can think at the same time.
+    # Strategies that can't work in the background simply react in end_react
+    def begin_react(self, strategy_input: StrategyInput):
+        self._pending_input = strategy_input
+
+    def end_react(self) -> StrategyOutput:
+        if self._pending_input is None:
+            raise RuntimeError("end_react called without begin_react")
+        strategy_input, self._pending_input = self._pending_input, None
+        return self.react(strategy_input)
+
+    def cpu_time(self) -> Optional[float]:
+        return None
+
+    def timing(self) -> StrategyTiming:
+        return StrategyTiming.create(self.latencies, self.timeouts, self.cpu_time())
 
+    def _turn_time_limit(self) -> Optional[float]:
+        if self.time_limit is None:
+            return None
+        return self.time_limit.get(len(self.latencies) + self.timeouts)
 
-    def _run(self, initial_state: StrategyInput) -> _CoroutineType:
-        with Popen(
-            self.cmd_line, shell=False,
+    def _on_timeout(self, strategy_input: StrategyInput, elapsed: float) -> StrategyOutput:
+        # called when a strategy misses its deadline, either forfeits or substitutes a default move
+        self.timeouts += 1
+        assert self.time_limit is not None
+        if self.time_limit.on_timeout == 'forfeit':
+            raise StrategyTimeout(f"no answer in {elapsed * 1000:.1f} ms")
+        return default_output(strategy_input)
+
+
+def react_all(
+    strategies: list[AbstractStrategy],
+    strategy_inputs: list[StrategyInput],
+    metrics: Optional[Metrics] = None
+) -> list[StrategyOutput]:
+    # all inputs are sent before any output is awaited, so a turn takes
+    # as long as the slowest strategy instead of the sum of all of them.
+    # In-process strategies only react once the answers of the background ones have arrived,
+    # so they can't delay the arrival timestamps and get a subprocess charged for their time
+    for strategy, strategy_input in zip(strategies, strategy_inputs):
+        strategy.begin_react(strategy_input)
+    strategy_outputs: list[Optional[StrategyOutput]] = [None] * len(strategies)
+    for i in await_order(strategies):
+        strategy = strategies[i]
+        wait_start = time.perf_counter()
+        try:
+            strategy_outputs[i] = strategy.end_react()
+        except StrategyTimeout as e:
+            e.strategy_number = i
+            raise
+        finally:
+            if metrics is not None:
+                # time this thread spent blocked on the pod, on top of the pods before it
+                metrics.observe('strategy_wait_seconds', time.perf_counter() - wait_start, pod=i)
+    return [strategy_output for strategy_output in strategy_outputs if strategy_output is not None]
+
+
+def await_order(strategies: list) -> list[int]:
+    # indices of the strategies, the ones thinking in the background first
+    return sorted(range(len(strategies)), key=lambda i: not strategies[i].thinks_in_background)
+
+
+# 'multi' is the multiplexed binary protocol, one process serving many games, see binary.py
+PROTOCOLS = ('text', 'binary', 'multi')
+_HANDSHAKES = {'binary': (HANDSHAKE, HANDSHAKE_REPLY), 'multi': (MULTI_HANDSHAKE, MULTI_HANDSHAKE_REPLY)}
+# how long a strategy may take to answer the binary protocol handshake, in seconds
+HANDSHAKE_TIMEOUT = 10.0
+
+
+class StrategyProcess:
+    def __init__(self, cmd_line: str, env: Optional[dict[str, str]] = None, protocol: str = 'text'):
+        if protocol not in PROTOCOLS:
+            raise RuntimeError(f"protocol must be one of {', '.join(PROTOCOLS)}")
+        self.cmd_line = cmd_line
+        self.protocol = protocol
+        self.games_played = 0
+        # Windows takes the command line as is, elsewhere it has to be split into arguments
+        args = self.cmd_line if os.name == 'nt' else shlex.split(self.cmd_line)
+        self.proc = Popen(
+            args, shell=False,
             stdin=PIPE,
             stdout=PIPE,
-            stderr=PIPE
-        ) as proc:
-            if proc.stdin is None or proc.stdout is None or proc.stderr is None:
-                raise RuntimeError("failed to open pipes with the process")
-            stderr_queue: Queue = Queue()
-            stderr_reader = Thread(
-                target=self._stderr_reader_target, 
-                kwargs={'proc': proc, 'queue': stderr_queue}
-            )
-            stderr_reader.daemon = True
-            stderr_reader.start()
-            proc.stdin.write(initial_state.serialize())
-            proc.stdin.flush()
-            while True:
-                proc.stdout.flush()
-                proc.stderr.flush()
-                raw_strategy_output = proc.stdout.readline()
-                stderr_lines = self._read_queue(stderr_queue)
-                strategy_output = StrategyOutput.deserialize(raw_strategy_output)
-                strategy_output.message = '\n'.join(line.decode() for line in stderr_lines)
-                strategy_input = yield strategy_output
-                match strategy_input:
-                    case StrategyInput():
-                        proc.stdin.write(strategy_input.serialize())
-                        proc.stdin.flush()
-                    case Strategy._StopCommand():
-                        break
-
-            proc.stdin.close()
-            proc.stdout.close()
-            proc.stderr.close()
-            proc.terminate()
+            stderr=PIPE,
+            # extra variables on top of the environment of this process
+            env=None if env is None else {**os.environ, **env}
+        )
+        if self.proc.stdin is None or self.proc.stdout is None or self.proc.stderr is None:
+            raise RuntimeError("failed to open pipes with the process")
+        # answers that arrived after their deadline and must be skipped
+        self._late_answers = 0
+        self._stdout_queue: Queue = Queue()
+        stdout_reader = Thread(
+            target=self._stdout_reader_target if protocol == 'text' else self._stdout_frame_reader_target,
+            kwargs={'proc': self.proc, 'queue': self._stdout_queue}
+        )
+        stdout_reader.daemon = True
+        stdout_reader.start()
+        self._stderr_queue: Queue = Queue()
+        stderr_reader = Thread(
+            target=self._stderr_reader_target,
+            kwargs={'proc': self.proc, 'queue': self._stderr_queue}
+        )
+        stderr_reader.daemon = True
+        stderr_reader.start()
+        if protocol in _HANDSHAKES:
+            self._handshake()
+
+    def _handshake(self):
+        assert self.proc.stdin is not None
+        handshake, expected_reply = _HANDSHAKES[self.protocol]
+        try:
+            self.proc.stdin.write(handshake)
+            self.proc.stdin.flush()
+            _, reply = self._stdout_queue.get(timeout=HANDSHAKE_TIMEOUT)
+        except (OSError, Empty):
+            reply = b''
+        if reply != expected_reply:
+            self.close()
+            raise RuntimeError(f"{self.cmd_line} did not accept the {self.protocol} protocol")
+
+    def write(self, strategy_input: StrategyInput):
+        assert self.proc.stdin is not None
+        if self.protocol == 'multi':
+            raise RuntimeError("multi protocol processes take batches, see write_batch")
+        if self.protocol == 'binary':
+            self.proc.stdin.write(encode_input(strategy_input))
+        else:
+            self.proc.stdin.write(strategy_input.serialize())
+        self.proc.stdin.flush()
+
+    def write_batch(self, strategy_inputs: dict[int, StrategyInput]):
+        # inputs of one tick by game id, multi protocol only
+        assert self.proc.stdin is not None
+        self.proc.stdin.write(encode_input_batch(strategy_inputs))
+        self.proc.stdin.flush()
+
+    def _read_raw(self, deadline: Optional[float]) -> tuple[bytes, float]:
+        while True:
+            timeout = None if deadline is None else max(deadline - time.perf_counter(), 0)
+            try:
+                arrival_time, raw_strategy_output = self._stdout_queue.get(timeout=timeout)
+            except Empty:
+                self._late_answers += 1
+                raise StrategyTimeout("no answer before the deadline")
+            if self._late_answers == 0:
+                return raw_strategy_output, arrival_time
+            self._late_answers -= 1
+
+    def _stderr_message(self) -> str:
+        return '\n'.join(line.decode() for line in self._read_queue(self._stderr_queue))
+
+    def read(self, deadline: Optional[float] = None) -> tuple[StrategyOutput, float]:
+        # returns the answer and the time.perf_counter() value when it arrived.
+        # deadline is a time.perf_counter() value, StrategyTimeout is raised when it passes
+        raw_strategy_output, arrival_time = self._read_raw(deadline)
+        message = self._stderr_message()
+        if self.protocol == 'binary':
+            strategy_output = decode_output(raw_strategy_output)
+        else:
+            strategy_output = StrategyOutput.deserialize(raw_strategy_output)
+        strategy_output.message = message
+        return strategy_output, arrival_time
+
+    def read_batch(self, deadline: Optional[float] = None) -> tuple[dict[int, StrategyOutput], float]:
+        # the answers of one tick by game id, like read
+        raw_strategy_outputs, arrival_time = self._read_raw(deadline)
+        message = self._stderr_message()
+        strategy_outputs = decode_output_batch(raw_strategy_outputs)
+        for strategy_output in strategy_outputs.values():
+            strategy_output.message = message
+        return strategy_outputs, arrival_time
+
+    def is_alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def is_in_sync(self) -> bool:
+        return self._late_answers == 0
+
+    def cpu_time(self) -> Optional[float]:
+        return process_cpu_time(self.proc.pid)
+
+    def close(self):
+        for pipe in (self.proc.stdin, self.proc.stdout, self.proc.stderr):
+            if pipe is not None:
+                try:
+                    pipe.close()
+                except OSError: pass
+        self.proc.terminate()
+        self.proc.wait()
 
     def _read_queue(self, queue: Queue) -> list[bytes]:
         result = []
@@ -62,24 +235,213 @@ class Strategy:
                 break
         return result
 
+    def _stdout_reader_target(self, proc: Popen, queue: Queue):
+        if proc.stdout is not None:
+            try:
+                while line := proc.stdout.readline():
+                    queue.put((time.perf_counter(), line))
+            except ValueError: pass
+        # an empty line makes the waiting read fail to parse, like a closed pipe would
+        queue.put((time.perf_counter(), b''))
+
+    def _stdout_frame_reader_target(self, proc: Popen, queue: Queue):
+        # the handshake reply line, then frame payloads
+        if proc.stdout is not None:
+            try:
+                queue.put((time.perf_counter(), proc.stdout.readline()))
+                while (payload := read_frame(proc.stdout)) is not None:
+                    queue.put((time.perf_counter(), payload))
+            except ValueError: pass
+        queue.put((time.perf_counter(), b''))
+
     def _stderr_reader_target(self, proc: Popen, queue: Queue):
         if proc.stderr is not None:
             try:
                 while line := proc.stderr.readline():
                     queue.put(line)
             except ValueError: pass
-    
-    def react(self, strategy_input: StrategyInput) -> StrategyOutput:
-        if self._coroutine is None:
-            self._coroutine = self._run(strategy_input)
-            return self._coroutine.send(None)
+
+
+class StrategyPool:
+    # keeps warm processes of one strategy ready, spawning replacements in the background
+    def __init__(self, cmd_line: str, size: int = 1, games_per_process: int = 1, protocol: str = 'text'):
+        if size < 1:
+            raise RuntimeError("size must be >= 1")
+        if games_per_process < 1:
+            raise RuntimeError("games_per_process must be >= 1")
+        self.cmd_line = cmd_line
+        self.size = size
+        self.games_per_process = games_per_process
+        self.protocol = protocol
+        self._ready: Queue[StrategyProcess | Exception] = Queue()
+        self._lock = Lock()
+        self._closed = False
+        self._spawning = 0
+        for _ in range(size):
+            self._spawn_in_background()
+
+    def _spawn_target(self):
+        try:
+            process = StrategyProcess(self.cmd_line, protocol=self.protocol)
+        except Exception as e:
+            with self._lock:
+                self._spawning -= 1
+                self._ready.put(e)
+            return
+        with self._lock:
+            self._spawning -= 1
+            if not self._closed:
+                self._ready.put(process)
+                return
+        process.close()
+
+    def _spawn_in_background(self):
+        with self._lock:
+            self._spawning += 1
+        spawner = Thread(target=self._spawn_target)
+        spawner.daemon = True
+        spawner.start()
+
+    def _get(self) -> StrategyProcess | Exception:
+        with self._lock:
+            try:
+                return self._ready.get_nowait()
+            except Empty:
+                if self._spawning == 0:
+                    # nothing is warming up, e.g. one pool shared by several pods of a match
+                    cold_start = True
+                else:
+                    cold_start = False
+        if cold_start:
+            try:
+                return StrategyProcess(self.cmd_line, protocol=self.protocol)
+            except Exception as e:
+                return e
+        return self._ready.get()
+
+    def acquire(self) -> StrategyProcess:
+        while True:
+            match item := self._get():
+                case Exception():
+                    self._spawn_in_background()
+                    raise item
+                case StrategyProcess() if not item.is_alive():
+                    item.close()
+                    self._spawn_in_background()
+                case StrategyProcess():
+                    if item.games_played + 1 >= self.games_per_process:
+                        # this is the last game of the process, warm up its successor right away
+                        self._spawn_in_background()
+                    return item
+
+    def release(self, process: StrategyProcess, healthy: bool = True):
+        process.games_played += 1
+        if process.games_played >= self.games_per_process:
+            process.close()
+        elif not healthy or not process.is_alive() or not process.is_in_sync():
+            process.close()
+            self._spawn_in_background()
         else:
-            return self._coroutine.send(strategy_input)
+            with self._lock:
+                if not self._closed and self._ready.qsize() < self.size:
+                    self._ready.put(process)
+                    return
+            process.close()
 
-    def stop(self):
-        if self._coroutine is not None:
+    def strategy(self, time_limit: Optional[TimeLimit] = None) -> Strategy:
+        return Strategy(self.cmd_line, pool=self, time_limit=time_limit, protocol=self.protocol)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        while True:
             try:
-                self._coroutine.send(Strategy._StopCommand())
-            except StopIteration: pass
+                item = self._ready.get_nowait()
+            except Empty:
+                break
+            if isinstance(item, StrategyProcess):
+                item.close()
+
+
+class Strategy(AbstractStrategy):
+    thinks_in_background = True
+
+    def __init__(
+        self,
+        cmd_line: str,
+        pool: Optional[StrategyPool] = None,
+        time_limit: Optional[TimeLimit] = None,
+        env: Optional[dict[str, str]] = None,
+        protocol: str = 'text'
+    ):
+        super().__init__(time_limit)
+        if pool is not None and env is not None:
+            raise RuntimeError("pooled strategies share the environment of their pool")
+        self.cmd_line = cmd_line
+        self.pool = pool
+        self.env = env
+        self.protocol = protocol
+        self._process: Optional[StrategyProcess] = None
+        self._healthy = True
+        self._begin_time = 0.0
+        # cpu time of the process before this match and once the match is over
+        self._cpu_time_start: Optional[float] = None
+        self._cpu_time: Optional[float] = None
+
+    def react(self, strategy_input: StrategyInput) -> StrategyOutput:
+        self.begin_react(strategy_input)
+        return self.end_react()
+
+    def begin_react(self, strategy_input: StrategyInput):
+        if self._process is None:
+            if self.pool is None:
+                self._process = StrategyProcess(self.cmd_line, self.env, self.protocol)
             else:
-                raise RuntimeError("couroutine did not stop")
+                self._process = self.pool.acquire()
+            self._cpu_time_start = self._process.cpu_time()
+        self._pending_input = strategy_input
+        self._begin_time = time.perf_counter()
+        try:
+            self._process.write(strategy_input)
+        except OSError:
+            self._healthy = False
+            raise
+
+    def end_react(self) -> StrategyOutput:
+        if self._process is None or self._pending_input is None:
+            raise RuntimeError("end_react called without begin_react")
+        strategy_input, self._pending_input = self._pending_input, None
+        time_limit = self._turn_time_limit()
+        deadline = None if time_limit is None else self._begin_time + time_limit
+        try:
+            strategy_output, arrival_time = self._process.read(deadline)
+        except StrategyTimeout:
+            self._healthy = False
+            return self._on_timeout(strategy_input, time.perf_counter() - self._begin_time)
+        except (ValueError, OSError):
+            self._healthy = False
+            raise
+        self.latencies.append(arrival_time - self._begin_time)
+        return strategy_output
+
+    def cpu_time(self) -> Optional[float]:
+        if self._process is not None:
+            cpu_time = self._process.cpu_time()
+        else:
+            cpu_time = self._cpu_time
+        if cpu_time is None or self._cpu_time_start is None:
+            return None
+        return cpu_time - self._cpu_time_start
+
+    def stop(self):
+        if self._process is None:
+            return
+        self._cpu_time = self._process.cpu_time()
+        if self.pool is None:
+            self._process.close()
+        else:
+            # an answer that was never read, e.g. after another pod forfeited, would be taken as the next match's
+            self.pool.release(self._process, self._healthy and self._pending_input is None)
+        self._process = None
+        self._pending_input = None
+        self._healthy = True
@@ -0,0 +1,95 @@
+from typing import Optional, Callable
+
+from .communication import AbstractStrategy, Strategy
+from .in_process import PythonStrategy
+from .multiplex import AbstractMultiStrategy, MultiStrategy, StrategyGroup
+from .messages import StrategyInput, StrategyOutput
+from .timing import TimeLimit
+
+PYTHON_STRATEGY_PREFIX = 'py:'
+BUILTIN_STRATEGY_PREFIX = 'builtin:'
+# a command line that speaks the binary protocol, see binary.py
+BINARY_STRATEGY_PREFIX = 'bin:'
+# a command line that serves many games from one process with the multi protocol, only in multiplexed matches
+MULTI_STRATEGY_PREFIX = 'multi:'
+
+
+def is_python_strategy(spec: str) -> bool:
+    return spec.startswith(PYTHON_STRATEGY_PREFIX)
+
+
+def is_builtin_strategy(spec: str) -> bool:
+    return spec.startswith(BUILTIN_STRATEGY_PREFIX)
+
+
+def is_time_budgeted_strategy(spec: str) -> bool:
+    # builtins that search until their time budget is spent, their moves depend on the machine's load
+    return is_builtin_strategy(spec) and spec[len(BUILTIN_STRATEGY_PREFIX):].partition(':')[0] in ('rollout',)
+
+
+def is_in_process_strategy(spec: str) -> bool:
+    return is_python_strategy(spec) or is_builtin_strategy(spec)
+
+
+def parse_process_spec(spec: str) -> tuple[str, str]:
+    # command line and protocol of a strategy that runs as a process
+    if spec.startswith(BINARY_STRATEGY_PREFIX):
+        return spec[len(BINARY_STRATEGY_PREFIX):], 'binary'
+    if spec.startswith(MULTI_STRATEGY_PREFIX):
+        return spec[len(MULTI_STRATEGY_PREFIX):], 'multi'
+    return spec, 'text'
+
+
+def _parse_options(options: str) -> dict[str, int | float]:
+    # "budget=0.02,candidates=1024"
+    result: dict[str, int | float] = {}
+    for option in filter(None, options.split(',')):
+        key, sep, value = option.partition('=')
+        if not sep:
+            raise RuntimeError(f"option must look like 'name=value', got {option!r}")
+        result[key.strip()] = float(value) if any(c in value for c in '.eE') else int(value)
+    return result
+
+
+def builtin_strategy(spec: str) -> Callable[[StrategyInput], StrategyOutput]:
+    # "rollout" or "rollout:budget=0.02,candidates=1024"
+    name, _, options = spec.partition(':')
+    match name:
+        case 'rollout':
+            # imported here so that running external strategies doesn't import numpy
+            from ..bots.rollout import RolloutPlanner
+            return RolloutPlanner(**_parse_options(options))
+        case _:
+            raise RuntimeError(f"unknown builtin strategy {name!r}")
+
+
+def make_strategy(
+    spec: str,
+    time_limit: Optional[TimeLimit] = None,
+    env: Optional[dict[str, str]] = None
+) -> AbstractStrategy:
+    # "py:module:name" runs a python strategy in-process, "builtin:name[:options]" one of the bots of this package,
+    # "bin:cmd" a command line that speaks the binary protocol,
+    # anything else is a command line, started with env added to its environment
+    if is_python_strategy(spec):
+        return PythonStrategy(spec[len(PYTHON_STRATEGY_PREFIX):], time_limit)
+    if is_builtin_strategy(spec):
+        return PythonStrategy(builtin_strategy(spec[len(BUILTIN_STRATEGY_PREFIX):]), time_limit)
+    cmd_line, protocol = parse_process_spec(spec)
+    if protocol == 'multi':
+        raise RuntimeError(f"{spec} serves many games at once, it can only play multiplexed matches")
+    return Strategy(cmd_line, time_limit=time_limit, env=env, protocol=protocol)
+
+
+def make_multi_strategy(
+    spec: str,
+    time_limit: Optional[TimeLimit] = None,
+    env: Optional[dict[str, str]] = None,
+    factory: Optional[Callable[[], AbstractStrategy]] = None
+) -> AbstractMultiStrategy:
+    # "multi:cmd" is one process for all the games, any other spec gets an instance per game,
+    # made by factory if it's given, by make_strategy otherwise
+    cmd_line, protocol = parse_process_spec(spec)
+    if protocol == 'multi':
+        return MultiStrategy(cmd_line, time_limit, env)
+    return StrategyGroup(factory or (lambda: make_strategy(spec, time_limit, env)))
@@ -0,0 +1,78 @@
+from typing import Optional, Callable, Generator, Any
+
+import importlib
+import importlib.util
+import inspect
+import os
+import time
+
+from .communication import AbstractStrategy
+from .messages import StrategyInput, StrategyOutput
+from .timing import TimeLimit
+
+
+def load_object(import_path: str) -> Any:
+    # "package.module:name" or "path/to/file.py:name"
+    module_name, sep, attr = import_path.rpartition(':')
+    if not sep or not module_name or not attr:
+        raise RuntimeError(f"import path must look like 'module:name', got {import_path!r}")
+    if module_name.endswith('.py'):
+        spec = importlib.util.spec_from_file_location(
+            os.path.splitext(os.path.basename(module_name))[0], module_name
+        )
+        if spec is None or spec.loader is None:
+            raise RuntimeError(f"failed to load {module_name}")
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    else:
+        module = importlib.import_module(module_name)
+    return getattr(module, attr)
+
+
+class PythonStrategy(AbstractStrategy):
+    # calls the strategy directly in this process, without pipes and text serialization.
+    # The target is either a callable taking StrategyInput and returning StrategyOutput,
+    # a class whose instances are such callables, or a generator function
+    # that takes the first StrategyInput, yields StrategyOutput and receives the next inputs
+    _CoroutineType = Generator[StrategyOutput, StrategyInput, None]
+
+    def __init__(self, target: str | Callable, time_limit: Optional[TimeLimit] = None):
+        super().__init__(time_limit)
+        self.import_path = target if isinstance(target, str) else None
+        self.target = load_object(target) if isinstance(target, str) else target
+        self._callable: Optional[Callable[[StrategyInput], StrategyOutput]] = None
+        self._coroutine: Optional[PythonStrategy._CoroutineType] = None
+        self._cpu_time = 0.0
+
+    def react(self, strategy_input: StrategyInput) -> StrategyOutput:
+        # an in-process call can't be interrupted, a late answer is only detected afterwards
+        time_limit = self._turn_time_limit()
+        begin_time = time.perf_counter()
+        begin_cpu_time = time.thread_time()
+        strategy_output = self._react(strategy_input)
+        self._cpu_time += time.thread_time() - begin_cpu_time
+        elapsed = time.perf_counter() - begin_time
+        if time_limit is not None and elapsed > time_limit:
+            return self._on_timeout(strategy_input, elapsed)
+        self.latencies.append(elapsed)
+        return strategy_output
+
+    def _react(self, strategy_input: StrategyInput) -> StrategyOutput:
+        if self._coroutine is not None:
+            return self._coroutine.send(strategy_input)
+        if self._callable is not None:
+            return self._callable(strategy_input)
+        if inspect.isgeneratorfunction(self.target):
+            self._coroutine = self.target(strategy_input)
+            return next(self._coroutine)
+        self._callable = self.target() if inspect.isclass(self.target) else self.target
+        return self._callable(strategy_input)
+
+    def cpu_time(self) -> Optional[float]:
+        return self._cpu_time
+
+    def stop(self):
+        if self._coroutine is not None:
+            self._coroutine.close()
+        self._coroutine = None
+        self._callable = None
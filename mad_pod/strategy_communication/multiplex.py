@@ -0,0 +1,145 @@
+from typing import Optional, Callable
+from abc import ABC, abstractmethod
+
+import time
+
+from .communication import AbstractStrategy, StrategyProcess
+from .messages import StrategyInput, StrategyOutput
+from .timing import TimeLimit, StrategyTimeout, StrategyTiming, default_output
+
+
+class AbstractMultiStrategy(ABC):
+    # one strategy playing in many games at once, inputs and outputs are keyed by game id.
+    # Game ids are unique for the lifetime of the object, so a strategy can keep state per game id
+
+    # see AbstractStrategy.thinks_in_background
+    thinks_in_background = False
+
+    @abstractmethod
+    def begin_react_batch(self, strategy_inputs: dict[int, StrategyInput]): ...
+
+    # games missing from the answer missed their deadline and forfeit
+    @abstractmethod
+    def end_react_batch(self) -> dict[int, StrategyOutput]: ...
+
+    @abstractmethod
+    def timing(self, game_id: int) -> StrategyTiming: ...
+
+    def finish(self, game_id: int):
+        # the game is over and won't be in the next batches
+        pass
+
+    @abstractmethod
+    def stop(self): ...
+
+
+class MultiStrategy(AbstractMultiStrategy):
+    # every game is served by one process speaking the multi protocol, a tick of all the games is one round trip.
+    # The time limit applies to the whole tick, so latencies and timeouts are shared by the games
+    thinks_in_background = True
+
+    def __init__(
+        self,
+        cmd_line: str,
+        time_limit: Optional[TimeLimit] = None,
+        env: Optional[dict[str, str]] = None
+    ):
+        self.cmd_line = cmd_line
+        self.time_limit = time_limit
+        self.env = env
+        self.latencies: list[float] = []
+        self.timeouts = 0
+        self._process: Optional[StrategyProcess] = None
+        self._pending_inputs: Optional[dict[int, StrategyInput]] = None
+        self._begin_time = 0.0
+        self._cpu_time_start: Optional[float] = None
+        self._cpu_time: Optional[float] = None
+
+    def begin_react_batch(self, strategy_inputs: dict[int, StrategyInput]):
+        if self._process is None:
+            self._process = StrategyProcess(self.cmd_line, self.env, 'multi')
+            self._cpu_time_start = self._process.cpu_time()
+        self._pending_inputs = strategy_inputs
+        self._begin_time = time.perf_counter()
+        self._process.write_batch(strategy_inputs)
+
+    def end_react_batch(self) -> dict[int, StrategyOutput]:
+        if self._process is None or self._pending_inputs is None:
+            raise RuntimeError("end_react_batch called without begin_react_batch")
+        strategy_inputs, self._pending_inputs = self._pending_inputs, None
+        deadline = None
+        if self.time_limit is not None:
+            deadline = self._begin_time + self.time_limit.get(len(self.latencies) + self.timeouts)
+        try:
+            strategy_outputs, arrival_time = self._process.read_batch(deadline)
+        except StrategyTimeout:
+            self.timeouts += 1
+            assert self.time_limit is not None
+            if self.time_limit.on_timeout == 'forfeit':
+                return {}
+            return {game_id: default_output(strategy_input) for game_id, strategy_input in strategy_inputs.items()}
+        missing = strategy_inputs.keys() - strategy_outputs.keys()
+        if missing:
+            raise ValueError(f"no answer for games {sorted(missing)}")
+        self.latencies.append(arrival_time - self._begin_time)
+        return strategy_outputs
+
+    def cpu_time(self) -> Optional[float]:
+        cpu_time = self._process.cpu_time() if self._process is not None else self._cpu_time
+        if cpu_time is None or self._cpu_time_start is None:
+            return None
+        return cpu_time - self._cpu_time_start
+
+    def timing(self, game_id: int) -> StrategyTiming:
+        return StrategyTiming.create(self.latencies, self.timeouts, self.cpu_time())
+
+    def stop(self):
+        if self._process is None:
+            return
+        self._cpu_time = self._process.cpu_time()
+        self._process.close()
+        self._process = None
+
+
+class StrategyGroup(AbstractMultiStrategy):
+    # any strategy in multiplexed matches: one instance per game, made by factory when the game first needs it.
+    # All instances are asked before any answer is awaited, like react_all does for the pods of a game
+    def __init__(self, factory: Callable[[], AbstractStrategy]):
+        self.factory = factory
+        self.strategies: dict[int, AbstractStrategy] = {}
+        self._pending: list[int] = []
+
+    @property
+    def thinks_in_background(self) -> bool:  # type: ignore[override]
+        return all(strategy.thinks_in_background for strategy in self.strategies.values())
+
+    def begin_react_batch(self, strategy_inputs: dict[int, StrategyInput]):
+        for game_id, strategy_input in strategy_inputs.items():
+            if game_id not in self.strategies:
+                self.strategies[game_id] = self.factory()
+            self.strategies[game_id].begin_react(strategy_input)
+        self._pending = list(strategy_inputs)
+
+    def end_react_batch(self) -> dict[int, StrategyOutput]:
+        pending, self._pending = self._pending, []
+        strategy_outputs = {}
+        for game_id in pending:
+            try:
+                strategy_outputs[game_id] = self.strategies[game_id].end_react()
+            except StrategyTimeout:
+                pass
+        return strategy_outputs
+
+    def timing(self, game_id: int) -> StrategyTiming:
+        if game_id not in self.strategies:
+            return StrategyTiming.create([], 0, None)
+        return self.strategies[game_id].timing()
+
+    def finish(self, game_id: int):
+        # a pooled process can go back to its pool before the other games end
+        if game_id in self.strategies:
+            self.strategies[game_id].stop()
+
+    def stop(self):
+        for strategy in self.strategies.values():
+            strategy.stop()
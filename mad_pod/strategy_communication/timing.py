@@ -0,0 +1,74 @@
+from __future__ import annotations
+from typing import Optional, Literal
+from dataclasses import dataclass
+
+import math
+import os
+
+from .messages import StrategyInput, StrategyOutput
+
+
+@dataclass
+class TimeLimit:
+    # seconds, the contest allows 1000 ms for the first turn and 75 ms for the others
+    first_turn: float = 1.0
+    turn: float = 0.075
+    # 'forfeit' ends the match, 'default' replaces the late answer with default_output
+    on_timeout: Literal['forfeit', 'default'] = 'forfeit'
+
+    def get(self, turn_number: int) -> float:
+        return self.first_turn if turn_number == 0 else self.turn
+
+
+class StrategyTimeout(Exception):
+    def __init__(self, message: str, strategy_number: Optional[int] = None):
+        super().__init__(message)
+        self.strategy_number = strategy_number
+
+
+def default_output(strategy_input: StrategyInput) -> StrategyOutput:
+    # coast towards the next checkpoint
+    return StrategyOutput(target_pos=strategy_input.checkpoint_pos, thrust=0)
+
+
+def _percentile(sorted_values: list[float], p: float) -> float:
+    rank = max(math.ceil(p / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+@dataclass
+class StrategyTiming:
+    turns: int
+    timeouts: int
+    # response times in seconds, None when the strategy never answered
+    p50: Optional[float]
+    p99: Optional[float]
+    max: Optional[float]
+    cpu_time: Optional[float]
+
+    @classmethod
+    def create(cls, latencies: list[float], timeouts: int, cpu_time: Optional[float]) -> StrategyTiming:
+        if len(latencies) == 0:
+            return StrategyTiming(turns=0, timeouts=timeouts, p50=None, p99=None, max=None, cpu_time=cpu_time)
+        sorted_latencies = sorted(latencies)
+        return StrategyTiming(
+            turns=len(latencies),
+            timeouts=timeouts,
+            p50=_percentile(sorted_latencies, 50),
+            p99=_percentile(sorted_latencies, 99),
+            max=sorted_latencies[-1],
+            cpu_time=cpu_time
+        )
+
+
+def process_cpu_time(pid: int) -> Optional[float]:
+    # user + system time of a live process, only available where /proc exists
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # the command name may contain spaces, the fields after it are fixed
+    fields = stat[stat.rfind(')') + 2:].split()
+    utime, stime = int(fields[11]), int(fields[12])
+    return (utime + stime) / os.sysconf('SC_CLK_TCK')
@@ -5,7 +5,7 @@ from numbers import Number
 import math
 
 
-@dataclass
+@dataclass(slots=True)
 class Vector:
     x: float
     y: float
@@ -0,0 +1,202 @@
+from __future__ import annotations
+from typing import Optional, Iterable, Iterator
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import os
+
+import numpy as np
+
+from .data import VisualizationData
+from .png import ApngWriter, write_png
+from .renderer import OffscreenRenderer
+from ..constants import WORLD_W, WORLD_H
+
+CLIP_FORMATS = ('apng', 'png')
+
+
+@dataclass
+class ClipSettings:
+    width: int = 800
+    # 'apng' is one animated file, 'png' a directory with a frame_00000.png sequence
+    format: str = 'apng'
+    fps: float = 30.0
+    # frames per simulation step, the ones in between are interpolated
+    substeps: int = 1
+    compression: int = 6
+    # moderngl standalone context backend, 'egl' renders without a display
+    backend: Optional[str] = None
+
+    @property
+    def height(self) -> int:
+        return int(round(self.width * WORLD_H / WORLD_W))
+
+
+class ClipWriter:
+    def __init__(self, path: str, settings: ClipSettings):
+        if settings.format not in CLIP_FORMATS:
+            raise RuntimeError(f"format must be one of {', '.join(CLIP_FORMATS)}")
+        self.path = path
+        self.settings = settings
+        self.frames = 0
+        self._apng: Optional[ApngWriter] = None
+        if settings.format == 'apng':
+            self._apng = ApngWriter(path, settings.width, settings.height, settings.fps, settings.compression)
+        else:
+            os.makedirs(path, exist_ok=True)
+
+    def add(self, image: np.ndarray):
+        if self._apng is not None:
+            self._apng.add(image)
+        else:
+            write_png(os.path.join(self.path, f'frame_{self.frames:05d}.png'), image, self.settings.compression)
+        self.frames += 1
+
+    def close(self):
+        if self._apng is not None:
+            self._apng.close()
+
+    def __enter__(self) -> ClipWriter:
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def clip_path(output_dir: str, name: str, settings: ClipSettings) -> str:
+    return os.path.join(output_dir, f'{name}.png' if settings.format == 'apng' else name)
+
+
+# offscreen renderers of the current worker process by size and backend, creating a context is slow
+_renderers: dict[tuple[int, int, Optional[str]], OffscreenRenderer] = {}
+
+def _get_renderer(settings: ClipSettings) -> OffscreenRenderer:
+    key = (settings.width, settings.height, settings.backend)
+    if key not in _renderers:
+        _renderers[key] = OffscreenRenderer(settings.width, settings.height, settings.backend)
+    return _renderers[key]
+
+
+def _render_step(renderer: OffscreenRenderer, writer: ClipWriter, substeps: int, last: bool):
+    # frames from the previous state towards the last one, the last state itself only ends the clip
+    for substep in range(substeps):
+        writer.add(renderer.render(substep / substeps))
+    if last:
+        writer.add(renderer.render(1.0))
+
+
+def render_replay(replay_path: str, output_path: str, settings: ClipSettings = ClipSettings()) -> int:
+    # the replay is read straight from its records, returns the number of frames
+    from ..simulation.replay import Replay
+    replay = Replay.open(replay_path)
+    renderer = _get_renderer(settings)
+    renderer.renderer.set_checkpoints(np.asarray(replay.checkpoints, dtype='f4'))
+    pos = np.asarray(replay.records['pos'], dtype='f4')
+    ang = np.asarray(replay.records['ang'], dtype='f4')
+    with ClipWriter(output_path, settings) as writer:
+        if len(replay) == 1:
+            renderer.renderer.set_pods(pos[0], pos[0], ang[0], ang[0])
+            writer.add(renderer.render(1.0))
+        for step in range(1, len(replay)):
+            renderer.renderer.set_pods(pos[step - 1], pos[step], ang[step - 1], ang[step])
+            _render_step(renderer, writer, settings.substeps, step == len(replay) - 1)
+        return writer.frames
+
+
+class LiveClip:
+    # a visualization callback of play() rendering the match as it's played
+    def __init__(self, output_path: str, settings: ClipSettings = ClipSettings()):
+        self.renderer = _get_renderer(settings)
+        self.writer = ClipWriter(output_path, settings)
+        self.settings = settings
+        self._last_frame: Optional[VisualizationData] = None
+
+    def __call__(self, frame: VisualizationData):
+        if self._last_frame is not None:
+            self.renderer.renderer.set_frames(self._last_frame, frame)
+            _render_step(self.renderer, self.writer, self.settings.substeps, False)
+        self._last_frame = frame
+
+    def close(self):
+        if self._last_frame is not None:
+            self.renderer.renderer.set_frames(self._last_frame, self._last_frame)
+            self.writer.add(self.renderer.render(1.0))
+            self._last_frame = None
+        self.writer.close()
+
+    def __enter__(self) -> LiveClip:
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _render_replay_job(replay_path: str, output_path: str, settings: ClipSettings) -> tuple[str, str, int]:
+    return replay_path, output_path, render_replay(replay_path, output_path, settings)
+
+
+def render_replays(
+    jobs: Iterable[tuple[str, str]],
+    settings: ClipSettings = ClipSettings(),
+    processes: Optional[int] = None
+) -> Iterator[tuple[str, str, int]]:
+    # (replay path, output path) pairs, every worker keeps its own context.
+    # Clips are yielded as soon as they are written as (replay path, output path, frames)
+    with ProcessPoolExecutor(max_workers=processes or os.cpu_count()) as executor:
+        futures = [
+            executor.submit(_render_replay_job, replay_path, output_path, settings)
+            for replay_path, output_path in jobs
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def render_match(
+    cmdlines: list[str],
+    seed: int,
+    output_path: str,
+    settings: ClipSettings = ClipSettings(),
+    step_limit: int = 500,
+    collisions: bool = False
+):
+    # plays a match and renders it live, returns the PlayResult
+    from ..simulation.game import Game
+    from ..simulation.play import play
+    from ..strategy_communication.factory import make_strategy
+    strategies = [make_strategy(cmdline) for cmdline in cmdlines]
+    game = Game.create(len(strategies), 4, seed, collisions)
+    with LiveClip(output_path, settings) as clip:
+        return play(game, strategies, step_limit, clip)
+
+
+def _render_match_job(
+    cmdlines: list[str],
+    seed: int,
+    output_path: str,
+    settings: ClipSettings,
+    step_limit: int,
+    collisions: bool
+) -> tuple[int, str, object]:
+    return seed, output_path, render_match(cmdlines, seed, output_path, settings, step_limit, collisions)
+
+
+def render_matches(
+    cmdlines: list[str],
+    seeds: Iterable[int],
+    output_dir: str,
+    settings: ClipSettings = ClipSettings(),
+    processes: Optional[int] = None,
+    step_limit: int = 500,
+    collisions: bool = False
+) -> Iterator[tuple[int, str, object]]:
+    # one clip per seed named after it, yielded as (seed, output path, PlayResult) when it's written
+    with ProcessPoolExecutor(max_workers=processes or os.cpu_count()) as executor:
+        futures = [
+            executor.submit(
+                _render_match_job, cmdlines, seed, clip_path(output_dir, str(seed), settings),
+                settings, step_limit, collisions
+            )
+            for seed in seeds
+        ]
+        for future in as_completed(futures):
+            yield future.result()
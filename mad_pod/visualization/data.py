@@ -3,8 +3,6 @@ from dataclasses import dataclass
 from ..vector import Vector
 
 
-class VisualizationStopCommand: pass
-
 @dataclass
 class PodVisualizationData:
     pos: Vector
@@ -0,0 +1,110 @@
+from __future__ import annotations
+from typing import Optional, TYPE_CHECKING
+from collections import deque
+from threading import Condition, Event
+
+from .data import VisualizationData
+
+if TYPE_CHECKING:
+    from ..simulation.replay import Replay
+
+# what the simulation does when the viewer falls behind:
+#   'drop'   the oldest buffered frame is discarded, the viewer skips ahead
+#   'block'  the simulation waits for the viewer to take a frame
+#   'record' the simulation writes a replay and never waits, the viewer plays it from disk
+FRAME_POLICIES = ('drop', 'block', 'record')
+
+
+class FrameBuffer:
+    # bounded buffer of frames from the simulation thread to the viewer, the viewer side never blocks
+    def __init__(self, capacity: int = 64, policy: str = 'drop'):
+        if capacity < 1:
+            raise RuntimeError("capacity must be >= 1")
+        if policy not in ('drop', 'block'):
+            raise RuntimeError("a frame buffer drops or blocks, recording goes through ReplayFrames")
+        self.capacity = capacity
+        self.policy = policy
+        self.dropped = 0
+        self._frames: deque[VisualizationData] = deque()
+        self._condition = Condition()
+        # no more frames will be put, either the match is over or the viewer is gone
+        self._closed = False
+
+    def put(self, frame: VisualizationData):
+        with self._condition:
+            if self.policy == 'block':
+                while len(self._frames) >= self.capacity and not self._closed:
+                    self._condition.wait()
+            if self._closed:
+                return
+            if len(self._frames) >= self.capacity:
+                self._frames.popleft()
+                self.dropped += 1
+            self._frames.append(frame)
+
+    def get_nowait(self) -> Optional[VisualizationData]:
+        with self._condition:
+            if not self._frames:
+                return None
+            frame = self._frames.popleft()
+            self._condition.notify()
+            return frame
+
+    def finished(self) -> bool:
+        # closed and every frame taken
+        with self._condition:
+            return self._closed and not self._frames
+
+    def close(self):
+        # frames already buffered can still be taken, a blocked put returns
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class ReplayFrames:
+    # frames of a replay file, followed while the simulation is still writing it until done is set.
+    # Records become visible as the writer's file buffer is flushed
+    def __init__(self, path: str, done: Optional[Event] = None):
+        self.path = path
+        self.done = done
+        self._replay: Optional[Replay] = None
+        self._next_record = 0
+        # the file was read after the writer finished, nothing more will appear
+        self._final = False
+
+    def _refresh(self):
+        if self._final:
+            return
+        # imported here so that the viewer doesn't depend on the simulation for live frames
+        from ..simulation.replay import Replay
+        # checked before reading, so that the last read sees everything written
+        final = self.done is None or self.done.is_set()
+        try:
+            self._replay = Replay.open(self.path)
+        except (OSError, RuntimeError):
+            # the header isn't on disk yet, or the match failed before writing it
+            self._final = final
+            return
+        self._final = final
+
+    def _available(self) -> int:
+        return 0 if self._replay is None else len(self._replay)
+
+    def get_nowait(self) -> Optional[VisualizationData]:
+        if self._next_record >= self._available():
+            self._refresh()
+        if self._replay is None or self._next_record >= len(self._replay):
+            return None
+        frame = self._replay.get_visualization_data(self._next_record)
+        self._next_record += 1
+        return frame
+
+    def finished(self) -> bool:
+        if self._next_record < self._available():
+            return False
+        self._refresh()
+        return self._final and self._next_record >= self._available()
+
+    def close(self):
+        self._final = True
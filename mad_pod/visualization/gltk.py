@@ -3,15 +3,14 @@ from dataclasses import dataclass, field
 
 import tkinter as tk
 from pyopengltk import OpenGLFrame # type: ignore
-from OpenGL.GL import * # type: ignore
 import moderngl
 
-from queue import Queue
 import time
-import math
 
-from .data import VisualizationData, PodVisualizationData, VisualizationStopCommand
-from ..constants import WORLD_H, WORLD_W, CHECKPOINT_RADIUS
+from .data import VisualizationData
+from .frame_buffer import FrameBuffer, ReplayFrames
+from .renderer import PodRenderer
+from ..constants import WORLD_H, WORLD_W
 from ..utils import degrees
 
 
@@ -24,147 +23,88 @@ class VisualizationState:
 
 class GlFrame(OpenGLFrame):
     def __init__(
-        self, *args, 
-        data_queue: Queue[VisualizationData | VisualizationStopCommand], 
-        factor: float, 
+        self, *args,
+        frames: FrameBuffer | ReplayFrames,
         frame_duration: float,
         label: tk.Label,
         **kwargs
     ):
-        self.data_queue = data_queue
-        self.data_queue_exhausted = False
-        self.factor = factor
+        self.frames = frames
         self.frame_duration = frame_duration
         self.label = label
+        self.ctx: Optional[moderngl.Context] = None
+        self.renderer: Optional[PodRenderer] = None
         super().__init__(*args, **kwargs)
         self.state = VisualizationState()
 
     def initgl(self):
-        glViewport(0, 0, self.width, self.height)
-        glClearColor(1.0,1.0,1.0,1.0)
+        # called again on every resize, the context and the renderer are kept
+        if self.ctx is None:
+            self.ctx = moderngl.create_context()
+            self.renderer = PodRenderer(self.ctx)
+        self.ctx.viewport = (0, 0, self.width, self.height)
 
-        # setup projection matrix
-        glMatrixMode(GL_PROJECTION)
-        glLoadIdentity()
-        glOrtho(0, self.width, self.height, 0, -1, 1)
-
-        # setup identity model view matrix
-        glMatrixMode(GL_MODELVIEW)
-        glLoadIdentity()
-
-        glEnable(GL_POINT_SMOOTH)
-
-        self.prev_time = time.time()
-    
     def _calc_k(self) -> float:
         dt = time.time() - self.state.frame_started_time
         k = min(1, dt / self.frame_duration)
         return k
 
-    def _calc_data(self) -> VisualizationData:
-        def queue_get(old_val):
-            if self.data_queue_exhausted:
-                return old_val
-            match x := self.data_queue.get():
-                case VisualizationStopCommand():
-                    self.data_queue_exhausted = True
-                    return old_val
-                case VisualizationData():
-                    return x
-
-        if self.state.prev_frame is None:
-            self.state.prev_frame = queue_get(self.state.prev_frame)
-            self.state.last_frame = queue_get(self.state.last_frame)
+    def _next_frame(self) -> bool:
+        # never waits for the simulation: without a new frame the last one stays on screen.
+        # Returns whether the pods have to be uploaded again
+        if self.state.last_frame is None:
+            frame = self.frames.get_nowait()
+            if frame is None:
+                return False
+            self.state.prev_frame = self.state.last_frame = frame
             self.state.frame_started_time = time.time()
-        elif self._calc_k() == 1:
-            self.state.prev_frame = self.state.last_frame
-            self.state.last_frame = queue_get(self.state.last_frame)
-            self.state.frame_started_time = time.time()
-        
-        k = self._calc_k()
-
-        if self.state.last_frame is None or self.state.prev_frame is None:
-            raise RuntimeError("unreachable")
-
-        return VisualizationData(
-            checkpoints=self.state.last_frame.checkpoints,
-            pods=[
-                PodVisualizationData(
-                    pos=podb.pos * k + poda.pos * (1 - k),
-                    ang=podb.ang * k + poda.ang * (1 - k)
-                )
-                for poda, podb 
-                in zip(self.state.prev_frame.pods, self.state.last_frame.pods)
-            ]
-        )
-
-    def _get_pod_color(self, pod_n: int) -> tuple[float, float, float]:
-        colors = [
-            (1, 0, 0),
-            (0, 1, 0),
-            (0, 0, 1),
-            (0, 1, 1),
-            (1, 0, 1),
-            (1, 1, 0)
-        ]
-        return colors[pod_n % len(colors)]
-
-    def redraw(self):       
-
-        data = self._calc_data()
+            return True
+        if self._calc_k() == 1:
+            frame = self.frames.get_nowait()
+            if frame is not None:
+                self.state.prev_frame = self.state.last_frame
+                self.state.last_frame = frame
+                self.state.frame_started_time = time.time()
+                return True
+        return False
+
+    def redraw(self):
+        assert self.renderer is not None
+        if self._next_frame():
+            assert self.state.prev_frame is not None and self.state.last_frame is not None
+            self.renderer.set_frames(self.state.prev_frame, self.state.last_frame)
+        self.renderer.render(self._calc_k())
+
+        if self.state.prev_frame is None or self.state.last_frame is None:
+            self.label.config(text="waiting for the simulation")
+            return
         report=(
-            f"ang = {degrees(data.pods[0].ang):.1f} ∈ [{degrees(self.state.prev_frame.pods[0].ang):.1f}, {degrees(self.state.last_frame.pods[0].ang):.1f}]"
+            f"ang ∈ [{degrees(self.state.prev_frame.pods[0].ang):.1f}, {degrees(self.state.last_frame.pods[0].ang):.1f}], "
+            f"{self.renderer.stats().format()}"
         )
+        if isinstance(self.frames, FrameBuffer) and self.frames.dropped > 0:
+            report += f", {self.frames.dropped} frames dropped"
+        if self.frames.finished():
+            report += ", finished"
         self.label.config(text=report)
 
-        # print(f"vis: {data}")
-
-        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-        glLoadIdentity()
-
-        glColor3f(0.0,0.0,0.0)
-        glPointSize(CHECKPOINT_RADIUS * 2 * self.factor)
-        glBegin(GL_POINTS)
-        for checkpoint in data.checkpoints:
-            glVertex2f(checkpoint.x * self.factor , checkpoint.y * self.factor)
-        glEnd()
-
-        # glColor3f(0.0,0.0,1.0)
-        glPointSize(200 * self.factor)
-        glBegin(GL_POINTS)
-        for i, pod in enumerate(data.pods):
-            glColor3f(*self._get_pod_color(i))
-            glVertex2f(pod.pos.x * self.factor, pod.pos.y * self.factor)
-        glEnd()
-        
-        # glColor3f(1.0,0.0,0.0)
-        # glLineWidth(3)
-        glBegin(GL_LINES)
-        for i, pod in enumerate(data.pods):
-            glColor3f(*self._get_pod_color(i + 1))
-            glVertex2f(pod.pos.x * self.factor, pod.pos.y * self.factor)
-            r = 300 * self.factor
-            dx = r * math.cos(pod.ang)
-            dy = r * math.sin(pod.ang)
-            glVertex2f(pod.pos.x * self.factor + dx, pod.pos.y * self.factor + dy)
-        glEnd()
-
-        glFlush()
-
-def visualize_game(data: Queue[VisualizationData | VisualizationStopCommand], window_scale: float = 1/5, frame_duration: float = 0.3):
+def visualize_game(frames: FrameBuffer | ReplayFrames, window_scale: float = 1/5, frame_duration: float = 0.3):
     root = tk.Tk()
     label = tk.Label(root, text="label")
     label.pack()
     frame = GlFrame(
         root,
-        data_queue=data,
-        factor=window_scale,
+        frames=frames,
         frame_duration=frame_duration,
         label=label,
-        width=int(WORLD_W * window_scale), 
+        width=int(WORLD_W * window_scale),
         height=int(WORLD_H * window_scale)
     )
     frame.pack(fill=tk.BOTH, expand=tk.YES)
     frame.animate = 1
 
-    root.mainloop()
+    try:
+        root.mainloop()
+    finally:
+        # a simulation blocked on a full buffer goes on without the viewer
+        frames.close()
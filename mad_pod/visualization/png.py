@@ -0,0 +1,107 @@
+from __future__ import annotations
+from typing import BinaryIO
+
+import struct
+import zlib
+
+import numpy as np
+
+# PNG and animated PNG encoding with the standard library, images are (height, width, 3) uint8 RGB
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# the frame delay is stored as 100 / (100 * fps) seconds, the denominator is a uint16
+MAX_APNG_FPS = 655.0
+
+
+def _chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def _header(width: int, height: int) -> bytes:
+    # 8 bits per channel, truecolor, no interlacing
+    return _chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+
+
+def _image_data(image: np.ndarray, compression: int) -> bytes:
+    if image.ndim != 3 or image.shape[2] != 3 or image.dtype != np.uint8:
+        raise RuntimeError("images must be (height, width, 3) uint8 arrays")
+    height, width, _ = image.shape
+    # every row starts with its filter type, 0 is no filtering
+    rows = np.zeros((height, 1 + width * 3), dtype=np.uint8)
+    rows[:, 1:] = image.reshape(height, width * 3)
+    return zlib.compress(rows.tobytes(), compression)
+
+
+def encode_png(image: np.ndarray, compression: int = 6) -> bytes:
+    height, width, _ = image.shape
+    return b''.join([
+        PNG_SIGNATURE,
+        _header(width, height),
+        _chunk(b'IDAT', _image_data(image, compression)),
+        _chunk(b'IEND', b''),
+    ])
+
+
+def write_png(path: str, image: np.ndarray, compression: int = 6):
+    with open(path, 'wb') as f:
+        f.write(encode_png(image, compression))
+
+
+class ApngWriter:
+    # frames are appended as they come, the frame count in the animation control chunk is patched on close
+    def __init__(self, path: str, width: int, height: int, fps: float, compression: int = 6):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.compression = compression
+        if not 0 < fps <= MAX_APNG_FPS:
+            raise RuntimeError(f"APNG frame rate must be above 0 and at most {MAX_APNG_FPS:g}, got {fps:g}")
+        # frame delay as a fraction of a second
+        self._delay = (100, max(int(round(100 * fps)), 1))
+        self.frames = 0
+        self._sequence = 0
+        self._file: BinaryIO = open(path, 'wb')
+        self._file.write(PNG_SIGNATURE)
+        self._file.write(_header(width, height))
+        self._actl_offset = self._file.tell()
+        self._file.write(self._animation_control())
+
+    def _animation_control(self) -> bytes:
+        # number of frames, 0 plays forever
+        return _chunk(b'acTL', struct.pack('>II', self.frames, 0))
+
+    def _next_sequence(self) -> int:
+        sequence = self._sequence
+        self._sequence += 1
+        return sequence
+
+    def add(self, image: np.ndarray):
+        if image.shape != (self.height, self.width, 3):
+            raise RuntimeError(f"frames must be {self.width}x{self.height}")
+        self._file.write(_chunk(b'fcTL', struct.pack(
+            '>IIIIIHHBB',
+            self._next_sequence(), self.width, self.height, 0, 0, *self._delay,
+            # keep the frame, replace the area
+            0, 0
+        )))
+        data = _image_data(image, self.compression)
+        if self.frames == 0:
+            # the first frame is also the still image of viewers without animation support
+            self._file.write(_chunk(b'IDAT', data))
+        else:
+            self._file.write(_chunk(b'fdAT', struct.pack('>I', self._next_sequence()) + data))
+        self.frames += 1
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.write(_chunk(b'IEND', b''))
+        self._file.seek(self._actl_offset)
+        self._file.write(self._animation_control())
+        self._file.close()
+
+    def __enter__(self) -> ApngWriter:
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,300 @@
+from __future__ import annotations
+from typing import Optional
+from dataclasses import dataclass
+from collections import deque
+
+import time
+
+import numpy as np
+import moderngl
+
+from .data import VisualizationData
+from ..constants import WORLD_W, WORLD_H, CHECKPOINT_RADIUS
+
+# world units, like the immediate-mode viewer drew them
+POD_DRAW_RADIUS = 100
+HEADING_LENGTH = 300
+POD_COLORS = [
+    (1, 0, 0),
+    (0, 1, 0),
+    (0, 0, 1),
+    (0, 1, 1),
+    (1, 0, 1),
+    (1, 1, 0)
+]
+
+# per pod instance: position and heading of the previous and the last frame
+POD_DTYPE = np.dtype([('prev_pos', '<f4', (2,)), ('pos', '<f4', (2,)), ('prev_ang', '<f4'), ('ang', '<f4')])
+_POD_FORMAT = '2f 2f 1f 1f /i'
+_POD_ATTRIBUTES = ('in_prev_pos', 'in_pos', 'in_prev_ang', 'in_ang')
+# discs don't turn, the headings are skipped
+_DISC_FORMAT = '2f 2f 8x /i'
+_DISC_ATTRIBUTES = ('in_prev_pos', 'in_pos')
+
+_COMMON = '''
+#version 330
+uniform vec2 world;
+uniform float k;
+uniform vec3 colors[6];
+
+vec4 to_clip(vec2 p) {
+    // world y grows downwards
+    return vec4(p.x / world.x * 2.0 - 1.0, 1.0 - p.y / world.y * 2.0, 0.0, 1.0);
+}
+
+vec2 lerp_pos(vec2 a, vec2 b) {
+    return mix(a, b, k);
+}
+
+float lerp_ang(float a, float b) {
+    // the short way around
+    float d = mod(b - a + 3.14159265, 6.28318531) - 3.14159265;
+    return a + d * k;
+}
+'''
+
+_DISC_VERTEX = _COMMON + '''
+in vec2 in_corner;
+in vec2 in_prev_pos;
+in vec2 in_pos;
+uniform float radius;
+out vec2 corner;
+out vec3 color;
+
+void main() {
+    corner = in_corner;
+    color = colors[gl_InstanceID % 6];
+    gl_Position = to_clip(lerp_pos(in_prev_pos, in_pos) + in_corner * radius);
+}
+'''
+
+_DISC_FRAGMENT = '''
+#version 330
+in vec2 corner;
+in vec3 color;
+uniform bool use_color;
+uniform vec3 flat_color;
+out vec4 fragment;
+
+void main() {
+    if (dot(corner, corner) > 1.0)
+        discard;
+    fragment = vec4(use_color ? color : flat_color, 1.0);
+}
+'''
+
+_HEADING_VERTEX = _COMMON + '''
+in float in_t;
+in vec2 in_prev_pos;
+in vec2 in_pos;
+in float in_prev_ang;
+in float in_ang;
+uniform float heading_length;
+out vec3 color;
+
+void main() {
+    float ang = lerp_ang(in_prev_ang, in_ang);
+    color = colors[(gl_InstanceID + 1) % 6];
+    gl_Position = to_clip(lerp_pos(in_prev_pos, in_pos) + in_t * vec2(cos(ang), sin(ang)) * heading_length);
+}
+'''
+
+_HEADING_FRAGMENT = '''
+#version 330
+in vec3 color;
+out vec4 fragment;
+
+void main() {
+    fragment = vec4(color, 1.0);
+}
+'''
+
+
+@dataclass
+class FrameStats:
+    frames: int
+    # time spent issuing a frame and time between frames, in seconds
+    render_mean: float
+    render_p99: float
+    interval_mean: Optional[float]
+
+    @property
+    def fps(self) -> Optional[float]:
+        if self.interval_mean is None or self.interval_mean == 0:
+            return None
+        return 1 / self.interval_mean
+
+    def format(self) -> str:
+        fps = self.fps
+        return (
+            f"render {self.render_mean * 1000:.2f} ms, p99 {self.render_p99 * 1000:.2f} ms"
+            f"{'' if fps is None else f', {fps:.0f} fps'}"
+        )
+
+
+class PodRenderer:
+    # draws checkpoints, pods and their headings with instanced shaders.
+    # Pod state lives in a VBO that is rewritten only when a new frame arrives,
+    # in between render(k) just moves the pods by interpolating on the GPU
+    def __init__(self, ctx: moderngl.Context, stats_window: int = 240):
+        self.ctx = ctx
+        self.number_of_pods = 0
+        self.number_of_checkpoints = 0
+        self._checkpoints_key: Optional[tuple] = None
+        self._pods = np.zeros(0, dtype=POD_DTYPE)
+        self._render_times: deque[float] = deque(maxlen=stats_window)
+        self._frame_starts: deque[float] = deque(maxlen=stats_window)
+
+        self._disc_program = ctx.program(vertex_shader=_DISC_VERTEX, fragment_shader=_DISC_FRAGMENT)
+        self._heading_program = ctx.program(
+            vertex_shader=_HEADING_VERTEX,
+            fragment_shader=_HEADING_FRAGMENT
+        )
+        self._heading_program['heading_length'].value = HEADING_LENGTH
+        colors = np.array(POD_COLORS, dtype='f4')
+        for program in (self._disc_program, self._heading_program):
+            program['world'].value = (WORLD_W, WORLD_H)
+            program['colors'].write(colors.tobytes())
+        self._corners = ctx.buffer(np.array([-1, -1, 1, -1, -1, 1, 1, 1], dtype='f4').tobytes())
+        self._ends = ctx.buffer(np.array([0, 1], dtype='f4').tobytes())
+        self._pod_buffer: Optional[moderngl.Buffer] = None
+        self._checkpoint_buffer: Optional[moderngl.Buffer] = None
+        self._pod_vao: Optional[moderngl.VertexArray] = None
+        self._heading_vao: Optional[moderngl.VertexArray] = None
+        self._checkpoint_vao: Optional[moderngl.VertexArray] = None
+
+    def _reserve_pods(self, number_of_pods: int):
+        # the buffer only grows, so it is reallocated a handful of times at most
+        if self._pod_buffer is not None and self._pod_buffer.size >= number_of_pods * POD_DTYPE.itemsize:
+            return
+        for resource in (self._pod_vao, self._heading_vao, self._pod_buffer):
+            if resource is not None:
+                resource.release()
+        capacity = max(16, 1 << (number_of_pods - 1).bit_length())
+        self._pod_buffer = self.ctx.buffer(reserve=capacity * POD_DTYPE.itemsize, dynamic=True)
+        self._pod_vao = self.ctx.vertex_array(self._disc_program, [
+            (self._corners, '2f', 'in_corner'),
+            (self._pod_buffer, _DISC_FORMAT, *_DISC_ATTRIBUTES),
+        ])
+        self._heading_vao = self.ctx.vertex_array(self._heading_program, [
+            (self._ends, '1f', 'in_t'),
+            (self._pod_buffer, _POD_FORMAT, *_POD_ATTRIBUTES),
+        ])
+
+    def set_pods(self, prev_pos: np.ndarray, pos: np.ndarray, prev_ang: np.ndarray, ang: np.ndarray):
+        # (pods, 2) positions and (pods,) headings of the two frames render interpolates between
+        number_of_pods = len(pos)
+        if len(self._pods) != number_of_pods:
+            self._pods = np.zeros(number_of_pods, dtype=POD_DTYPE)
+        self._pods['prev_pos'] = prev_pos
+        self._pods['pos'] = pos
+        self._pods['prev_ang'] = prev_ang
+        self._pods['ang'] = ang
+        self._reserve_pods(number_of_pods)
+        assert self._pod_buffer is not None
+        self._pod_buffer.write(self._pods.tobytes())
+        self.number_of_pods = number_of_pods
+
+    def set_checkpoints(self, checkpoints: np.ndarray):
+        key = (checkpoints.shape, checkpoints.tobytes())
+        if key == self._checkpoints_key:
+            return
+        self._checkpoints_key = key
+        for resource in (self._checkpoint_vao, self._checkpoint_buffer):
+            if resource is not None:
+                resource.release()
+        # the disc program reads the same instance layout as pods, with both frames at the checkpoint
+        records = np.zeros(max(len(checkpoints), 1), dtype=POD_DTYPE)
+        records['prev_pos'][:len(checkpoints)] = checkpoints
+        records['pos'][:len(checkpoints)] = checkpoints
+        self._checkpoint_buffer = self.ctx.buffer(records.tobytes())
+        self._checkpoint_vao = self.ctx.vertex_array(self._disc_program, [
+            (self._corners, '2f', 'in_corner'),
+            (self._checkpoint_buffer, _DISC_FORMAT, *_DISC_ATTRIBUTES),
+        ])
+        self.number_of_checkpoints = len(checkpoints)
+
+    def set_frames(self, prev_frame: VisualizationData, last_frame: VisualizationData):
+        self.set_checkpoints(np.array([(c.x, c.y) for c in last_frame.checkpoints], dtype='f4').reshape(-1, 2))
+        self.set_pods(
+            np.array([(pod.pos.x, pod.pos.y) for pod in prev_frame.pods], dtype='f4').reshape(-1, 2),
+            np.array([(pod.pos.x, pod.pos.y) for pod in last_frame.pods], dtype='f4').reshape(-1, 2),
+            np.array([pod.ang for pod in prev_frame.pods], dtype='f4'),
+            np.array([pod.ang for pod in last_frame.pods], dtype='f4')
+        )
+
+    def render(self, k: float = 1.0):
+        # k in [0, 1] goes from the previous frame to the last one
+        start = time.perf_counter()
+        self._frame_starts.append(start)
+        self.ctx.clear(1.0, 1.0, 1.0, 1.0)
+        self.ctx.enable_only(moderngl.NOTHING)
+        for program in (self._disc_program, self._heading_program):
+            program['k'].value = k
+        if self._checkpoint_vao is not None and self.number_of_checkpoints > 0:
+            self._disc_program['radius'].value = CHECKPOINT_RADIUS
+            self._disc_program['use_color'].value = False
+            self._disc_program['flat_color'].value = (0.0, 0.0, 0.0)
+            self._checkpoint_vao.render(moderngl.TRIANGLE_STRIP, instances=self.number_of_checkpoints)
+        if self._pod_vao is not None and self._heading_vao is not None and self.number_of_pods > 0:
+            self._disc_program['radius'].value = POD_DRAW_RADIUS
+            self._disc_program['use_color'].value = True
+            self._pod_vao.render(moderngl.TRIANGLE_STRIP, instances=self.number_of_pods)
+            self._heading_vao.render(moderngl.LINES, instances=self.number_of_pods)
+        self._render_times.append(time.perf_counter() - start)
+
+    def stats(self) -> FrameStats:
+        render_times = sorted(self._render_times)
+        intervals = None
+        if len(self._frame_starts) > 1:
+            intervals = (self._frame_starts[-1] - self._frame_starts[0]) / (len(self._frame_starts) - 1)
+        if not render_times:
+            return FrameStats(frames=0, render_mean=0.0, render_p99=0.0, interval_mean=intervals)
+        return FrameStats(
+            frames=len(render_times),
+            render_mean=sum(render_times) / len(render_times),
+            render_p99=render_times[min(int(0.99 * len(render_times)), len(render_times) - 1)],
+            interval_mean=intervals
+        )
+
+    def release(self):
+        for resource in (
+            self._pod_vao, self._heading_vao, self._checkpoint_vao,
+            self._pod_buffer, self._checkpoint_buffer, self._corners, self._ends,
+            self._disc_program, self._heading_program
+        ):
+            if resource is not None:
+                resource.release()
+
+
+class OffscreenRenderer:
+    # a PodRenderer on a standalone context and its own framebuffer, e.g. with Mesa's llvmpipe:
+    #   LIBGL_ALWAYS_SOFTWARE=1, backend='egl' where there's no display
+    def __init__(self, width: int, height: int, backend: Optional[str] = None, samples: int = 0):
+        kwargs = {} if backend is None else {'backend': backend}
+        self.ctx = moderngl.create_standalone_context(**kwargs)
+        self.width = width
+        self.height = height
+        self.framebuffer = self.ctx.simple_framebuffer((width, height), components=3, samples=samples)
+        # multisampled framebuffers can't be read directly
+        self._resolve = None if samples == 0 else self.ctx.simple_framebuffer((width, height), components=3)
+        self.framebuffer.use()
+        self.renderer = PodRenderer(self.ctx)
+
+    def render(self, k: float = 1.0) -> np.ndarray:
+        # the image as (height, width, 3) uint8 rows from the top
+        self.framebuffer.use()
+        self.renderer.render(k)
+        source = self.framebuffer
+        if self._resolve is not None:
+            self.ctx.copy_framebuffer(self._resolve, self.framebuffer)
+            source = self._resolve
+        pixels = np.frombuffer(source.read(components=3), dtype=np.uint8)
+        return pixels.reshape(self.height, self.width, 3)[::-1]
+
+    def release(self):
+        self.renderer.release()
+        self.framebuffer.release()
+        if self._resolve is not None:
+            self._resolve.release()
+        self.ctx.release()
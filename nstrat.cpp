@@ -3,6 +3,7 @@
 #include <vector>
 #include <algorithm>
 #include <math.h>
+#include <cstdlib>
 
 using namespace std;
 
@@ -14,6 +15,13 @@ double k = 2.5;
 int checkpoint_radius = k*600;
 int force_field = k*400;
 
+// tunable through the environment, see mad-pod-cmd optimize
+double env_param(const char * name, double fallback)
+{
+    const char * value = std::getenv(name);
+    return value? std::atof(value): fallback;
+}
+
 enum class GameCondition: int
 {
     FAR_FROM_ALL = 0,
@@ -45,6 +53,9 @@ struct GameState
 
 int main()
 {
+    k = env_param("MAD_POD_K", k);
+    checkpoint_radius = env_param("MAD_POD_CHECKPOINT_RADIUS", k*600);
+    force_field = env_param("MAD_POD_FORCE_FIELD", k*400);
     int boost_used = false;
 
     auto get_thrust_input = [boost_used](const GameState & s) -> std::string
@@ -0,0 +1,163 @@
+/*
+ * Strategy side of the mad_pod binary protocol, see mad_pod/strategy_communication/binary.py.
+ *
+ * The host opts in by starting the strategy with a "bin:" command line. It sends the text line
+ * "mad_pod binary 1", and the strategy answers "binary 1". After that each turn is one input frame and
+ * one output frame: a uint32 payload length followed by int32 fields, all little endian.
+ *
+ *     mp_input input;
+ *     int binary = mp_handshake(stdin, stdout, line, sizeof line) == MP_BINARY;
+ *     while (binary && mp_read_input(stdin, &input)) {
+ *         mp_output output = {input.checkpoint_x, input.checkpoint_y, 100};
+ *         mp_write_output(stdout, &output);
+ *     }
+ *
+ * When mp_handshake returns MP_TEXT, line holds the first line of the text protocol,
+ * so the same bot can also run in contests.
+ *
+ * With a "multi:" command line the host sends "mad_pod multi 1" instead and mp_handshake returns MP_MULTI.
+ * One process then serves many games: every tick is one frame with the inputs of all the running games,
+ * each tagged with its game id, answered by one frame with an output per game id.
+ *
+ *     uint32_t ids[MP_MAX_GAMES];
+ *     mp_input inputs[MP_MAX_GAMES];
+ *     mp_output outputs[MP_MAX_GAMES];
+ *     int count;
+ *     while ((count = mp_read_batch(stdin, ids, inputs, MP_MAX_GAMES)) >= 0) {
+ *         for (int i = 0; i < count; i++)
+ *             outputs[i] = (mp_output){inputs[i].checkpoint_x, inputs[i].checkpoint_y, 100};
+ *         mp_write_batch(stdout, ids, outputs, count);
+ *     }
+ *
+ * Fields are read and written in host byte order, which is little endian on x86 and ARM.
+ * On Windows mp_handshake switches in and out to binary mode once the host asked for a binary protocol:
+ * text mode stdio turns \n into \r\n and stops reading at 0x1A, which breaks length prefixed frames.
+ */
+#ifndef MAD_POD_BINARY_H
+#define MAD_POD_BINARY_H
+
+#include <stdint.h>
+#include <stdio.h>
+#include <string.h>
+#ifdef _WIN32
+#include <fcntl.h>
+#include <io.h>
+#endif
+
+#define MP_HANDSHAKE "mad_pod binary 1\n"
+#define MP_HANDSHAKE_REPLY "binary 1\n"
+#define MP_MULTI_HANDSHAKE "mad_pod multi 1\n"
+#define MP_MULTI_HANDSHAKE_REPLY "multi 1\n"
+#define MP_THRUST_BOOST (-1)
+
+typedef struct {
+    int32_t x, y;
+    int32_t checkpoint_x, checkpoint_y;
+    int32_t checkpoint_dist, checkpoint_angle;
+    int32_t enemy_x, enemy_y;
+} mp_input;
+
+typedef struct {
+    int32_t target_x, target_y;
+    /* 0..100 or MP_THRUST_BOOST */
+    int32_t thrust;
+} mp_output;
+
+#define MP_TEXT 0
+#define MP_BINARY 1
+#define MP_MULTI 2
+/* the most games a host puts in one batch is up to the host, this is a suggested buffer size */
+#define MP_MAX_GAMES 1024
+
+static inline void mp_binary_mode(FILE *in, FILE *out)
+{
+#ifdef _WIN32
+    fflush(out);
+    _setmode(_fileno(in), _O_BINARY);
+    _setmode(_fileno(out), _O_BINARY);
+#else
+    (void)in;
+    (void)out;
+#endif
+}
+
+/* reads the first line into line, answers the handshake when the host asks for a binary protocol
+   and returns the protocol, in and out are then in binary mode */
+static inline int mp_handshake(FILE *in, FILE *out, char *line, size_t size)
+{
+    if (fgets(line, (int)size, in) == NULL)
+        return MP_TEXT;
+    if (strcmp(line, MP_HANDSHAKE) == 0) {
+        /* before the reply, text mode would end it with \r\n */
+        mp_binary_mode(in, out);
+        fputs(MP_HANDSHAKE_REPLY, out);
+        fflush(out);
+        return MP_BINARY;
+    }
+    if (strcmp(line, MP_MULTI_HANDSHAKE) == 0) {
+        mp_binary_mode(in, out);
+        fputs(MP_MULTI_HANDSHAKE_REPLY, out);
+        fflush(out);
+        return MP_MULTI;
+    }
+    return MP_TEXT;
+}
+
+/* returns 0 at the end of the input; fields the host appends in later versions are skipped */
+static inline int mp_read_input(FILE *in, mp_input *input)
+{
+    uint32_t length;
+    char payload[256];
+    if (fread(&length, sizeof length, 1, in) != 1 || length < sizeof *input || length > sizeof payload)
+        return 0;
+    if (fread(payload, 1, length, in) != length)
+        return 0;
+    memcpy(input, payload, sizeof *input);
+    return 1;
+}
+
+static inline void mp_write_output(FILE *out, const mp_output *output)
+{
+    uint32_t length = sizeof *output;
+    fwrite(&length, sizeof length, 1, out);
+    fwrite(output, sizeof *output, 1, out);
+    fflush(out);
+}
+
+/* multi protocol: reads the inputs of one tick, returns how many there are or -1 at the end of the input
+   or when the batch doesn't fit in max_games; bytes the host appends after the records in later versions are skipped */
+static inline int mp_read_batch(FILE *in, uint32_t *ids, mp_input *inputs, int max_games)
+{
+    uint32_t length, count, expected;
+    if (fread(&length, sizeof length, 1, in) != 1 || length < sizeof count || fread(&count, sizeof count, 1, in) != 1)
+        return -1;
+    if (count > (uint32_t)max_games)
+        return -1;
+    expected = sizeof count + count * (sizeof *ids + sizeof *inputs);
+    if (length < expected)
+        return -1;
+    for (uint32_t i = 0; i < count; i++) {
+        if (fread(&ids[i], sizeof *ids, 1, in) != 1 || fread(&inputs[i], sizeof *inputs, 1, in) != 1)
+            return -1;
+    }
+    for (uint32_t rest = length - expected; rest > 0; rest--) {
+        if (getc(in) == EOF)
+            return -1;
+    }
+    return (int)count;
+}
+
+static inline void mp_write_batch(FILE *out, const uint32_t *ids, const mp_output *outputs, int count)
+{
+    uint32_t n = (uint32_t)count;
+    uint32_t length = sizeof n + n * (sizeof *ids + sizeof *outputs);
+    fwrite(&length, sizeof length, 1, out);
+    fwrite(&n, sizeof n, 1, out);
+    for (int i = 0; i < count; i++) {
+        fwrite(&ids[i], sizeof *ids, 1, out);
+        fwrite(&outputs[i], sizeof *outputs, 1, out);
+    }
+    fflush(out);
+}
+
+#endif
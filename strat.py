@@ -1,5 +1,6 @@
 import sys
 import math
+import os
 print("start", file=sys.stderr, flush=True)
 # Auto-generated code below aims at helping you parse
 # the standard input according to the problem statement.
@@ -8,6 +9,12 @@ def s(x):
     x = max(0, min(1, x))
     return 3*x*x-2*x*x*x
 
+# tunable through the environment, see mad-pod-cmd optimize
+DIST_SCALE = float(os.environ.get('MAD_POD_DIST_SCALE', 0.00025))
+ANGLE_SCALE = float(os.environ.get('MAD_POD_ANGLE_SCALE', 0.015))
+BOOST_ANGLE = float(os.environ.get('MAD_POD_BOOST_ANGLE', 10))
+BOOST_DIST = float(os.environ.get('MAD_POD_BOOST_DIST', 5000))
+
 boost_used = False
 while True:
     # next_checkpoint_x: x position of the next check point
@@ -25,11 +32,11 @@ while True:
     # followed by the power (0 <= thrust <= 100)
     # i.e.: "x y thrust"
 
-    thrust_dist = s(next_checkpoint_dist * 0.00025)
-    thrust_angle = s((90 - abs(next_checkpoint_angle)) * 0.015)
+    thrust_dist = s(next_checkpoint_dist * DIST_SCALE)
+    thrust_angle = s((90 - abs(next_checkpoint_angle)) * ANGLE_SCALE)
     thrust = int(100 * thrust_dist * thrust_angle)
 
-    use_boost = not boost_used and abs(next_checkpoint_angle) < 10 and next_checkpoint_dist >= 5000
+    use_boost = not boost_used and abs(next_checkpoint_angle) < BOOST_ANGLE and next_checkpoint_dist >= BOOST_DIST
     if use_boost:
         boost_used = True
 